@@ -8,7 +8,27 @@
 
 #TODOs
 #add support for all RV32I assembly directives
-#add support for pseudo-instructions
+
+import argparse
+import collections
+import concurrent.futures
+import functools
+import glob
+import itertools
+import os
+import re
+import struct
+import sys
+from array import array
+
+import riscv_build_cache
+import riscv_debug_map
+import riscv_image_formats
+import riscv_object
+
+#Version of the generated machine code, it is part of the build cache key so it
+#must be increased whenever a change of the assembler alters its output
+ASSEMBLER_VERSION = '2.3'
 
 # RISC-V opcode dictionary
 opc = {
@@ -96,7 +116,8 @@ function3 = {
    'or'    :  '110',    'OR'    :  '110',
    'and'   :  '111',    'AND'   :  '111',
    'beq'   :  '000',    'BEQ'   :  '000',
-   'bne'   :  '001',    'BNE'   :  '001'
+   'bne'   :  '001',    'BNE'   :  '001',
+   'jalr'  :  '000',    'JALR'  :  '000'
 }
 
 # I-Type/R-type Instruction Funct7 dictionary
@@ -185,6 +206,160 @@ sfr_map = {
 }
 
 
+# Pseudo-instructions with a fixed expansion: mnemonic -> (operand format, instructions)
+#li (load immediate) and la (load address) are expanded by expand_pseudo() into the
+#shortest sequence for their value. call is a single jal, it reaches the whole 64KB PFM
+pseudo_instructions = {
+   'nop'   : ('',   ['addi zero, zero, 0']),      #no operation
+   'mv'    : ('rr', ['addi {0}, {1}, 0']),        #copy register
+   'not'   : ('rr', ['xori {0}, {1}, -1']),       #one's complement
+   'neg'   : ('rr', ['sub {0}, zero, {1}']),      #two's complement
+   'j'     : ('t',  ['jal zero, {0}']),           #jump
+   'jr'    : ('r',  ['jalr zero, {0}, 0']),       #jump register
+   'ret'   : ('',   ['jalr zero, ra, 0']),        #return from subroutine
+   'call'  : ('t',  ['jal ra, {0}']),             #call subroutine
+   'beqz'  : ('rt', ['beq {0}, zero, {1}']),      #branch if equal to zero
+   'bnez'  : ('rt', ['bne {0}, zero, {1}'])       #branch if not equal to zero
+}
+
+# Inverted condition of the branches, an out of range branch is replaced by the inverted
+#branch over a jal to the target
+inverse_branch = {
+   'beq'   : 'bne',   'BEQ'   : 'BNE',
+   'bne'   : 'beq',   'BNE'   : 'BEQ'
+}
+
+#Byte offsets reached by a B-Type (13 bit) and a J-Type (21 bit) instruction
+BRANCH_RANGE = (-(1 << 12), (1 << 12) - 2)
+JUMP_RANGE   = (-(1 << 20), (1 << 20) - 2)
+#Shift amounts of slli/srli/srai (the upper bits of the immediate field are funct7)
+SHIFT_RANGE  = (0, 31)
+
+
+# Integer encoding tables
+#The string tables above stay the reference description of the ISA, these integer
+#versions are derived once at load time and used by the build_*type_instr functions
+#to pack the instruction fields with shifts and masks
+opc_int       = {mnemonic: int(code, 2) for mnemonic, code in opc.items()}
+function3_int = {mnemonic: int(code, 2) for mnemonic, code in function3.items()}
+function7_int = {mnemonic: int(code, 2) for mnemonic, code in function7.items()}
+register_int  = {reg: int(code, 2) for reg, code in register_map.items()}
+
+
+# Lexer
+#A source line is [label:] [mnemonic/directive [operands]] [comment], one match of the
+#precompiled STATEMENT_RE splits it (instruction is the mnemonic with its operands). The
+#operands end at the comment ('/' alone is an operand character, '//' starts a comment)
+STATEMENT_RE = re.compile(r'''
+    [ \t]*(?:(?P<label>[A-Za-z_.$][\w.$]*)[ \t]*:)?
+    [ \t]*(?P<instruction>(?P<mnemonic>\.?[A-Za-z_][\w.]*)
+        (?:[ \t]+(?P<operands>[^\s\#/][^\#/]*(?:/(?!/)[^\#/]*)*(?<!\s)))?)?
+    [ \t]*(?:(?:\#|//).*)?$''', re.VERBOSE)
+
+#Memory operand offset(base) of lw/sw
+MEMORY_RE = re.compile(r'([^\s()]+)\(([^\s()]+)\)')
+
+#An operand of tokenize(): string, %hi/%lo(symbol), or a value with an optional (base)
+OPERAND_RE = re.compile(r'("[^"]*"|%(?:hi|lo)\([^\s,()]+\)|[^\s,()"]+)(?:\(([^\s,()]+)\))?')
+
+#Operands of every instruction format: r = register, i = immediate (number, SFR name or
+#symbol), m = memory operand offset(base), t = branch/jump target (label or offset),
+#s = symbol
+operand_format = {'R': 'rrr', 'I': 'rri', 'S': 'rm', 'B': 'rrt', 'U': 'ri', 'J': 'rt'}
+pseudo_format  = {mnemonic: operands for mnemonic, (operands, _) in pseudo_instructions.items()}
+pseudo_format.update({'li': 'ri', 'la': 'rs'})
+
+#Lexical token of a source line, line and column start at 1
+Token = collections.namedtuple('Token', 'kind text line column')
+
+#Name of a source in the error messages when it does not come from a file
+SOURCE_NAME = '<source>'
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: SourceError                                                                 |#
+#| Description: Error of an assembly source. token is the text the error refers to,   |#
+#|    field is the index of the instruction token it is in (0 for the mnemonic, 1 for |#
+#|    the first operand, negative from the last operand) and offset its position in   |#
+#|    that token (the base register of a memory operand). location is (name, line,    |#
+#|    column) once locate_error() placed it in the source                             |#
+#+------------------------------------------------------------------------------------+#
+class SourceError(ValueError):
+    def __init__(self, message, token=None, field=None, offset=0, location=None):
+        super().__init__(message)
+        self.token = token
+        self.field = field
+        self.offset = offset
+        self.location = location
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: tokenize(string, int)                                                    |#
+#| Description: Splits a source line into typed tokens: 'label', 'directive',         |#
+#|    'mnemonic', 'operand' and 'base' (register of a memory operand). The comment is |#
+#|    not a token                                                                     |#
+#| Input:                                                                             |#
+#|    string - a line of an assembly file                                             |#
+#|    int - the line number                                                           |#
+#| Output:                                                                            |#
+#|    list - the Token of the line                                                    |#
+#+------------------------------------------------------------------------------------+#
+def tokenize(line, line_number=0):
+    match = STATEMENT_RE.match(line)
+    if match is None:
+        raise SourceError("Syntax Error! Invalid statement!", line.strip())
+    tokens = []
+    label, mnemonic = match.group('label', 'mnemonic')
+    if label is not None:
+        tokens.append(Token('label', label, line_number, match.start('label') + 1))
+    if mnemonic is not None:
+        kind = 'directive' if mnemonic.startswith('.') else 'mnemonic'
+        tokens.append(Token(kind, mnemonic, line_number, match.start('mnemonic') + 1))
+    if match.group('operands'):
+        for operand in OPERAND_RE.finditer(line, match.start('operands'), match.end('operands')):
+            tokens.append(Token('operand', operand.group(1), line_number, operand.start(1) + 1))
+            if operand.group(2) is not None:
+                tokens.append(Token('base', operand.group(2), line_number, operand.start(2) + 1))
+    return tokens
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: locate_error(ValueError, string, int, string)                            |#
+#| Description: Returns the error prefixed with its location "name:line:column". The  |#
+#|    column is the one of the instruction token (field) of a SourceError, the first  |#
+#|    token with its text if it has no field (label, directive, data) or if the field |#
+#|    is of a pseudo-instruction expansion, else the first character of the statement |#
+#|    (no column if the line is not known)                                            |#
+#| Input:                                                                             |#
+#|    ValueError - the error                                                          |#
+#|    string - the name of the source (file path)                                     |#
+#|    int - the line number                                                           |#
+#|    string - the source line (None if not known)                                    |#
+#| Output:                                                                            |#
+#|    SourceError - the located error                                                 |#
+#+------------------------------------------------------------------------------------+#
+def locate_error(err, name, line_number, line=None):
+    token, field = getattr(err, 'token', None), getattr(err, 'field', None)
+    if line is None:
+        return SourceError(f"{name}:{line_number}: {err}", token, field, location=(name, line_number, None))
+    column = len(line) - len(line.lstrip()) + 1
+    try:
+        tokens = tokenize(line, line_number)
+    except SourceError:
+        tokens = []
+    fields = [tok for tok in tokens if tok.kind in ('mnemonic', 'operand')]
+    if field is not None and -len(fields) <= field < len(fields) and \
+       line.startswith(token or fields[field].text, fields[field].column - 1 + err.offset):
+        column = fields[field].column + err.offset
+    elif token is not None:
+        columns = [tok.column for tok in tokens if tok.text == token]
+        if columns:
+            column = columns[0]
+        elif token in line:
+            column = line.index(token) + 1
+    return SourceError(f"{name}:{line_number}:{column}: {err}", token, field, location=(name, line_number, column))
+
+
 #+------------------------------------------------------------------------------------+#
 #| Function: bin2hex_32bit(string)                                                    |#
 #| Description: This function translates an 32 bit long binary value representeas     |#
@@ -207,6 +382,32 @@ def bin2hex_32bit(bin_str):
     return hex_str
 
 
+#+------------------------------------------------------------------------------------+#
+#| Function: word2bin_32bit(int)                                                      |#
+#| Description: This function formats a 32 bit machine word as the binary string      |#
+#|    written in the .bin memory files                                                |#
+#| Input:                                                                             |#
+#|    int - a 32bit machine word                                                      |#
+#| Output:                                                                            |#
+#|    string - the 32bit binary number represented as a string                        |#
+#+------------------------------------------------------------------------------------+#
+def word2bin_32bit(word):
+    return format(word, '032b')
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: word2hex_32bit(int)                                                      |#
+#| Description: This function formats a 32 bit machine word as the hexadecimal string |#
+#|    with the '0x' prefix written in the .hex memory files                           |#
+#| Input:                                                                             |#
+#|    int - a 32bit machine word                                                      |#
+#| Output:                                                                            |#
+#|    string - the 32bit hexadecimal number represented as a string with '0x' prefix  |#
+#+------------------------------------------------------------------------------------+#
+def word2hex_32bit(word):
+    return '0x' + format(word, '08x')
+
+
 #+------------------------------------------------------------------------------------+#
 #| Function: strval2strbin(string,int)                                                |#
 #| Description: This function computes an input string that is either a value         |#
@@ -250,6 +451,52 @@ def strval2strbin(val_str,length):
         raise ValueError(f"Assemble Error! Value {dec_val} cannot fit in {length} bits length!")
 
     return bin_str
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: parse_value(string)                                                      |#
+#| Description: Returns the integer value of a decimal/hexadecimal number or of an    |#
+#|    SFR name (ValueError if the string is neither)                                  |#
+#+------------------------------------------------------------------------------------+#
+def parse_value(val_str):
+    #Remove the "`" that can be used as a prefix for x or h in hexadecimal
+    value = val_str.replace("'", "")
+
+    #Test if the value is an SFR name and replace the name with the hex value
+    if value in sfr_map:
+        value = sfr_map[value]
+
+    #Test if the value is in hexadecimal and convert it based on its representation
+    try:
+        if value.startswith('0x') or value.startswith('0h'):
+            return int(value[2:], 16)
+        if value.startswith('x') or value.startswith('h'):
+            return int(value[1:], 16)
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Syntax Error! Invalid number '{val_str}'!") from None
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: strval2int(string,int)                                                   |#
+#| Description: This function computes an input string that is either a value         |#
+#|    represented in decimal or in hexadecimal (or an SFR name) and returns the value  |#
+#|    as an integer truncated to the field length specified as an int argument.       |#
+#|    Negative values are accepted if they fit the field in two's complement.         |#
+#| Input:                                                                             |#
+#|    string - a decimal/hexadecimal number represented as a string (or an int)       |#
+#|    int - the length in bits of the instruction field                               |#
+#| Output:                                                                            |#
+#|    int - the value of the field as an unsigned integer of the specified length     |#
+#+------------------------------------------------------------------------------------+#
+def strval2int(val_str, length):
+    dec_val = val_str if isinstance(val_str, int) else parse_value(val_str)
+
+    #Test is the value can be represented on the specified number of bits
+    if dec_val >= (1 << length) or dec_val < -(1 << (length-1)):
+        raise ValueError(f"Assemble Error! Value {dec_val} cannot fit in {length} bits length!")
+
+    return dec_val & ((1 << length) - 1)
      
 
 #+------------------------------------------------------------------------------------+#
@@ -274,250 +521,947 @@ def compute_signed_Nbit_ta(N, PC_current, target_addr):
     return hex(value)
 
 
+#Length of the immediate field of every instruction type
+IMMEDIATE_LENGTH = {'I': 12, 'S': 12, 'B': 13, 'U': 32, 'J': 21}
+
+#mnemonic -> (instruction type, operand format, opcode/funct3/funct7 bits of the word)
+mnemonic_format = {mnemonic: (instr_type, 'rm' if mnemonic.lower() == 'lw' else operand_format[instr_type],
+                              (function7_int.get(mnemonic, 0) << 25) | (function3_int.get(mnemonic, 0) << 12) |
+                              opc_int[mnemonic])
+                   for mnemonic, instr_type in instrcution_type.items()}
+mnemonic_format.update({mnemonic: ('P', operands, None) for mnemonic, operands in pseudo_format.items()})
+
+#I-Type shifts, their funct7 bits are the upper bits of the immediate field
+shift_mnemonics = {mnemonic for mnemonic in function7_int if instrcution_type[mnemonic] == 'I'}
+
+#Position in the machine word of the register operands of every instruction type (the
+#first operand of a store/branch is the rs2 field, the base of a memory operand is rs1)
+register_shifts = {'R': (7, 15, 20), 'I': (7, 15), 'S': (20, 15), 'B': (20, 15), 'U': (7,), 'J': (7,), 'P': ()}
+
+
 #+------------------------------------------------------------------------------------+#
-#| Function: build_Rtype_instr(string)                                                |#
-#| Description: This function computes the input string represented by an assembly    |#
-#|    menmonic and build the specific R-Type binary instruction for a RISC-V 32bit    |#
-#|    microcontroller                                                                 |#
+#| Class: Instruction                                                                 |#
+#| Description: An instruction parsed once and shared by the passes. The registers    |#
+#|    and a literal immediate are already placed in the machine word, an operand that |#
+#|    names a symbol is resolved by encode_instruction() once the symbol table is     |#
+#|    known                                                                           |#
+#| Attributes:                                                                        |#
+#|    mnemonic - the mnemonic as written                                              |#
+#|    type - the instruction type ('R', 'I', 'S', 'B', 'U', 'J', 'P' for pseudo)      |#
+#|    operands - the operand texts                                                    |#
+#|    imm - the literal immediate/offset (None if there is none or it is symbolic)    |#
+#|    symbol - the symbolic immediate/offset/target (label, data variable, SFR name)  |#
+#|    word - the machine word without the symbolic field (None for pseudo)            |#
+#|    rd, rs1, rs2 - the register fields of the machine word                          |#
+#+------------------------------------------------------------------------------------+#
+class Instruction:
+    __slots__ = ('mnemonic', 'type', 'operands', 'imm', 'symbol', 'word')
+
+    def __init__(self, mnemonic, instr_type, operands, imm, symbol, word):
+        self.mnemonic = mnemonic
+        self.type = instr_type
+        self.operands = operands
+        self.imm = imm
+        self.symbol = symbol
+        self.word = word
+
+    @property
+    def rd(self):
+        return (self.word >> 7) & 0x1F
+
+    @property
+    def rs1(self):
+        return (self.word >> 15) & 0x1F
+
+    @property
+    def rs2(self):
+        return (self.word >> 20) & 0x1F
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: immediate(int, dict)                                                 |#
+    #| Description: Returns the immediate field as an unsigned value of the field     |#
+    #|    length. A symbol of the symbol table comes first (not for U-Type), the      |#
+    #|    offset of a branch/jump to a label is relative to the current PC, otherwise |#
+    #|    the symbol is an SFR name or an x/h hexadecimal number                      |#
+    #+--------------------------------------------------------------------------------+#
+    def immediate(self, current_PC, symbol_table):
+        symbol, instr_type = self.symbol, self.type
+        length = IMMEDIATE_LENGTH[instr_type]
+        if symbol is None:
+            value, symbol = self.imm, str(self.imm)
+        elif instr_type != 'U' and symbol in symbol_table:
+            value = symbol_table[symbol]
+            if instr_type in ('B', 'J'):
+                offset = check_target_range(symbol, value - current_PC, BRANCH_RANGE if instr_type == 'B' else JUMP_RANGE)
+                return offset & ((1 << length) - 1)
+        else:
+            try:
+                value = parse_value(symbol)
+            except ValueError:
+                kind = 'Label' if instr_type in ('B', 'J') else 'Symbol'
+                raise SourceError(f"Assemble Error! {kind} '{symbol}' is not defined!", symbol, -1) from None
+        if self.mnemonic in shift_mnemonics:
+            check_shift_amount(value, symbol)
+        try:
+            return strval2int(value, length)
+        except ValueError as err:
+            raise SourceError(str(err), symbol, -1) from None
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: parse_fields(string, tuple)                                              |#
+#| Description: Checks the operands of an instruction against its format and parses   |#
+#|    its fields. The registers and a literal immediate are placed in the machine     |#
+#|    word, a symbolic immediate/offset/target is resolved once the symbol table is   |#
+#|    known                                                                           |#
+#| Input:                                                                             |#
+#|    string - the mnemonic                                                           |#
+#|    tuple - the operand texts                                                       |#
+#| Output:                                                                            |#
+#|    tuple - (instruction type, literal immediate, symbol, machine word) as in the   |#
+#|            Instruction                                                             |#
+#+------------------------------------------------------------------------------------+#
+def parse_fields(mnemonic, operands):
+    info = mnemonic_format.get(mnemonic)
+    if info is None:
+        #The pseudo-instructions are accepted in any case
+        info = mnemonic_format.get(mnemonic.lower())
+        if info is None or info[0] != 'P':
+            raise SourceError(f"Syntax Error! Unsupported RV32I instruction '{mnemonic}'!", mnemonic, 0)
+    instr_type, formats, word = info
+    if len(operands) != len(formats):
+        raise SourceError(f"Syntax Error! '{mnemonic}' expects {len(formats)} operand(s)!", mnemonic, 0)
+
+    #Registers (the pseudo-instructions only check them)
+    value = None
+    try:
+        if word is None:
+            for kind, operand in zip(formats, operands):
+                if kind == 'r':
+                    register_int[operand]
+                else:
+                    value = operand
+        elif formats == 'rm':
+            memory = MEMORY_RE.fullmatch(operands[1])
+            if memory is None:
+                raise SourceError(f"Syntax Error! Invalid memory operand '{operands[1]}', expected offset(register)!",
+                                  operands[1], 2)
+            value, base = memory.groups()
+            word |= (register_int[operands[0]] << register_shifts[instr_type][0]) | (register_int[base] << 15)
+        elif formats == 'rrr':
+            word |= (register_int[operands[0]] << 7) | (register_int[operands[1]] << 15) | \
+                    (register_int[operands[2]] << 20)
+        elif len(formats) == 3:
+            shifts = register_shifts[instr_type]
+            word |= (register_int[operands[0]] << shifts[0]) | (register_int[operands[1]] << shifts[1])
+            value = operands[2]
+        else:
+            word |= register_int[operands[0]] << 7
+            value = operands[1]
+    except KeyError as err:
+        register = err.args[0]
+        if register in operands:
+            raise SourceError(f"Syntax Error! Invalid register '{register}'!", register,
+                              operands.index(register) + 1) from None
+        #Base of the memory operand
+        raise SourceError(f"Syntax Error! Invalid register '{register}'!", register, 2,
+                          operands[1].index('(') + 1) from None
+
+    #Immediate/offset/target: a number is placed in the word now, a symbol when it is known
+    imm = symbol = None
+    if value is None:
+        pass
+    elif value[0] in '+-0123456789':
+        try:
+            imm = int(value, 0)
+        except ValueError:
+            try:
+                imm = parse_value(value)
+            except ValueError:
+                raise SourceError(f"Syntax Error! Invalid number '{value}'!", value, -1) from None
+        if word is not None:
+            if mnemonic in shift_mnemonics:
+                check_shift_amount(imm, value)
+            length = IMMEDIATE_LENGTH[instr_type]
+            if imm >= (1 << length) or imm < -(1 << (length-1)):
+                raise SourceError(f"Assemble Error! Value {imm} cannot fit in {length} bits length!", value, -1)
+            word |= place_immediate(instr_type, imm & ((1 << length) - 1))
+    else:
+        symbol = value
+    return instr_type, imm, symbol, word
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: parse_operands(string, tuple)                                            |#
+#| Description: Checks the operands of an instruction against its format and returns  |#
+#|    the parsed Instruction                                                          |#
+#| Input:                                                                             |#
+#|    string - the mnemonic                                                           |#
+#|    tuple - the operand texts                                                       |#
+#| Output:                                                                            |#
+#|    Instruction - the parsed instruction                                            |#
+#+------------------------------------------------------------------------------------+#
+def parse_operands(mnemonic, operands):
+    instr_type, imm, symbol, word = parse_fields(mnemonic, operands)
+    return Instruction(mnemonic, instr_type, operands, imm, symbol, word)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: split_instruction(string)                                                |#
+#| Description: Splits the text of an instruction, the instruction of a statement     |#
+#|    lexed by STATEMENT_RE: the mnemonic and the operands separated by commas and/or |#
+#|    spaces                                                                          |#
+#| Output:                                                                            |#
+#|    tuple - (mnemonic, tuple of the operand texts)                                  |#
+#+------------------------------------------------------------------------------------+#
+def split_instruction(line):
+    fields = line.replace(",", " ").split()
+    if not fields:
+        raise SourceError(f"Syntax Error! Invalid instruction '{line}'!")
+    return fields[0], tuple(fields[1:])
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: parse_instruction(string)                                                |#
+#| Description: Parses the text of an instruction (or pseudo-instruction)             |#
 #| Input:                                                                             |#
-#|    string - an RISC-V assembly mnemonic (RV32I)                                    |#
+#|    string - an assembly instruction                                                |#
 #| Output:                                                                            |#
-#|    string - a binary instruction coded as a R-Type instruction for RISC-V 32bit    |#
+#|    Instruction - the parsed instruction                                            |#
+#+------------------------------------------------------------------------------------+#
+def parse_instruction(line):
+    mnemonic, operands = split_instruction(line)
+    return parse_operands(mnemonic, operands)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: to_instruction(string/Instruction)                                       |#
+#| Description: Returns the Instruction of an instruction given as text or already    |#
+#|    parsed (the pseudo-instructions and branches parsed by the first pass are       |#
+#|    handed on to relax() and the peephole optimizer)                                |#
+#+------------------------------------------------------------------------------------+#
+def to_instruction(line):
+    return line if isinstance(line, Instruction) else parse_instruction(line)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: place_immediate(string, int)                                             |#
+#| Description: Places the immediate field of an instruction type in the machine word |#
+#| Input:                                                                             |#
+#|    string - the instruction type                                                   |#
+#|    int - the immediate as an unsigned value of the field length                    |#
+#| Output:                                                                            |#
+#|    int - the immediate bits of the machine word                                    |#
+#+------------------------------------------------------------------------------------+#
+def place_immediate(instr_type, imm):
+    if instr_type == 'I':
+        return imm << 20
+    if instr_type == 'S':
+        #imm[11:5] (bits 31:25) and imm[4:0] (bits 11:7)
+        return ((imm >> 5) << 25) | ((imm & 0x1F) << 7)
+    if instr_type == 'B':
+        return Btype_immediate(imm)
+    if instr_type == 'U':
+        return imm & 0xFFFFF000
+    return Jtype_immediate(imm)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: encode_instruction(Instruction, int, dict)                               |#
+#| Description: Returns the machine word of a parsed instruction, the symbolic        |#
+#|    operand (if any) is resolved with the symbol table                              |#
+#| Input:                                                                             |#
+#|    Instruction - the parsed instruction                                            |#
+#|    int - current PC address to be used for branch/jump instructions                |#
+#|    dictionary - the symbol table (labels and data variables)                       |#
+#| Output:                                                                            |#
+#|    int - the 32bit machine code of the instruction                                 |#
+#+------------------------------------------------------------------------------------+#
+def encode_instruction(instr, current_PC, symbol_table):
+    if instr.word is None:
+        raise SourceError(f"Syntax Error! '{instr.mnemonic}' is a pseudo-instruction, it must be expanded!",
+                          instr.mnemonic, 0)
+    if instr.symbol is None:
+        return instr.word
+    return instr.word | place_immediate(instr.type, instr.immediate(current_PC, symbol_table))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: build_Rtype_instr(list)                                                  |#
+#| Description: This function computes the assembly menmonic given as a list of       |#
+#|    tokens (mnemonic and operands) and build the specific R-Type binary instruction |#
+#|    for a RISC-V 32bit microcontroller                                              |#
+#| Input:                                                                             |#
+#|    list - an RISC-V assembly mnemonic (RV32I) split in tokens                      |#
+#| Output:                                                                            |#
+#|    int - a 32bit instruction coded as a R-Type instruction for RISC-V 32bit        |#
 #+------------------------------------------------------------------------------------+#
 def build_Rtype_instr(instr_line):
-    op       = opc[instr_line[0]]
-    rd       = register_map[instr_line[1]]
-    funct3   = function3[instr_line[0]]
-    rs1      = register_map[instr_line[2]]
-    rs2      = register_map[instr_line[3]]
-    funct7   = function7[instr_line[0]]
-    
-    rtype_instr =  funct7 + rs2 + rs1 + funct3 + rd + op
-    return rtype_instr
+    return encode_instruction(parse_operands(instr_line[0], tuple(instr_line[1:])), 0, {})
 
 
 #+------------------------------------------------------------------------------------+#
-#| Function: build_Itype_instr(string)                                                |#
-#| Description: This function computes the input string represented by an assembly    |#
-#|    menmonic and build the specific I-Type binary instruction for a RISC-V 32bit    |#
-#|    microcontroller                                                                 |#
+#| Function: build_Itype_instr(list, dict)                                            |#
+#| Description: This function computes the assembly menmonic given as a list of       |#
+#|    tokens and build the specific I-Type binary instruction for a RISC-V 32bit      |#
+#|    microcontroller (the operand of a load is offset(register))                     |#
 #| Input:                                                                             |#
-#|    string - an RISC-V assembly mnemonic (RV32I)                                    |#
+#|    list - an RISC-V assembly mnemonic (RV32I) split in tokens                      |#
+#|    dictionary - the symbol table (labels and data variables)                       |#
 #| Output:                                                                            |#
-#|    string - a binary instruction coded as a I-Type instruction for RISC-V 32bit    |#
+#|    int - a 32bit instruction coded as a I-Type instruction for RISC-V 32bit        |#
 #+------------------------------------------------------------------------------------+#
-def build_Itype_instr(instr_line):
-    immediate_field_length = 12
-    
-    #EXCEPTION for load operations
-    #This ['lw', 'x6', '0(x7)'] should become this ['lw', 'x6', 'x7', '0'] for easier processing
-    if instr_line[0].startswith('l') or instr_line[0].startswith('L'):
-        instr_line[2] = instr_line[2].replace(")", "")  #removing last ")"
-        instr_line[2] = instr_line[2].split(sep='(')    #splitting third element in 2 elemnts
-        instr_line = [instr_line[0],instr_line[1],instr_line[2][1],instr_line[2][0]] #reorder the elements in the initial string
-    
-    #Verify if the immediate field is in the symbol_table
-    if instr_line[3] in symbol_table:
-        #Store address was calculated based on an offset provided by gp register
-        instr_line[3] = symbol_table[instr_line[3]]
-
-    op        = opc[instr_line[0]]
-    rd        = register_map[instr_line[1]]
-    funct3    = function3[instr_line[0]]
-    rs1       = register_map[instr_line[2]]
-    imm_11_0  = strval2strbin(instr_line[3],immediate_field_length)
-    
-    itype_instr =  imm_11_0 + rs1 + funct3 + rd + op
-    return itype_instr
+def build_Itype_instr(instr_line, symbol_table):
+    return encode_instruction(parse_operands(instr_line[0], tuple(instr_line[1:])), 0, symbol_table)
 
 
 #+------------------------------------------------------------------------------------+#
-#| Function: build_Stype_instr(string)                                                |#
-#| Description: This function computes the input string represented by an assembly    |#
-#|    menmonic and build the specific S-Type binary instruction for a RISC-V 32bit    |#
+#| Function: build_Stype_instr(list, dict)                                            |#
+#| Description: This function computes the assembly menmonic given as a list of       |#
+#|    tokens and build the specific S-Type binary instruction for a RISC-V 32bit      |#
 #|    microcontroller                                                                 |#
 #| Input:                                                                             |#
-#|    string - an RISC-V assembly mnemonic (RV32I)                                    |#
+#|    list - an RISC-V assembly mnemonic (RV32I) split in tokens                      |#
+#|    dictionary - the symbol table (labels and data variables)                       |#
 #| Output:                                                                            |#
-#|    string - a binary instruction coded as a S-Type instruction for RISC-V 32bit    |#
+#|    int - a 32bit instruction coded as a S-Type instruction for RISC-V 32bit        |#
 #+------------------------------------------------------------------------------------+#
-def build_Stype_instr(instr_line):
-    immediate_field_length = 12
-    
-    #This ['sw', 'x6', '0(x7)'] should become this ['sw', 'x6', 'x7', '0'] for easier processing
-    instr_line[2] = instr_line[2].replace(")", "")  #removing last ")"
-    instr_line[2] = instr_line[2].split(sep='(')    #splitting third element in 2 elemnts
-    instr_line = [instr_line[0],instr_line[1],instr_line[2][1],instr_line[2][0]] #reorder the elements in the initial string
-    
-    #Verify if the immediate field is in the symbol_table
-    if instr_line[3] in symbol_table:
-        #Store address was calculated based on an offset provided by gp register
-        instr_line[3] = symbol_table[instr_line[3]]
-
-    #Compute the entire immediate value into one string
-    imm_11_0  = strval2strbin(instr_line[3],immediate_field_length)
-    #Calculate the index for splitting the LSB and MSB from the 12 bit immediate value
-    split_index = immediate_field_length-1-4
-    
-    op        = opc[instr_line[0]]
-    imm_4_0   = imm_11_0[split_index:] #5LSbits of the 12 bit immediate are at the end of the string
-    funct3    = function3[instr_line[0]]
-    rs1       = register_map[instr_line[2]]
-    rs2       = register_map[instr_line[1]]
-    imm_11_5  = imm_11_0[:split_index] #7MSbits of the 12 bit immediate are at the start of the string
-    
-    stype_instr =  imm_11_5 + rs2 + rs1 + funct3 + imm_4_0 + op
-    return stype_instr
+def build_Stype_instr(instr_line, symbol_table):
+    return encode_instruction(parse_operands(instr_line[0], tuple(instr_line[1:])), 0, symbol_table)
 
 
 #+------------------------------------------------------------------------------------+#
-#| Function: build_Btype_instr(string)                                                |#
-#| Description: This function computes the input string represented by an assembly    |#
-#|    menmonic and build the specific B-Type binary instruction for a RISC-V 32bit    |#
+#| Function: build_Btype_instr(list, int, dict)                                       |#
+#| Description: This function computes the assembly menmonic given as a list of       |#
+#|    tokens and build the specific B-Type binary instruction for a RISC-V 32bit      |#
 #|    microcontroller                                                                 |#
 #| Input:                                                                             |#
-#|    string - an RISC-V assembly mnemonic (RV32I)                                    |#
+#|    list - an RISC-V assembly mnemonic (RV32I) split in tokens                      |#
 #|    int - current PC address                                                        |#
+#|    dictionary - the symbol table (labels and data variables)                       |#
 #| Output:                                                                            |#
-#|    string - a binary instruction coded as a B-Type instruction for RISC-V 32bit    |#
+#|    int - a 32bit instruction coded as a B-Type instruction for RISC-V 32bit        |#
 #+------------------------------------------------------------------------------------+#
-def build_Btype_instr(instr_line, current_PC):
-    immediate_field_length = 13
-    
-    #if the instruction contains a label, swap the label with the PC address
-    if(instr_line[3] in symbol_table):
-        #branch address is relative to the current PC
-        instr_line[3] = compute_signed_Nbit_ta(immediate_field_length, current_PC, symbol_table[instr_line[3]])
-    
-    imm_12_0  = strval2strbin(instr_line[3],immediate_field_length)
-    
-    op        = opc[instr_line[0]]
-    imm_11    = imm_12_0[(immediate_field_length-1)-11]
-    imm_4_1   = imm_12_0[(immediate_field_length-1)-4:(immediate_field_length-1)] 
-    funct3    = function3[instr_line[0]]
-    rs1       = register_map[instr_line[2]]
-    rs2       = register_map[instr_line[1]]
-    imm_10_5  = imm_12_0[(immediate_field_length-1)-10:(immediate_field_length-5)]
-    imm_12    = imm_12_0[(immediate_field_length-1)-12]
+def build_Btype_instr(instr_line, current_PC, symbol_table):
+    return encode_instruction(parse_operands(instr_line[0], tuple(instr_line[1:])), current_PC, symbol_table)
 
-    btype_instr = imm_12 + imm_10_5 + rs2 + rs1 + funct3 + imm_4_1 + imm_11 + op
-    return btype_instr
+
+#+------------------------------------------------------------------------------------+#
+#| Function: Btype_immediate(int)                                                     |#
+#| Description: Places the 13 bit branch offset in the B-Type instruction fields      |#
+#|    imm[12|10:5] (bits 31:25) and imm[4:1|11] (bits 11:7)                           |#
+#+------------------------------------------------------------------------------------+#
+def Btype_immediate(imm_12_0):
+    imm_11    = (imm_12_0 >> 11) & 0x1
+    imm_4_1   = (imm_12_0 >> 1)  & 0xF
+    imm_10_5  = (imm_12_0 >> 5)  & 0x3F
+    imm_12    = (imm_12_0 >> 12) & 0x1
+    return (imm_12 << 31) | (imm_10_5 << 25) | (imm_4_1 << 8) | (imm_11 << 7)
 
 
 #+------------------------------------------------------------------------------------+#
-#| Function: build_Utype_instr(string)                                                |#
-#| Description: This function computes the input string represented by an assembly    |#
-#|    menmonic and build the specific U-Type binary instruction for a RISC-V 32bit    |#
+#| Function: check_target_range(string, int, tuple)                                   |#
+#| Description: Raises an error if a branch/jump offset is outside the range of the   |#
+#|    immediate field (instead of encoding the truncated offset)                      |#
+#| Output:                                                                            |#
+#|    int - the offset                                                                |#
+#+------------------------------------------------------------------------------------+#
+def check_target_range(label, offset, target_range):
+    if not target_range[0] <= offset <= target_range[1]:
+        raise SourceError(f"Assemble Error! Label '{label}' is out of range ({offset} bytes from the instruction)!",
+                          label, -1)
+    return offset
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: check_shift_amount(int, string)                                          |#
+#| Description: Raises an error if the shift amount of slli/srli/srai does not fit in |#
+#|    5 bits (a larger immediate would overwrite the funct7 bits of the word)         |#
+#+------------------------------------------------------------------------------------+#
+def check_shift_amount(value, token):
+    if not SHIFT_RANGE[0] <= value <= SHIFT_RANGE[1]:
+        raise SourceError(f"Assemble Error! Shift amount {value} is out of range {list(SHIFT_RANGE)}!", token, -1)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: build_Utype_instr(list)                                                  |#
+#| Description: This function computes the assembly menmonic given as a list of       |#
+#|    tokens and build the specific U-Type binary instruction for a RISC-V 32bit      |#
 #|    microcontroller                                                                 |#
 #| Input:                                                                             |#
-#|    string - an RISC-V assembly mnemonic (RV32I)                                    |#
+#|    list - an RISC-V assembly mnemonic (RV32I) split in tokens                      |#
 #| Output:                                                                            |#
-#|    string - a binary instruction coded as a U-Type instruction for RISC-V 32bit    |#
+#|    int - a 32bit instruction coded as a U-Type instruction for RISC-V 32bit        |#
 #+------------------------------------------------------------------------------------+#
 def build_Utype_instr(instr_line):
-    immediate_field_length = 32
-    
-    imm_31_0  = strval2strbin(instr_line[2],immediate_field_length)
-    
-    op        = opc[instr_line[0]]
-    rd        = register_map[instr_line[1]]
-    imm_31_12 = imm_31_0[(immediate_field_length-1)-31:(immediate_field_length-12)]
-    
-    utype_instr = imm_31_12 + rd + op
-    return utype_instr
+    return encode_instruction(parse_operands(instr_line[0], tuple(instr_line[1:])), 0, {})
 
 
 #+------------------------------------------------------------------------------------+#
-#| Function: build_Jtype_instr(string)                                                |#
-#| Description: This function computes the input string represented by an assembly    |#
-#|    menmonic and build the specific J-Type binary instruction for a RISC-V 32bit    |#
+#| Function: build_Jtype_instr(list, int, dict)                                       |#
+#| Description: This function computes the assembly menmonic given as a list of       |#
+#|    tokens and build the specific J-Type binary instruction for a RISC-V 32bit      |#
 #|    microcontroller                                                                 |#
 #| Input:                                                                             |#
-#|    string - an RISC-V assembly mnemonic (RV32I)                                    |#
+#|    list - an RISC-V assembly mnemonic (RV32I) split in tokens                      |#
 #|    int - current PC address                                                        |#
+#|    dictionary - the symbol table (labels and data variables)                       |#
 #| Output:                                                                            |#
-#|    string - a binary instruction coded as a J-Type instruction for RISC-V 32bit    |#
+#|    int - a 32bit instruction coded as a J-Type instruction for RISC-V 32bit        |#
 #+------------------------------------------------------------------------------------+#
-def build_Jtype_instr(instr_line, current_PC):
-    immediate_field_length = 21
-    
-    #if the instruction contains a label, swap the label with the PC address
-    if(instr_line[2] in symbol_table):
-        #jump address is relative to the current PC
-        instr_line[2] = compute_signed_Nbit_ta(immediate_field_length, current_PC, symbol_table[instr_line[2]])
-    
-    imm_20_0  = strval2strbin(instr_line[2],immediate_field_length)
-    
-    op        = opc[instr_line[0]]
-    rd        = register_map[instr_line[1]]
-    imm_19_12 = imm_20_0[(immediate_field_length-1)-19:(immediate_field_length-12)]
-    imm_11    = imm_20_0[(immediate_field_length-1)-11]
-    imm_10_1  = imm_20_0[(immediate_field_length-1)-10:(immediate_field_length-1)]
-    imm_20    = imm_20_0[(immediate_field_length-1)-20]
-     
-    jtype_instr = imm_20 + imm_10_1 + imm_11 + imm_19_12 + rd + op
-    return jtype_instr
+def build_Jtype_instr(instr_line, current_PC, symbol_table):
+    return encode_instruction(parse_operands(instr_line[0], tuple(instr_line[1:])), current_PC, symbol_table)
 
 
 #+------------------------------------------------------------------------------------+#
-#| Function: translate_menmonic(string)                                               |#
+#| Function: Jtype_immediate(int)                                                     |#
+#| Description: Places the 21 bit jump offset in the J-Type instruction field         |#
+#|    imm[20|10:1|11|19:12] (bits 31:12)                                              |#
+#+------------------------------------------------------------------------------------+#
+def Jtype_immediate(imm_20_0):
+    imm_19_12 = (imm_20_0 >> 12) & 0xFF
+    imm_11    = (imm_20_0 >> 11) & 0x1
+    imm_10_1  = (imm_20_0 >> 1)  & 0x3FF
+    imm_20    = (imm_20_0 >> 20) & 0x1
+    return (imm_20 << 31) | (imm_10_1 << 21) | (imm_11 << 20) | (imm_19_12 << 12)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: translate_menmonic(string, int, dict)                                    |#
 #| Description: This function computes the input string represented by an assembly    |#
-#|    menmonic and it select base on the instruction type the specific binary encode  |#
-#|    function                                                                        |#
+#|    menmonic and returns its machine code. The word of an instruction without a     |#
+#|    symbolic operand is complete once its fields are parsed, the others are encoded |#
+#|    by encode_instruction()                                                         |#
 #| Input:                                                                             |#
-#|    string - an RISC-V assembly mnemonic (RV32I)                                    |#
+#|    string - an RISC-V assembly mnemonic (RV32I), or its parsed Instruction         |#
 #|    int - current PC address to be used for branch/jump instructions                |#
+#|    dictionary - the symbol table (labels and data variables)                       |#
 #| Output:                                                                            |#
-#|    string - the binary instruction code for the specific assembly mnemonic         |#
+#|    int - the 32bit machine code for the specific assembly mnemonic                 |#
 #+------------------------------------------------------------------------------------+#
-def translate_menmonic(instr_line, current_PC):
-    instr_line = instr_line.replace(",", "")
-    instr_line = instr_line.split()
-    instr_type = instrcution_type[instr_line[0]]
-    
-    if  (instr_type == 'R'):
-        binary_instr = build_Rtype_instr(instr_line)
-    elif(instr_type == 'I'):
-        binary_instr = build_Itype_instr(instr_line)
-    elif(instr_type == 'S'):
-        binary_instr = build_Stype_instr(instr_line)
-    elif(instr_type == 'B'):
-        binary_instr = build_Btype_instr(instr_line, current_PC)
-    elif(instr_type == 'U'):
-        binary_instr = build_Utype_instr(instr_line)
-    elif(instr_type == 'J'):
-        binary_instr = build_Jtype_instr(instr_line, current_PC)
+def translate_menmonic(instr_line, current_PC, symbol_table):
+    if isinstance(instr_line, Instruction):
+        return encode_instruction(instr_line, current_PC, symbol_table)
+    mnemonic, operands = split_instruction(instr_line)
+    instr_type, imm, symbol, word = parse_fields(mnemonic, operands)
+    if symbol is None and word is not None:
+        return word
+    instr = Instruction(mnemonic, instr_type, operands, imm, symbol, word)
+    return encode_instruction(instr, current_PC, symbol_table)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: split_hi_lo(int)                                                         |#
+#| Description: Splits a 32 bit value into the lui upper part and the signed 12 bit   |#
+#|    addi immediate. addi sign extends its immediate, so the upper part is increased |#
+#|    by one when bit 11 of the value is set                                          |#
+#| Output:                                                                            |#
+#|    tuple - (upper 20 bits in place, signed 12 bit immediate)                       |#
+#+------------------------------------------------------------------------------------+#
+def split_hi_lo(value):
+    value &= 0xFFFFFFFF
+    lo = ((value & 0xFFF) ^ 0x800) - 0x800      #12 LSbits as a signed value
+    return (value - lo) & 0xFFFFF000, lo
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: li_sequence(string, int, bool)                                           |#
+#| Description: Returns the shortest instructions that load a 32 bit constant: one    |#
+#|    addi for the values that fit in 12 signed bits, one lui if the 12 LSbits are 0, |#
+#|    lui + addi otherwise                                                            |#
+#| Input:                                                                             |#
+#|    string - the destination register                                               |#
+#|    int - the value                                                                 |#
+#|    bool - always use the lui + addi pair (fixed size sequence)                     |#
+#| Output:                                                                            |#
+#|    list - the assembly instructions                                                |#
+#+------------------------------------------------------------------------------------+#
+def li_sequence(rd, value, long_form=False):
+    hi, lo = split_hi_lo(value)
+    if not long_form:
+        if hi == 0:
+            return [f'addi {rd}, zero, {lo}']
+        if lo == 0:
+            return [f'lui {rd}, {hex(hi)}']
+    return [f'lui {rd}, {hex(hi)}', f'addi {rd}, {rd}, {lo}']
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: expand_pseudo(string, dict, bool)                                        |#
+#| Description: Expands a pseudo-instruction into RV32I instructions, any other line  |#
+#|    is returned as it is. la of a data variable is a gp relative addi, la of a text |#
+#|    label loads the address of the label like li. The long form of a branch is the  |#
+#|    inverted branch over a jal to the target                                        |#
+#| Input:                                                                             |#
+#|    string - an assembly instruction (or its parsed Instruction)                    |#
+#|    dictionary - the symbol table (labels and data variables)                       |#
+#|    bool - li/la always use the lui + addi pair, branches use the long form         |#
+#| Output:                                                                            |#
+#|    list - the RV32I assembly instructions                                          |#
+#+------------------------------------------------------------------------------------+#
+def expand_pseudo(line, symbol_table, long_form=False):
+    instr = to_instruction(line)
+    mnemonic, operands = instr.mnemonic.lower(), instr.operands
+    if mnemonic in ('li', 'la'):
+        rd, value = operands
+        if mnemonic == 'li':
+            try:
+                return li_sequence(rd, strval2int(value, 32), long_form)
+            except ValueError as err:
+                raise SourceError(str(err), value, -1) from None
+        if value not in symbol_table:
+            raise SourceError(f"Assemble Error! Label '{value}' is not defined!", value, -1)
+        if isinstance(symbol_table[value], str):
+            return [f'addi {rd}, gp, {value}']
+        return li_sequence(rd, symbol_table[value], long_form)
+    if mnemonic in pseudo_instructions:
+        instructions = [expansion.format(*operands) for expansion in pseudo_instructions[mnemonic][1]]
+    else:
+        instructions = [line]
+    if long_form and len(instructions) == 1:
+        branch = to_instruction(instructions[0])
+        if branch.mnemonic in inverse_branch:
+            rs, rt, target = branch.operands
+            return [f'{inverse_branch[branch.mnemonic]} {rs}, {rt}, 8', f'jal zero, {target}']
+    return instructions
+
 
-    return binary_instr
+#+------------------------------------------------------------------------------------+#
+#| Function: relax_target(string, dict)                                               |#
+#| Description: Returns what the size of an instruction depends on: 'la' for an la    |#
+#|    of a text label (or of a symbol that is not defined yet), 'branch' for a        |#
+#|    conditional branch to a label                                                   |#
+#| Output:                                                                            |#
+#|    tuple - (kind, label), (None, None) for the instructions of fixed size          |#
+#+------------------------------------------------------------------------------------+#
+def relax_target(line, symbol_table):
+    instr = to_instruction(line)
+    mnemonic, label = instr.mnemonic.lower(), instr.operands[-1] if instr.operands else None
+    if mnemonic == 'la' and not isinstance(symbol_table.get(label), str):
+        return 'la', label
+    if mnemonic in ('beq', 'bne', 'beqz', 'bnez') and (label in symbol_table or is_forward_label(label, symbol_table)):
+        return 'branch', label
+    return None, None
+
+
+# Peephole optimizer (-O)
+#ABI name of every register number, used in the instructions written by the optimizer
+register_name = {}
+for reg, code in register_int.items():
+    if reg.islower() and not reg.startswith('x'):
+        register_name.setdefault(code, reg)
+
+#Semantics of the R-Type instructions on 32 bit unsigned values, the I-Type version of
+#an instruction computes the same function with the sign extended immediate
+alu_operation = {
+   'add'  : lambda a, b: (a + b) & 0xFFFFFFFF,
+   'sub'  : lambda a, b: (a - b) & 0xFFFFFFFF,
+   'sll'  : lambda a, b: (a << (b & 0x1F)) & 0xFFFFFFFF,
+   'slt'  : lambda a, b: int((a ^ 0x80000000) < (b ^ 0x80000000)),
+   'sltu' : lambda a, b: int(a < b),
+   'xor'  : lambda a, b: a ^ b,
+   'srl'  : lambda a, b: a >> (b & 0x1F),
+   'sra'  : lambda a, b: (((a ^ 0x80000000) - 0x80000000) >> (b & 0x1F)) & 0xFFFFFFFF,
+   'or'   : lambda a, b: a | b,
+   'and'  : lambda a, b: a & b
+}
+immediate_operation = {
+   'addi' : 'add',   'slti' : 'slt',   'sltiu': 'sltu',  'xori' : 'xor',  'ori'  : 'or',
+   'andi' : 'and',   'slli' : 'sll',   'srli' : 'srl',   'srai' : 'sra'
+}
+
+#Number of instructions after a load use pair searched for an instruction that can
+#fill the load slot
+PEEPHOLE_SCHEDULE_WINDOW = 8
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: PeepholeInstr                                                               |#
+#| Description: An instruction of the text segment as seen by the peephole optimizer. |#
+#|    kind is 'alu' (R-Type, I-Type arithmetic, lui), 'load', 'store' or 'other'      |#
+#|    (branches, jumps, auipc and the la/branches sized by relax(), never moved).     |#
+#|    fields are the raw rs1/rs2 fields of the machine word (what cpu_hazard_unit     |#
+#|    compares with the destination of a lw), None when they are not known yet.       |#
+#|    offset is the numeric offset of a branch/jump (None for a label target)         |#
+#+------------------------------------------------------------------------------------+#
+class PeepholeInstr:
+    __slots__ = ('line', 'line_number', 'entry', 'kind', 'mnemonic', 'rd', 'sources', 'imm', 'fields', 'offset')
 
+    def __init__(self, line, line_number, symbol_table, entry=None):
+        self.line = line
+        self.line_number = line_number
+        #Text entry written out unchanged (la/branch of a label, relax() gives its size)
+        self.entry = entry
+        self.kind = 'other'
+        self.mnemonic = None
+        self.rd = None
+        self.sources = ()
+        self.imm = None
+        self.fields = None
+        self.offset = None
+        if entry is not None and entry[3] == 'la':
+            return
+        try:
+            self.parse(symbol_table)
+        except (KeyError, ValueError, IndexError):
+            #Left to the second pass, which reports the error
+            self.kind = 'other'
+            self.rd = self.fields = None
+            self.sources = ()
 
+    def parse(self, symbol_table):
+        instr = to_instruction(self.line)
+        mnemonic = self.mnemonic = instr.mnemonic.lower()
+        instr_type = instr.type
+        if instr_type in ('B', 'J'):
+            self.offset = instr.imm
+            if instr_type == 'B':
+                self.fields = (instr.rs1, instr.rs2)
+            return
+        if mnemonic == 'jalr':
+            self.sources = (instr.rs1,)
+            return
+        if mnemonic == 'auipc':
+            return
+        word = encode_instruction(instr, 0, symbol_table)
+        self.fields = ((word >> 15) & 0x1F, (word >> 20) & 0x1F)
+        if mnemonic == 'sw':
+            self.kind = 'store'
+            self.sources = (instr.rs2, instr.rs1)
+            self.imm = immediate_value(instr, symbol_table)
+        elif mnemonic == 'lw':
+            self.kind = 'load'
+            self.rd = instr.rd
+            self.sources = (instr.rs1,)
+            self.imm = immediate_value(instr, symbol_table)
+        else:
+            self.kind = 'alu'
+            self.rd = instr.rd
+            if instr_type == 'R':
+                self.sources = (instr.rs1, instr.rs2)
+            elif instr_type == 'I':
+                self.sources = (instr.rs1,)
+                self.imm = immediate_value(instr, symbol_table)
+            else:
+                self.imm = instr.immediate(0, symbol_table) & 0xFFFFF000
+
+    #Value written in rd if the sources are known constants, None otherwise
+    def evaluate(self, consts):
+        values = [consts.get(source) for source in self.sources]
+        if None in values:
+            return None
+        if self.mnemonic == 'lui':
+            return self.imm
+        if self.mnemonic in immediate_operation:
+            return alu_operation[immediate_operation[self.mnemonic]](values[0], self.imm)
+        return alu_operation[self.mnemonic](*values)
+
+    #Tests if the instruction copies rd into itself (addi x, x, 0, add x, x, zero, ...)
+    def is_identity(self):
+        mnemonic, rd, sources = self.mnemonic, self.rd, self.sources
+        if mnemonic in ('add', 'or', 'xor') and sources in ((rd, 0), (0, rd)):
+            return True
+        if mnemonic in ('sub', 'sll', 'srl', 'sra') and sources == (rd, 0):
+            return True
+        if mnemonic in ('and', 'or') and sources == (rd, rd):
+            return True
+        if mnemonic in ('addi', 'ori', 'xori', 'slli', 'srli', 'srai') and sources == (rd,) and self.imm == 0:
+            return True
+        return mnemonic == 'andi' and sources == (rd,) and self.imm == 0xFFFFFFFF
+
+    def text_entry(self):
+        return self.entry if self.entry is not None else (self.line, self.line_number, 1, None, None)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: PeepholeStats                                                               |#
+#| Description: What the peephole optimizer changed and its estimate of the cycles    |#
+#|    saved by one pass through the code: the removed instructions plus the load use  |#
+#|    stalls of cpu_hazard_unit (lw followed by an instruction that has its rd in the |#
+#|    rs1/rs2 field) that are no longer in the program                                |#
+#+------------------------------------------------------------------------------------+#
+class PeepholeStats:
+    def __init__(self):
+        self.dead_moves = 0
+        self.forwarded_loads = 0
+        self.folded_constants = 0
+        self.filled_load_slots = 0
+        self.instructions_before = 0
+        self.instructions_after = 0
+        self.stalls_before = 0
+        self.stalls_after = 0
+
+    @property
+    def cycles_saved(self):
+        return self.instructions_before - self.instructions_after + self.stalls_before - self.stalls_after
+
+    def report(self):
+        return (f"peephole: {self.dead_moves} dead move(s) removed, {self.forwarded_loads} load(s) forwarded, "
+                f"{self.folded_constants} constant(s) folded, {self.filled_load_slots} load slot(s) filled\n"
+                f"peephole: {self.instructions_before} -> {self.instructions_after} instructions, "
+                f"{self.stalls_before} -> {self.stalls_after} load use stalls, "
+                f"~{self.cycles_saved} cycle(s) saved per pass through the code (pipeline model estimate)")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: immediate_value(Instruction, dict)                                       |#
+#| Description: Returns the value of the 12 bit immediate of an instruction (number,  |#
+#|    SFR name or data variable) sign extended to a 32 bit unsigned value             |#
 #+------------------------------------------------------------------------------------+#
-#| Function: translate_menmonic(string)                                               |#
+def immediate_value(instr, symbol_table):
+    value = instr.immediate(0, symbol_table)
+    return ((value ^ 0x800) - 0x800) & 0xFFFFFFFF
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: load_use_stall(PeepholeInstr, PeepholeInstr)                             |#
+#| Description: Tests if the second instruction stalls behind the first one (hazard   |#
+#|    rule of cpu_hazard_unit.sv and of the ISS pipeline timing model)                |#
+#+------------------------------------------------------------------------------------+#
+def load_use_stall(first, second):
+    return first.kind == 'load' and second.fields is not None and first.rd in second.fields
+
+
+def count_load_use_stalls(instrs):
+    return sum(load_use_stall(first, second) for first, second in zip(instrs, instrs[1:]))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: forward_values(list, dict, PeepholeStats)                                |#
+#| Description: Forward pass over a straight-line run. Tracks the registers that hold |#
+#|    known constants and the register that holds the word at every gp relative      |#
+#|    address (after a sw or a lw). A lw of a tracked word becomes a register copy    |#
+#|    (or is removed), an instruction that only copies a register into itself or     |#
+#|    writes the constant that is already in rd is removed, and an instruction on     |#
+#|    constant operands becomes a single addi/lui when its result fits one. The       |#
+#|    writes to x0 (nop) are kept, they are timing padding                            |#
+#| Output:                                                                            |#
+#|    list - the optimized run                                                        |#
+#+------------------------------------------------------------------------------------+#
+def forward_values(run, symbol_table, stats):
+    gp = register_int['gp']
+    consts = {0: 0}
+    memory = {}
+    optimized = []
+    for instr in run:
+        if instr.kind == 'load' and instr.rd and instr.sources[0] == gp and instr.imm in memory:
+            source = memory[instr.imm]
+            stats.forwarded_loads += 1
+            if source == instr.rd:
+                continue
+            instr = PeepholeInstr(f'addi {register_name[instr.rd]}, {register_name[source]}, 0',
+                                  instr.line_number, symbol_table)
+
+        rd = instr.rd
+        if instr.kind == 'alu' and rd:
+            value = instr.evaluate(consts)
+            if instr.is_identity() or (value is not None and consts.get(rd) == value):
+                stats.dead_moves += 1
+                continue
+            if value is not None and any(instr.sources):
+                folded = li_sequence(register_name[rd], value)
+                if len(folded) == 1:
+                    stats.folded_constants += 1
+                    instr = PeepholeInstr(folded[0], instr.line_number, symbol_table)
+        elif instr.kind == 'store':
+            source, base = instr.sources
+            if base == gp:
+                for offset in [offset for offset in memory if abs(offset - instr.imm) < 4]:
+                    del memory[offset]
+                memory[instr.imm] = source
+            elif base != 0:
+                #Only the addresses relative to x0 (SFR/IO space) cannot be in the data memory
+                memory.clear()
+
+        if rd:
+            #rd is written, forget what it held
+            value = instr.evaluate(consts) if instr.kind == 'alu' else None
+            if value is None:
+                consts.pop(rd, None)
+            else:
+                consts[rd] = value
+            if rd == gp:
+                memory.clear()
+            for offset in [offset for offset, reg in memory.items() if reg == rd]:
+                del memory[offset]
+            if instr.kind == 'load' and instr.sources[0] == gp and rd != gp:
+                memory[instr.imm] = rd
+        optimized.append(instr)
+    return optimized
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: remove_dead_writes(list, PeepholeStats)                                  |#
+#| Description: Backward pass over a straight-line run, removes the arithmetic        |#
+#|    instructions whose rd is written again later in the run before it is read (the  |#
+#|    registers are live at the end of the run)                                       |#
+#+------------------------------------------------------------------------------------+#
+def remove_dead_writes(run, stats):
+    overwritten = set()
+    kept = []
+    for instr in reversed(run):
+        if instr.kind == 'alu' and instr.rd and instr.rd in overwritten:
+            stats.dead_moves += 1
+            continue
+        if instr.rd:
+            overwritten.add(instr.rd)
+        overwritten.difference_update(instr.sources)
+        kept.append(instr)
+    kept.reverse()
+    return kept
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: can_cross(PeepholeInstr, list)                                           |#
+#| Description: Tests if an arithmetic instruction can be moved over the instructions |#
+#|    of the list (no register is read or written out of order, memory is not used)  |#
+#+------------------------------------------------------------------------------------+#
+def can_cross(instr, others):
+    if instr.kind != 'alu':
+        return False
+    for other in others:
+        if other.kind == 'other' or (other.rd and other.rd in instr.sources):
+            return False
+        if instr.rd and (instr.rd in other.sources or instr.rd == other.rd):
+            return False
+    return True
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: schedule_loads(list, PeepholeInstr, PeepholeStats)                       |#
+#| Description: Fills the slot of every lw whose next instruction stalls with an      |#
+#|    independent arithmetic instruction: the one right before the lw or one of the   |#
+#|    next PEEPHOLE_SCHEDULE_WINDOW instructions. A move is kept only if it lowers    |#
+#|    the load use stalls around it. The instruction that ends the run (branch/jump,  |#
+#|    None if the run ends at a label) is part of the check but is never moved        |#
+#+------------------------------------------------------------------------------------+#
+def schedule_loads(run, follower, stats):
+    instrs = run + [follower] if follower is not None else list(run)
+    i = 0
+    while i < len(instrs) - 1:
+        if instrs[i].kind == 'load' and load_use_stall(instrs[i], instrs[i + 1]):
+            candidates = [i - 1] if i > 0 else []
+            candidates += range(i + 2, min(len(run), i + 2 + PEEPHOLE_SCHEDULE_WINDOW))
+            for j in candidates:
+                crossed = instrs[j + 1:i + 1] if j < i else instrs[i + 1:j]
+                if not can_cross(instrs[j], crossed):
+                    continue
+                lo, hi = max(0, min(i, j) - 1), max(i, j) + 2
+                before = count_load_use_stalls(instrs[lo:hi])
+                moved = instrs[:]
+                instr = moved.pop(j)
+                moved.insert(i if j < i else i + 1, instr)
+                if count_load_use_stalls(moved[lo:hi]) < before:
+                    instrs = moved
+                    stats.filled_load_slots += 1
+                    break
+        i += 1
+    run[:] = instrs[:len(run)]
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: fixed_layout(list)                                                       |#
+#| Description: Returns the instructions whose addresses the program depends on: the  |#
+#|    span between a branch/jump with a numeric offset and its target, or all of them |#
+#|    if the code computes addresses from the PC (auipc) or jumps to a register that  |#
+#|    is not the return address (jalr through a computed address)                     |#
+#| Output:                                                                            |#
+#|    set - the id() of the instructions that must not be removed or moved            |#
+#+------------------------------------------------------------------------------------+#
+def fixed_layout(instrs):
+    ra = register_int['ra']
+    addresses = []
+    address = 0
+    for instr in instrs:
+        if instr.mnemonic == 'auipc' or (instr.mnemonic == 'jalr' and instr.sources != (ra,)):
+            return {id(instr) for instr in instrs}
+        addresses.append(address)
+        address += 4 * (instr.entry[2] if instr.entry else 1)
+
+    fixed = set()
+    for instr, address in zip(instrs, addresses):
+        if instr.offset is not None:
+            lo, hi = sorted((address, address + instr.offset))
+            fixed.update(id(other) for other, other_address in zip(instrs, addresses) if lo <= other_address <= hi)
+    return fixed
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: peephole_optimize(list, list, dict)                                      |#
+#| Description: Peephole optimizer of the text segment, runs between the first pass   |#
+#|    and relax(). The source instructions are expanded into RV32I instructions and   |#
+#|    split into straight-line runs (a label, a branch/jump, an la/branch sized by    |#
+#|    relax() or an instruction of fixed_layout() ends a run). Every run goes through |#
+#|    forward_values(), remove_dead_writes() and schedule_loads(). Nothing is moved   |#
+#|    over a run boundary and the order of the loads/stores is kept, so the program   |#
+#|    computes the same registers and memory                                          |#
+#| Input:                                                                             |#
+#|    list - the text entries (line, line number, size, relax kind, relax label)      |#
+#|    list - the text labels (label, index of the next text entry)                    |#
+#|    dictionary - the symbol table (labels and data variables)                       |#
+#| Output:                                                                            |#
+#|    tuple - (text entries, text labels, PeepholeStats)                              |#
+#+------------------------------------------------------------------------------------+#
+def peephole_optimize(text, text_labels, symbol_table):
+    stats = PeepholeStats()
+    label_positions = sorted({position for _, position in text_labels} | {0, len(text)})
+    segments = []
+    for start, end in zip(label_positions, label_positions[1:]):
+        instrs = []
+        for line, line_number, size, kind, label in text[start:end]:
+            if kind is None:
+                instrs += [PeepholeInstr(instr, line_number, symbol_table)
+                           for instr in expand_pseudo(line, symbol_table)]
+            else:
+                entry = (line, line_number, size, kind, label)
+                instrs.append(PeepholeInstr(expand_pseudo(line, symbol_table)[0] if kind == 'branch' else line,
+                                            line_number, symbol_table, entry))
+        segments.append((start, instrs))
+    before = [instr for _, instrs in segments for instr in instrs]
+    fixed = fixed_layout(before)
+
+    new_positions = {}
+    after = []
+    for start, instrs in segments:
+        new_positions[start] = len(after)
+        run = []
+        for instr in instrs + [None]:
+            if instr is not None and instr.kind != 'other' and id(instr) not in fixed:
+                run.append(instr)
+                continue
+            run = remove_dead_writes(forward_values(run, symbol_table, stats), stats)
+            schedule_loads(run, instr, stats)
+            after += run
+            if instr is not None:
+                after.append(instr)
+            run = []
+    new_positions[len(text)] = len(after)
+
+    stats.instructions_before = sum(instr.entry[2] if instr.entry else 1 for instr in before)
+    stats.instructions_after = sum(instr.entry[2] if instr.entry else 1 for instr in after)
+    stats.stalls_before = count_load_use_stalls(before)
+    stats.stalls_after = count_load_use_stalls(after)
+    text_labels = [(label, new_positions[position]) for label, position in text_labels]
+    return [instr.text_entry() for instr in after], text_labels, stats
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: print_data_memory_map(bytearray, int)                                    |#
 #| Description: This function is used to print the data memory map after the code is  |#
 #|              assembled                                                             |#
 #| Input:                                                                             |#
-#|    dictionary - a map of the data memory                                           |#
+#|    bytearray - the content of the data memory                                      |#
+#|    int - the address of the first byte of the data memory                          |#
 #| Output:                                                                            |#
 #|    void                                                                            |#
 #+------------------------------------------------------------------------------------+#
-def print_data_memory_map(data_segment):
-    j = 0
-    line = ''
+def print_data_memory_map(data_memory, start_addr):
     print("Data Memory Address" + "\t\t" + "Each 4 bytes of a line in Little Endian")
-    for i in data_seg:
-        if j == 0:
-            line = ''
-            hex_addr = hex(i)[2:]   #strip the '0x' prefix for now
-            hex_addr = hex_addr.zfill(8)          #make the hex number 8=32/4 characters long
-            hex_addr = '0x' + hex_addr
-        
-        j = (j+1)%4
-        hex_value = hex(int(data_seg[i],2))[2:]
-        hex_value = hex_value.zfill(2)          #make the hex number 2=8/4 characters long
-        hex_value = '0x' + hex_value
-        line = " " + hex_value + line
-        if j == 0:
-            print(hex_addr + "\t\t\t\t" + line)
+    for i in range(0, len(data_memory), 4):
+        hex_addr = '0x' + format(start_addr + i, '08x')
+        #Most significant byte first, the memory is Little Endian
+        line = ''.join(" 0x" + format(byte, '02x') for byte in reversed(data_memory[i:i+4]))
+        print(hex_addr + "\t\t\t\t" + line)
 
 
 #Program Memory 64KB
@@ -528,223 +1472,1070 @@ prog_seg_start_addr  = '0x00000000'
 data_seg_end_addr    = '0x10000FFF'
 data_seg_start_addr  = '0x10000000'
 
+
+#+------------------------------------------------------------------------------------+#
+#| Function: global_pointer()                                                         |#
+#| Description: Returns the gp value, the middle of the data memory, so the 12 bit    |#
+#|    signed offsets of the gp relative accesses reach the whole data memory          |#
+#+------------------------------------------------------------------------------------+#
+def global_pointer():
+    start = int(data_seg_start_addr, 16)
+    return start + (int(data_seg_end_addr, 16) + 1 - start) // 2
+
+
 #+------------------------------------------------------------------------------------+#
-#| Function: main()                                                                   |#
-#| Description: This is the main function                                             |#
+#| Function: assembler_config(bool)                                                   |#
+#| Description: Returns the memory map/SFR configuration and the options that the     |#
+#|    generated machine code depends on (used in the build cache key)                 |#
 #| Input:                                                                             |#
+#|    bool - the peephole optimizer runs (-O)                                         |#
 #| Output:                                                                            |#
+#|    dict - the configuration                                                        |#
 #+------------------------------------------------------------------------------------+#
-def main():
-    #Initialize variables
-    PC = int(prog_seg_start_addr[2:],16) #strip the '0x' prefix and convert to decimal
-    DATA_SEG_ADDR = int(data_seg_start_addr[2:],16) #strip the '0x' prefix and convert to decimal
-    max_data_seg_addr_val = int(data_seg_end_addr[2:],16)
-    segment_type = ''
+def assembler_config(optimize=False):
+    config = {
+        'sfr_map'             : sfr_map,
+        'prog_seg_start_addr' : prog_seg_start_addr,
+        'prog_seg_end_addr'   : prog_seg_end_addr,
+        'data_seg_start_addr' : data_seg_start_addr,
+        'data_seg_end_addr'   : data_seg_end_addr,
+    }
+    #Only added for -O so the keys of the other builds do not change
+    if optimize:
+        config['peephole'] = True
+    return config
 
-    #Initialize the global pointer at the middle of Data Memory
-    #This will help in accesing variables from memory by using indirect addressing
-    gp = int(DATA_SEG_ADDR + ((max_data_seg_addr_val + 1) - DATA_SEG_ADDR)/2)
 
-    #TODO quick workaround
-    #Initialize the gp register with the address from the middle of the data memory segment 0x1000_0800
-    prog_seg[0] = 'lui   gp,         0x10001000' #load a bigger upper immediate because addi is signed op
-    prog_seg[4] = 'addi  gp, gp,     0x800'      #now addi will add 0xFFFF_F800 to the previous value
-    PC = 8
+#+------------------------------------------------------------------------------------+#
+#| Class: DataSegment                                                                 |#
+#| Description: Content of the data segment, kept in a bytearray preallocated to the  |#
+#|    size of the data memory. The directives write their values in place at the     |#
+#|    current address (Little Endian) and the used part is returned by contents()     |#
+#+------------------------------------------------------------------------------------+#
+class DataSegment:
+    def __init__(self):
+        self.start_addr = int(data_seg_start_addr, 16)
+        self.memory = bytearray(int(data_seg_end_addr, 16) + 1 - self.start_addr)
+        self.size = 0
 
-    #First Iteration
-    #1) Strip the assembly code of comments & empty lines & spaces
-    #2) Build the symbol table map
-    #3) Generates the data_segment and program_segment
-    with open("test_prog_03.asm", "r") as asm_file:
-        for line in asm_file:
-            #Strip all whitespaces from the current line
-            line = line.strip()
-            #If the line is empty skip it
-            if not line:
-                continue
-            #If the line starts with '#' skip it
-            if line.startswith("#"):
-                continue
-            #Remove the comments from the lines that contains instructions
-            line = line.split('#', 1)[0].strip()
-            
-
-            if line.startswith(".section "):
-                    #Remove ".section" part of the string
-                    line = line.replace(".section ", "", 1)
-                    #Strip all whitespaces from the current line
-                    line = line.strip()
-                    #Save the segment type
-                    segment_type = line[1:]
-            else:
-                if segment_type == "text":
-                    if line.startswith("."):
-                        raise ValueError("Syntax Error! Unsupported RV32I Assembly Directive in text segment!")
-                        
-                    if line.endswith(":"): #if line is an label
-                        if line[:-1] in symbol_table: #if the label already exists throw an error
-                            raise ValueError(f"Assemble Error! Label '{line[:-1]}' is already defined!")
-                        else:
-                            symbol_table[line[:-1]] = PC #save the PC for the label
+    @property
+    def address(self):
+        return self.start_addr + self.size
+
+    #Returns the offset of the next num_bytes bytes and moves the current address
+    def allocate(self, num_bytes):
+        offset = self.size
+        if offset + num_bytes > len(self.memory):
+            raise ValueError("Assemble Error! Data Segment is full!")
+        self.size += num_bytes
+        return offset
+
+    def add_word(self, val_str):
+        struct.pack_into('<I', self.memory, self.allocate(4), strval2int(val_str, 32))
+
+    def add_byte(self, val_str):
+        self.memory[self.allocate(1)] = strval2int(val_str, 8)
+
+    def add_string(self, text):
+        #ASCII codes of the chars and the null termination
+        data = text.encode('latin-1') + b'\0'
+        offset = self.allocate(len(data))
+        self.memory[offset:offset + len(data)] = data
+
+    def add_space(self, num_of_spaces):
+        offset = self.allocate(num_of_spaces)
+        self.memory[offset:offset + num_of_spaces] = bytes(num_of_spaces)
+
+    def contents(self):
+        return self.memory[:self.size]
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Image                                                                       |#
+#| Description: The result of an assembly run. The program memory is kept as 32 bit   |#
+#|    machine words and the data memory as raw bytes (Little Endian), the text        |#
+#|    formats are only produced by the write_* functions                              |#
+#| Attributes:                                                                        |#
+#|    pfm - array('I') with one machine word per PFM address, from prog_seg_start_addr|#
+#|    dfm - bytearray with the data memory content, from data_seg_start_addr          |#
+#|    symbol_table - dictionary with the labels and data variables of the program     |#
+#|    line_map - array('I') with the source line number of every PFM word (0 for the  |#
+#|               instructions added by the assembler), None if unknown                |#
+#|    peephole - PeepholeStats of an optimized (-O) assembly, None otherwise          |#
+#+------------------------------------------------------------------------------------+#
+class Image:
+    def __init__(self, pfm, dfm, symbol_table, line_map=None):
+        self.pfm = pfm
+        self.dfm = dfm
+        self.symbol_table = symbol_table
+        self.line_map = line_map
+        self.peephole = None
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: dfm_words()                                                          |#
+    #| Description: Returns the data memory as 32 bit Little Endian words, the last   |#
+    #|    word is padded with 0's if the data segment is not a multiple of 4 bytes    |#
+    #+--------------------------------------------------------------------------------+#
+    def dfm_words(self):
+        dfm = self.dfm + bytes(-len(self.dfm) % 4)
+        if sys.byteorder == 'little':
+            return memoryview(dfm).cast('I')
+        words = array('I')
+        words.frombytes(dfm)
+        words.byteswap()
+        return words
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Assembler                                                                   |#
+#| Description: Two pass RV32I assembler. Every call of assemble() starts from an     |#
+#|    empty symbol table and empty segments, so one object can be reused for any      |#
+#|    number of programs and separate objects never share state. The first pass keeps |#
+#|    the source instructions with their size in words, relax() then gives every la   |#
+#|    of a text label its final size before the instructions are placed. With         |#
+#|    optimize the peephole optimizer runs on the source instructions before relax()  |#
+#|    The errors of the source are raised as SourceError with their location          |#
+#|    "name:line:column"                                                              |#
+#| Input:                                                                             |#
+#|    bool - run the peephole optimizer (-O)                                          |#
+#+------------------------------------------------------------------------------------+#
+class Assembler:
+    #The program starts with the gp initialization (a linked program gets it from the linker)
+    startup = True
+
+    def __init__(self, optimize=False):
+        self.optimize = optimize
+        self.symbol_table = {}
+        self.exports = {}
+        self.prog_seg = {}
+        self.data_seg = DataSegment()
+        self.line_map = array('I')
+        self.line_number = 0
+        self.text = []
+        self.text_labels = []
+        self.source_name = SOURCE_NAME
+        self.source = ''
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: assemble(string, string)                                             |#
+    #| Description: Assembles the source code of a program                            |#
+    #| Input:                                                                         |#
+    #|    string - the content of an assembly file (.asm)                             |#
+    #|    string - the name of the source in the error messages (file path)           |#
+    #| Output:                                                                        |#
+    #|    Image - the PFM and DFM content of the program                              |#
+    #+--------------------------------------------------------------------------------+#
+    def assemble(self, source, name=SOURCE_NAME):
+        #Declare the symbol table as a map (dictionary) and the symbols exported with .globl
+        #(symbol -> line of the .globl)
+        self.symbol_table = {}
+        self.exports = {}
+        #Declare maps in which the program and data segments will be stored
+        self.prog_seg = {}
+        self.data_seg = DataSegment()
+        #Source line of every instruction (0 for the gp initialization)
+        self.line_map = array('I')
+        self.line_number = 0
+        #Source instructions (line, line number, size in words, relaxable) and text labels
+        #(label, index of the next source instruction). line is the text of an RV32I
+        #instruction or the parsed Instruction of a pseudo-instruction/branch. The entries
+        #are tuples, the garbage collector stops tracking the ones of a text line
+        self.text = []
+        self.text_labels = []
+        #The source is kept for the location of the errors (its lines are split again then)
+        self.source_name = name
+        self.source = source
+
+        try:
+            self.first_pass(source.splitlines())
+            peephole = None
+            if self.optimize:
+                self.text, self.text_labels, peephole = peephole_optimize(self.text, self.text_labels,
+                                                                          self.symbol_table)
+            self.relax()
+            image = Image(self.second_pass(), self.data_memory(), self.symbol_table, self.line_map)
+        except ValueError as err:
+            raise self.located(err) from err
+        image.peephole = peephole
+        return image
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: located(ValueError, string)                                          |#
+    #| Description: Returns the error with the location of the current line (the      |#
+    #|    line being read or the source line of the instruction being placed/encoded) |#
+    #| Input:                                                                         |#
+    #|    ValueError - the error                                                      |#
+    #|    string - the text of the current line (None to look it up in the source)    |#
+    #| Output:                                                                        |#
+    #|    SourceError - the located error (the error itself if it is located already) |#
+    #+--------------------------------------------------------------------------------+#
+    def located(self, err, line=None):
+        if getattr(err, 'location', None) is not None:
+            return err
+        if line is None and self.line_number > 0:
+            lines = self.source.splitlines()
+            if self.line_number <= len(lines):
+                line = lines[self.line_number - 1]
+        return locate_error(err, self.source_name, self.line_number, line)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: first_pass(iterable)                                                 |#
+    #| Description: First Iteration                                                   |#
+    #|    1) Split every line in label/mnemonic/operands (STATEMENT_RE), skip the     |#
+    #|       comments & empty lines                                                   |#
+    #|    2) Build the symbol table map                                               |#
+    #|    3) Generates the data_segment and program_segment                           |#
+    #| Input:                                                                         |#
+    #|    iterable - the lines of the assembly file                                   |#
+    #| Output:                                                                        |#
+    #|    void                                                                        |#
+    #+--------------------------------------------------------------------------------+#
+    def first_pass(self, lines):
+        symbol_table = self.symbol_table
+        data_seg = self.data_seg
+
+        #Initialize variables
+        PC = int(prog_seg_start_addr[2:],16) #strip the '0x' prefix and convert to decimal
+        segment_type = ''
+
+        #Initialize the global pointer at the middle of Data Memory
+        #This will help in accesing variables from memory by using indirect addressing
+        gp = global_pointer()
+
+        #Initialize the gp register with the address from the middle of the data memory segment 0x1000_0800
+        #(lui gp, 0x10001000 / addi gp, gp, -0x800 because addi sign extends its immediate)
+        if self.startup:
+            PC = self.add_source(PC, f'li gp, {hex(gp)}')
+
+        line = None
+        try:
+            for self.line_number, line in enumerate(lines, 1):
+                statement = STATEMENT_RE.match(line)
+                if statement is None:
+                    raise SourceError("Syntax Error! Invalid statement!", line.strip())
+                label, mnemonic, operands = statement.group('label', 'mnemonic', 'operands')
+                #Empty line or comment
+                if label is None and mnemonic is None:
+                    continue
+
+                if mnemonic == ".globl" or mnemonic == ".global":
+                    #Symbols visible to the other modules of a linked program (riscv_linker.py)
+                    for symbol in (operands or '').replace(",", " ").split():
+                        self.exports.setdefault(symbol, self.line_number)
+                elif mnemonic == ".section":
+                    #Save the segment type (strip the '.' of the section name)
+                    segment_type = (operands or '')[1:]
+                elif segment_type == "text":
+                    if label is not None:
+                        if label in symbol_table: #if the label already exists throw an error
+                            raise SourceError(f"Assemble Error! Label '{label}' is already defined!", label)
                         #Labels are not real intructions, that is why they should not increase the PC value, only save it
-                    else: #if the line is not a label than it is an instruction
-                        prog_seg[PC] = line
-                        #Update PC address
-                        PC += 4
+                        symbol_table[label] = PC
+                        self.text_labels.append((label, len(self.text)))
+                    if mnemonic is not None:
+                        if mnemonic.startswith("."):
+                            raise SourceError("Syntax Error! Unsupported RV32I Assembly Directive in text segment!",
+                                              mnemonic)
+                        #Instruction (or pseudo-instruction)
+                        PC = self.add_source(PC, statement.group('instruction'))
                 elif segment_type == "data":
-                    #Split the string in 3 substrings (label + data_type + value)
-                    temp_line = line.split()
-                    data_type = ''
-
-                    if len(temp_line) == 1 and temp_line[0].endswith(":"): #if line is only an label
-                        #Compute the address to store in symbol_table
-                        if temp_line[0][:-1] in symbol_table: #if the variable already exists throw an error
-                            raise ValueError(f"Assemble Error! Variable '{temp_line[0][:-1]}' is already defined!")
-                        else:
-                            symbol_table[temp_line[0][:-1]] = compute_signed_Nbit_ta(12, gp, DATA_SEG_ADDR)
-                        continue #skip the rest of the code to the end of the loop
-                    elif temp_line[0].endswith(":"): #if the line is a label but there are other elements
-                        #Split the string in 3 substrings (label + data_type + value)
-                        line = " ".join(line.split()) #exception, remove any unnecessary space characters
-                        line = line.split(r' ', 2)
+                    if label is not None:
+                        if label in symbol_table: #if the variable already exists throw an error
+                            raise SourceError(f"Assemble Error! Variable '{label}' is already defined!", label)
                         #Compute the address to store in symbol_table
-                        if temp_line[0][:-1] in symbol_table: #if the variable already exists throw an error
-                            raise ValueError(f"Assemble Error! Variable '{temp_line[0][:-1]}' is already defined!")
-                        else:
-                            symbol_table[temp_line[0][:-1]] = compute_signed_Nbit_ta(12, gp, DATA_SEG_ADDR)
-                        data_type = line[1] #save the data_type
-                        #Select only the values of the variable substring and replace , with spaces
-                        value = line[2].replace(",", " ")
-                    else: #if the line only contains a type declaration without a label save the data type
-                        #Split the string in 2 substrings (data_type + value)
-                        line = line.split(" ", 1)
-                        data_type = line[0]
-                        value = line[1].replace(",", " ")
-                        
-                    #Split the variable in case there are multiple
-                    value = value.split()
-                    
-                    for i in value:
-                        if DATA_SEG_ADDR <= max_data_seg_addr_val:
-                            if data_type == ".string":
-                                #String variable declares only one variable at a time
-                                data_string = i
-                                #Strip the " chars from the string
-                                data_string = data_string.replace("\"", "")
-                                num_of_chars = len(data_string)
-                                #Add every char into the data_seg
-                                for j in range(num_of_chars):
-                                    #Transform each char of the string into their ASCII code and save it into data segment
-                                    ascii_code = str(ord(data_string[j]))
-                                    #Translate the ascii code to binary and add it to the data_segment
-                                    data_seg[DATA_SEG_ADDR] = strval2strbin(ascii_code,8)
-                                    #Increase the address by 1 because chars are 1 byte long
-                                    DATA_SEG_ADDR += 1
-                                #Add the null termination
-                                #Transform each char of the string into their ASCII code and save it into data segment
-                                data_seg[DATA_SEG_ADDR] = strval2strbin('0',8)
-                                #Increase the address by 1 because chars are 1 byte long
-                                DATA_SEG_ADDR += 1
-                            elif data_type == ".word":
-                                #Transorm the value in a binary string of 4 bytes
-                                binary_value = strval2strbin(i,32)
-                                for j in range(4):
-                                    #Save value for each byte from LSB to MSB of the binary value!!!
-                                    data_seg[DATA_SEG_ADDR] = binary_value[(3-j)*8:(4-j)*8]
-                                    #Increase the address by 1 for each byte
-                                    DATA_SEG_ADDR += 1
-                            elif data_type == ".byte":
-                                #Save value in binary
-                                data_seg[DATA_SEG_ADDR] = strval2strbin(i,8)
-                                #Increase the address by 1
-                                DATA_SEG_ADDR += 1
-                            elif data_type == ".space":
-                                #Add num_of_spaces spaces into the data memory
-                                num_of_spaces = int(i)
-                                for j in range(num_of_spaces):
-                                    #Insert a space
-                                    data_seg[DATA_SEG_ADDR] = strval2strbin('0',8)
-                                    #Increase the address by 1
-                                    DATA_SEG_ADDR += 1
+                        symbol_table[label] = compute_signed_Nbit_ta(12, gp, data_seg.address)
+                    #Split the values in case there are multiple
+                    for i in (operands or '').replace(",", " ").split():
+                        if mnemonic not in (".string", ".word", ".byte", ".space"):
+                            raise SourceError(f"Syntax Error! Unsupported type '{mnemonic}'!", mnemonic)
+                        try:
+                            if mnemonic == ".string":
+                                #String variable declares only one variable at a time, strip the " chars
+                                data_seg.add_string(i.replace("\"", ""))
+                            elif mnemonic == ".word":
+                                data_seg.add_word(i)
+                            elif mnemonic == ".byte":
+                                data_seg.add_byte(i)
                             else:
-                                raise ValueError(f"Syntax Error! Unsupported type '{data_type}'!")
-                        else:
-                            raise ValueError("Assemble Error! Data Segment is full!")
+                                #Add num_of_spaces spaces into the data memory
+                                if not i.isdigit():
+                                    raise ValueError(f"Syntax Error! Invalid number '{i}'!")
+                                data_seg.add_space(int(i))
+                        except ValueError as err:
+                            #The value the error refers to
+                            raise SourceError(str(err), i) from None
                 else:
                     raise ValueError(f"Syntax Error! Invalid Section: .'{segment_type}'. Expected '.data' or '.text'.")
+        except ValueError as err:
+            raise self.located(err, line) from err
 
-    #Close the ASM code file:
-    asm_file.close()
-    
+    #+--------------------------------------------------------------------------------+#
+    #| Function: add_source(int, string)                                              |#
+    #| Description: Stores a source instruction of the text segment for relax(). Only |#
+    #|    the pseudo-instructions and the branches are parsed here (their size        |#
+    #|    depends on the symbols), an RV32I instruction is kept as text and parsed by |#
+    #|    the second pass                                                             |#
+    #| Output:                                                                        |#
+    #|    int - the PC of the next instruction                                        |#
+    #+--------------------------------------------------------------------------------+#
+    def add_source(self, PC, line):
+        info = mnemonic_format.get(line.partition(' ')[0]) if isinstance(line, str) else None
+        if info is not None and info[0] != 'P' and info[0] != 'B':
+            self.text.append((line, self.line_number, 1, None, None))
+            return PC + 4
+        #The parsed instruction is kept for relax()
+        instr = to_instruction(line)
+        if instr.type == 'P' or instr.type == 'B':
+            #An la/branch of a label starts as one instruction
+            kind, label = relax_target(instr, self.symbol_table)
+            size = 1 if kind else len(expand_pseudo(instr, self.symbol_table))
+        else:
+            kind = label = None
+            size = 1
+        self.text.append((instr, self.line_number, size, kind, label))
+        return PC + 4 * size
 
-    #Second Iteration
-    #1) Convert the menmonics into machine code
-    #2) Generate the programming .bin/.hex files for PFM memory
-    #2) Generate the programming .bin/.hex files for PFM memory  
-    with open("pfm.bin", "w") as bin_file, \
-         open("pfm.hex", "w") as hex_file:
-      
-        for PC in prog_seg:
-            #Trasnslate the assembly instruction into binary machine code
-            bin_line = translate_menmonic(prog_seg[PC], PC)
-            #Transfrom the binary coded instruction in hexadecimal as well
-            hex_line = bin2hex_32bit(bin_line)
-            #Write the machine code files in their specific format binary/hex
-            bin_file.write(bin_line + '\n')
-            hex_file.write(hex_line + '\n')
-
-    #Close the .bin and .hex files:
-    bin_file.close()
-    hex_file.close()
-
-    with open("dfm.bin", "w") as bin_file, \
-         open("dfm.hex", "w") as hex_file:
-      
-        word_cnt = 0
-        bin_line = ''
-        #Exception: if the data_segment has a number of elements that it is not 
-        #           a multiple of 4 add 0's until this condition is met
-        if len(data_seg) % 4 != 0:
-            #Calculate how much elements are needed to fill the last line
-            num_of_zeros = 4 - (len(data_seg) % 4)
-            #Assign the pointer the next address after the last that was written
-            DATA_SEG_ADDR = max(data_seg.keys()) + 1
-            for i in range(num_of_zeros):
-                data_seg[DATA_SEG_ADDR] = strval2strbin('0', 8)
-                DATA_SEG_ADDR += 1
-        
-        for DATA_SEG_ADDR in data_seg:
-            #Trasnslate the data_seg map into binary
-            bin_line = data_seg[DATA_SEG_ADDR] + bin_line
-            #Count the number of bytes
-            word_cnt = (word_cnt + 1) % 4
-            
-            if word_cnt == 0:
-                #Transfrom the binary coded line in hexadecimal as well
-                hex_line = bin2hex_32bit(bin_line)
-                #Write the data memory files in their specific format binary/hex
-                bin_file.write(bin_line + '\n')
-                hex_file.write(hex_line + '\n')
-                #Reinitialize bin_lin as empty
-                bin_line = ""
-
-    #Close the .bin and .hex files:
-    bin_file.close()
-    hex_file.close()
-    
-    #Print the Data memory Map
-    print_data_memory_map(prog_seg)
+    #+--------------------------------------------------------------------------------+#
+    #| Function: relax()                                                              |#
+    #| Description: Relaxation pass. Every la of a text label and every branch to a   |#
+    #|    label starts in its short form (one instruction). The text is placed with   |#
+    #|    the current sizes and the instructions whose target is out of reach grow to |#
+    #|    their long form (lui + addi, inverted branch over a jal), until no size     |#
+    #|    changes. A round only computes the running sum of the sizes and looks the   |#
+    #|    targets up by their index in it, sizes only grow so the loop ends. An la    |#
+    #|    whose final address fits one instruction keeps the lui + addi pair once it  |#
+    #|    has grown. The expanded instructions are then stored with add_instruction() |#
+    #+--------------------------------------------------------------------------------+#
+    def relax(self):
+        text = self.text
+        symbol_table = self.symbol_table
+        #Index of the source instruction that follows every text label
+        positions = dict(self.text_labels)
+        relaxable = []
+        for i, (_, self.line_number, _, kind, label) in enumerate(text):
+            if kind is None:
+                continue
+            if label in positions:
+                relaxable.append((i, kind, positions[label]))
+            elif label not in symbol_table:
+                self.undefined_symbol(label)
+
+        sizes = [entry[2] for entry in text]
+        start = int(prog_seg_start_addr, 16)
+        while True:
+            PCs = list(itertools.accumulate((4 * size for size in sizes), initial=start))
+            grown = False
+            for i, kind, position in relaxable:
+                if sizes[i] > 1:
+                    continue
+                target = PCs[position]
+                if kind == 'la':
+                    hi, lo = split_hi_lo(target)
+                    fits = hi == 0 or lo == 0
+                else:
+                    fits = BRANCH_RANGE[0] <= target - PCs[i] <= BRANCH_RANGE[1]
+                if not fits:
+                    sizes[i] = 2
+                    grown = True
+            if not grown:
+                break
+
+        for label, position in self.text_labels:
+            symbol_table[label] = PCs[position]
+        for (line, self.line_number, _, _, _), size, PC in zip(text, sizes, PCs):
+            if isinstance(line, str):
+                #RV32I instruction kept as text
+                self.add_instruction(PC, line)
+                continue
+            for instruction in self.expand_source(line, size):
+                self.add_instruction(PC, instruction)
+                PC += 4
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: undefined_symbol(string)                                             |#
+    #| Description: Called by relax() for a branch/la target that is not defined      |#
+    #+--------------------------------------------------------------------------------+#
+    def undefined_symbol(self, label):
+        raise SourceError(f"Assemble Error! Label '{label}' is not defined!", label, -1)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: expand_source(string, int)                                           |#
+    #| Description: Expands a source instruction into the number of instructions      |#
+    #|    chosen by relax() (the long form if the short one does not have that size)  |#
+    #| Output:                                                                        |#
+    #|    list - the RV32I assembly instructions                                      |#
+    #+--------------------------------------------------------------------------------+#
+    def expand_source(self, line, size):
+        instructions = expand_pseudo(line, self.symbol_table)
+        if len(instructions) != size:
+            instructions = expand_pseudo(line, self.symbol_table, long_form=True)
+        return instructions
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: add_instruction(int, string)                                         |#
+    #| Description: Stores an instruction of the text segment for the second pass     |#
+    #+--------------------------------------------------------------------------------+#
+    def add_instruction(self, PC, line):
+        self.prog_seg[PC] = line
+        self.line_map.append(self.line_number)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: second_pass()                                                        |#
+    #| Description: Second Iteration                                                  |#
+    #|    1) Convert the menmonics into machine code                                  |#
+    #| Output:                                                                        |#
+    #|    array('I') - the machine words of the program memory                        |#
+    #+--------------------------------------------------------------------------------+#
+    def second_pass(self):
+        pfm = array('I')
+        symbol_table = self.symbol_table
+        try:
+            for PC, line in self.prog_seg.items():
+                #Trasnslate the assembly instruction into machine code
+                pfm.append(translate_menmonic(line, PC, symbol_table))
+        except ValueError:
+            #Source line of the instruction for the error location
+            self.line_number = self.line_map[len(pfm)]
+            raise
+        return pfm
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: data_memory()                                                        |#
+    #| Description: Packs the data segment into the DFM content                       |#
+    #| Output:                                                                        |#
+    #|    bytearray - the data memory content starting at data_seg_start_addr         |#
+    #+--------------------------------------------------------------------------------+#
+    def data_memory(self):
+        return self.data_seg.contents()
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: StreamingAssembler                                                          |#
+#| Description: Single pass version of the Assembler for very large (generated)       |#
+#|    sources. The lines are consumed from any iterable (e.g. an open file) and every |#
+#|    instruction is encoded as soon as it is read into a preallocated PFM buffer, so |#
+#|    the source text is never held in memory. A branch/jump to a label that is not   |#
+#|    defined yet is encoded with a 0 offset and recorded as a fixup, the offset is   |#
+#|    patched in at the end. An instruction that refers to a variable declared later  |#
+#|    (data segment after the text segment) is translated again at the end. The      |#
+#|    images are the same as the ones of the two pass Assembler, except for an la of  |#
+#|    a label that is not defined yet: it is always a lui + addi pair (no relaxation) |#
+#+------------------------------------------------------------------------------------+#
+class StreamingAssembler(Assembler):
+    def __init__(self):
+        super().__init__()
+        self.pfm = array('I')
+        self.size = 0
+        self.fixups = []
+        self.deferred = []
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: assemble(iterable, string)                                           |#
+    #| Description: Assembles a program                                               |#
+    #| Input:                                                                         |#
+    #|    iterable - the lines of the assembly file (or the whole source as a string) |#
+    #|    string - the name of the source in the error messages (file path)           |#
+    #| Output:                                                                        |#
+    #|    Image - the PFM and DFM content of the program                              |#
+    #+--------------------------------------------------------------------------------+#
+    def assemble(self, lines, name=SOURCE_NAME):
+        if isinstance(lines, str):
+            lines = lines.splitlines()
+        self.symbol_table = {}
+        self.prog_seg = {}
+        self.data_seg = DataSegment()
+        prog_seg_size = int(prog_seg_end_addr, 16) + 1 - int(prog_seg_start_addr, 16)
+        self.pfm = array('I', bytes(prog_seg_size))
+        self.size = 0
+        self.fixups = []
+        self.deferred = []
+        self.line_map = array('I')
+        self.line_number = 0
+        self.text_labels = []
+        self.exports = {}
+        #The lines are not kept, the errors of the end of the pass only have the line number
+        self.source_name = name
+        self.source = ''
+
+        try:
+            self.first_pass(lines)
+            return Image(self.second_pass(), self.data_memory(), self.symbol_table, self.line_map)
+        except ValueError as err:
+            raise self.located(err) from err
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: add_source(int, string)                                              |#
+    #| Description: Expands and encodes a source instruction. The address of an la of |#
+    #|    a label that is not defined yet is patched into a lui + addi pair at the end|#
+    #| Output:                                                                        |#
+    #|    int - the PC of the next instruction                                        |#
+    #+--------------------------------------------------------------------------------+#
+    def add_source(self, PC, line):
+        instr = to_instruction(line)
+        if instr.mnemonic.lower() == 'la' and instr.operands[1] not in self.symbol_table:
+            rd = instr.operands[0]
+            self.fixups.append(((PC - int(prog_seg_start_addr, 16)) >> 2, PC, 'LA', instr.operands[1]))
+            instructions = [f'lui {rd}, 0', f'addi {rd}, {rd}, 0']
+        else:
+            instructions = expand_pseudo(instr, self.symbol_table)
+            kind, label = relax_target(instr, self.symbol_table)
+            #Backward branch out of reach, a forward one is checked when it is patched
+            if kind == 'branch' and label in self.symbol_table and \
+               not BRANCH_RANGE[0] <= self.symbol_table[label] - PC <= BRANCH_RANGE[1]:
+                instructions = expand_pseudo(instr, self.symbol_table, long_form=True)
+        for instruction in instructions:
+            self.add_instruction(PC, instruction)
+            PC += 4
+        return PC
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: add_instruction(int, string)                                         |#
+    #| Description: Encodes an instruction into the PFM buffer                        |#
+    #+--------------------------------------------------------------------------------+#
+    def add_instruction(self, PC, line):
+        index = (PC - int(prog_seg_start_addr, 16)) >> 2
+        if index >= len(self.pfm):
+            raise ValueError("Assemble Error! Program Segment is full!")
+        self.size = index + 1
+        self.line_map.append(self.line_number)
+
+        instr = to_instruction(line)
+        if instr.type in ('B', 'J') and instr.symbol is not None and is_forward_label(instr.symbol, self.symbol_table):
+            #Encoded with a 0 offset
+            self.fixups.append((index, PC, instr.type, instr.symbol))
+            self.pfm[index] = instr.word
+            return
+        try:
+            self.pfm[index] = encode_instruction(instr, PC, self.symbol_table)
+        except ValueError:
+            #Operand that is not known yet, the error is raised at the end if it still fails
+            self.deferred.append((index, PC, line))
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: second_pass()                                                        |#
+    #| Description: Patches the fixups once every label is known                      |#
+    #| Output:                                                                        |#
+    #|    array('I') - the machine words of the program memory                        |#
+    #+--------------------------------------------------------------------------------+#
+    def second_pass(self):
+        pfm = self.pfm
+        symbol_table = self.symbol_table
+        for index, PC, line in self.deferred:
+            self.line_number = self.line_map[index]
+            pfm[index] = translate_menmonic(line, PC, symbol_table)
+        for index, PC, instr_type, label in self.fixups:
+            self.line_number = self.line_map[index]
+            if label not in symbol_table:
+                raise SourceError(f"Assemble Error! Label '{label}' is not defined!", label, -1)
+            if instr_type == 'B':
+                offset = check_target_range(label, symbol_table[label] - PC, BRANCH_RANGE)
+                pfm[index] |= Btype_immediate(offset & 0x1FFF)
+            elif instr_type == 'LA':
+                address = riscv_debug_map.symbol_addresses({label: symbol_table[label]})[label][0]
+                hi, lo = split_hi_lo(address)
+                pfm[index] |= hi
+                pfm[index + 1] |= (lo & 0xFFF) << 20
+            else:
+                offset = check_target_range(label, symbol_table[label] - PC, JUMP_RANGE)
+                pfm[index] |= Jtype_immediate(offset & 0x1FFFFF)
+        del pfm[self.size:]
+        return pfm
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: is_forward_label(string, dict)                                           |#
+#| Description: Tests if a branch/jump target is a label that is not defined yet      |#
+#|    (neither a known symbol nor a number)                                           |#
+#+------------------------------------------------------------------------------------+#
+def is_forward_label(target, symbol_table):
+    if target in symbol_table:
+        return False
+    try:
+        strval2int(target, 32)
+    except ValueError:
+        return True
+    return False
 
 
 #+------------------------------------------------------------------------------------+#
-#|                                Global Variable Space                               |#
+#| Class: ObjectAssembler                                                             |#
+#| Description: Assembles one module of a program into a relocatable object           |#
+#|    (riscv_object.ObjectFile) for riscv_linker.py. The text starts at address 0     |#
+#|    without the gp initialization. Branches/jumps to the labels of the module are   |#
+#|    resolved here (the text of a module is placed in one piece), the fields that    |#
+#|    depend on the final layout get a relocation entry and are encoded as 0:         |#
+#|    branches/jumps to labels of other modules, the gp relative offsets of the data  |#
+#|    symbols and the lui %hi/addi %lo pair of an la of a text label or of a symbol   |#
+#|    of another module (la does not know the section of an undefined symbol, so it   |#
+#|    always loads the absolute address). The symbols named by .globl are exported   |#
 #+------------------------------------------------------------------------------------+#
-#Declare the symbol table as a map (dictionary)
-symbol_table = {}
-#Declare maps in which the program and data segments will be stored
-prog_seg = {}
-data_seg = {}
+class ObjectAssembler(Assembler):
+    startup = False
+
+    def __init__(self):
+        super().__init__()
+        self.relocations = []
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: assemble(string, string)                                             |#
+    #| Description: Assembles the source code of a module                             |#
+    #| Input:                                                                         |#
+    #|    string - the content of an assembly file (.asm)                             |#
+    #|    string - the name of the source in the error messages (file path)           |#
+    #| Output:                                                                        |#
+    #|    ObjectFile - the relocatable object of the module                           |#
+    #+--------------------------------------------------------------------------------+#
+    def assemble(self, source, name=SOURCE_NAME):
+        self.relocations = []
+        image = super().assemble(source, name)
+
+        gp = global_pointer()
+        prog_start, data_start = int(prog_seg_start_addr, 16), int(data_seg_start_addr, 16)
+        symbols = {}
+        for symbol, value in self.symbol_table.items():
+            if isinstance(value, str):
+                #gp relative 12 bit offset of a data variable
+                address = gp + ((int(value, 16) ^ 0x800) - 0x800)
+                symbols[symbol] = (riscv_object.DATA, address - data_start, symbol in self.exports)
+            else:
+                symbols[symbol] = (riscv_object.TEXT, value - prog_start, symbol in self.exports)
+        missing = sorted(set(self.exports) - set(symbols))
+        if missing:
+            #Reported at the .globl of the symbol
+            self.line_number = self.exports[missing[0]]
+            raise self.located(SourceError(f"Assemble Error! Exported symbol '{missing[0]}' is not defined!",
+                                           missing[0]))
+        digest = riscv_object.source_digest(source, ASSEMBLER_VERSION, assembler_config())
+        return riscv_object.ObjectFile(image.pfm, image.dfm, symbols, self.relocations, digest)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: add_source(int, string)                                              |#
+    #| Description: Stores a source instruction, an la that is not gp relative always |#
+    #|    takes the lui + addi pair                                                   |#
+    #| Output:                                                                        |#
+    #|    int - the PC of the next instruction                                        |#
+    #+--------------------------------------------------------------------------------+#
+    def add_source(self, PC, line):
+        if isinstance(line, str) and line.split(None, 1)[0].lower() != 'la':
+            return super().add_source(PC, line)
+        instr = to_instruction(line)
+        kind, label = relax_target(instr, self.symbol_table)
+        if kind == 'la':
+            self.text.append((instr, self.line_number, 2, None, label))
+            return PC + 8
+        return super().add_source(PC, line)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: undefined_symbol(string)                                             |#
+    #| Description: A branch target that is not defined in the module is imported     |#
+    #+--------------------------------------------------------------------------------+#
+    def undefined_symbol(self, label):
+        pass
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: expand_source(string, int)                                           |#
+    #| Description: Expands a source instruction, the la pair refers to its symbol    |#
+    #|    with %hi/%lo for second_pass()                                              |#
+    #| Output:                                                                        |#
+    #|    list - the RV32I assembly instructions                                      |#
+    #+--------------------------------------------------------------------------------+#
+    def expand_source(self, line, size):
+        instr = to_instruction(line)
+        if instr.mnemonic.lower() == 'la' and size == 2:
+            rd, label = instr.operands
+            return [f'lui {rd}, %hi({label})', f'addi {rd}, {rd}, %lo({label})']
+        return super().expand_source(line, size)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: second_pass()                                                        |#
+    #| Description: Converts the mnemonics into machine code, the relocated operands  |#
+    #|    are encoded as 0                                                            |#
+    #| Output:                                                                        |#
+    #|    array('I') - the machine words of the module                                |#
+    #+--------------------------------------------------------------------------------+#
+    def second_pass(self):
+        pfm = array('I')
+        symbol_table = self.symbol_table
+        try:
+            for PC, line in self.prog_seg.items():
+                instr = to_instruction(line)
+                relocation = self.relocation(instr)
+                if relocation is None:
+                    pfm.append(encode_instruction(instr, PC, symbol_table))
+                else:
+                    self.relocations.append((len(pfm),) + relocation)
+                    pfm.append(instr.word)
+        except ValueError:
+            self.line_number = self.line_map[len(pfm)]
+            raise
+        return pfm
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: relocation(Instruction)                                              |#
+    #| Description: Returns the relocation an instruction needs (its symbolic operand |#
+    #|    depends on the final layout)                                                |#
+    #| Input:                                                                         |#
+    #|    Instruction - the parsed instruction                                        |#
+    #| Output:                                                                        |#
+    #|    tuple - (relocation type, symbol name), None if the instruction does not    |#
+    #|            need one                                                            |#
+    #+--------------------------------------------------------------------------------+#
+    def relocation(self, instr):
+        symbol_table = self.symbol_table
+        symbol = instr.symbol
+        if symbol is None:
+            return None
+        if symbol.startswith('%hi(') or symbol.startswith('%lo('):
+            return (riscv_object.R_HI20 if symbol.startswith('%hi(') else riscv_object.R_LO12), symbol[4:-1]
+        if instr.type in ('B', 'J'):
+            if is_forward_label(symbol, symbol_table):
+                return (riscv_object.R_BRANCH if instr.type == 'B' else riscv_object.R_JUMP), symbol
+        #symbol(base) of lw/sw, symbol of the addi of an la
+        elif instr.type in ('I', 'S') and (isinstance(symbol_table.get(symbol), str) or
+                                          is_forward_label(symbol, symbol_table)):
+            return riscv_object.R_GPREL, symbol
+        return None
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: assemble(string, bool, string)                                           |#
+#| Description: Assembles the source code of a program with a new Assembler object    |#
+#| Input:                                                                             |#
+#|    string - the content of an assembly file (.asm)                                 |#
+#|    bool - run the peephole optimizer (-O)                                          |#
+#|    string - the name of the source in the error messages (file path)               |#
+#| Output:                                                                            |#
+#|    Image - the PFM and DFM content of the program                                  |#
+#+------------------------------------------------------------------------------------+#
+def assemble(source, optimize=False, name=SOURCE_NAME):
+    return Assembler(optimize).assemble(source, name)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: assemble_file(string, bool)                                              |#
+#| Description: Reads an assembly file and assembles it                               |#
+#| Input:                                                                             |#
+#|    string - the path of an assembly file (.asm)                                    |#
+#|    bool - run the peephole optimizer (-O)                                          |#
+#| Output:                                                                            |#
+#|    Image - the PFM and DFM content of the program                                  |#
+#+------------------------------------------------------------------------------------+#
+def assemble_file(asm_path, optimize=False):
+    with open(asm_path, "r") as asm_file:
+        return assemble(asm_file.read(), optimize, str(asm_path))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: assemble_object(string, string)                                          |#
+#| Description: Assembles the source code of a module into a relocatable object       |#
+#| Input:                                                                             |#
+#|    string - the content of an assembly file (.asm)                                 |#
+#|    string - the name of the source in the error messages (file path)               |#
+#| Output:                                                                            |#
+#|    ObjectFile - the relocatable object of the module                               |#
+#+------------------------------------------------------------------------------------+#
+def assemble_object(source, name=SOURCE_NAME):
+    return ObjectAssembler().assemble(source, name)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: assemble_file_streaming(string)                                          |#
+#| Description: Assembles an assembly file line by line with the StreamingAssembler   |#
+#| Input:                                                                             |#
+#|    string - the path of an assembly file (.asm)                                    |#
+#| Output:                                                                            |#
+#|    Image - the PFM and DFM content of the program                                  |#
+#+------------------------------------------------------------------------------------+#
+def assemble_file_streaming(asm_path):
+    with open(asm_path, "r") as asm_file:
+        return StreamingAssembler().assemble(asm_file, str(asm_path))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: open_build_cache(string, int, bool)                                      |#
+#| Description: Opens the build cache of the current assembler version/configuration  |#
+#| Input:                                                                             |#
+#|    string - the cache directory                                                    |#
+#|    int - the maximum size of the cache in bytes                                    |#
+#|    bool - the images are built with the peephole optimizer (-O)                    |#
+#| Output:                                                                            |#
+#|    BuildCache - the cache object                                                   |#
+#+------------------------------------------------------------------------------------+#
+def open_build_cache(cache_dir, max_bytes=riscv_build_cache.DEFAULT_MAX_BYTES, optimize=False):
+    return riscv_build_cache.BuildCache(cache_dir, ASSEMBLER_VERSION, assembler_config(optimize), max_bytes)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: assemble_file_cached(string, BuildCache, bool)                           |#
+#| Description: Reads an assembly file and takes its images from the build cache, the |#
+#|    file is only assembled (and added to the cache) on a miss                       |#
+#| Input:                                                                             |#
+#|    string - the path of an assembly file (.asm)                                    |#
+#|    BuildCache - the build cache (None to always assemble), opened with the same    |#
+#|                 optimize option                                                    |#
+#|    bool - run the peephole optimizer (-O)                                          |#
+#| Output:                                                                            |#
+#|    Image - the PFM and DFM content of the program                                  |#
+#+------------------------------------------------------------------------------------+#
+def assemble_file_cached(asm_path, cache, optimize=False):
+    with open(asm_path, "r") as asm_file:
+        source = asm_file.read()
+    if cache is None:
+        return assemble(source, optimize, str(asm_path))
+
+    entry = cache.lookup(source)
+    if entry is not None:
+        return Image(*entry)
+    image = assemble(source, optimize, str(asm_path))
+    cache.store(source, image.pfm, image.dfm, image.symbol_table, image.line_map)
+    return image
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_image(Image, string, iterable, bool)                               |#
+#| Description: Generates the programming files for PFM and DFM memory in the         |#
+#|    selected formats (riscv_image_formats.FORMATS, .bin/.hex by default)            |#
+#| Input:                                                                             |#
+#|    Image - the assembled program                                                   |#
+#|    string - the output directory                                                   |#
+#|    iterable - the format names                                                     |#
+#|    bool - leave the runs of 0 words out of the formats with address records        |#
+#| Output:                                                                            |#
+#|    void                                                                            |#
+#+------------------------------------------------------------------------------------+#
+def write_image(image, out_dir='.', formats=riscv_image_formats.DEFAULT_FORMATS, sparse=False):
+    riscv_image_formats.write_memory(os.path.join(out_dir, "pfm"), int(prog_seg_start_addr, 16), image.pfm,
+                                     formats, sparse)
+    riscv_image_formats.write_memory(os.path.join(out_dir, "dfm"), int(data_seg_start_addr, 16), image.dfm_words(),
+                                     formats, sparse)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: collect_batch_files(list, string)                                        |#
+#| Description: Builds the list of assembly files of a batch run from glob patterns   |#
+#|    (recursive '**' is allowed) and/or a manifest file that contains one path per   |#
+#|    line ('#' comments allowed, relative paths are relative to the manifest)        |#
+#| Input:                                                                             |#
+#|    list - glob patterns                                                            |#
+#|    string - path of the manifest file (or None)                                    |#
+#|    iterable - more assembly file paths                                             |#
+#| Output:                                                                            |#
+#|    list - sorted list of unique assembly file paths                                |#
+#+------------------------------------------------------------------------------------+#
+def collect_batch_files(patterns, manifest=None, extra_paths=()):
+    asm_paths = set()
+    for pattern in patterns or []:
+        asm_paths.update(glob.glob(pattern, recursive=True))
+
+    if manifest is not None:
+        manifest_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, "r") as manifest_file:
+            for line in manifest_file:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    asm_paths.add(os.path.join(manifest_dir, line))
+    asm_paths.update(extra_paths)
+
+    #The same file given by a relative and an absolute path is assembled once
+    unique = {}
+    for asm_path in sorted(asm_paths):
+        unique.setdefault(os.path.abspath(asm_path), asm_path)
+    return sorted(unique.values())
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: check_batch_outputs(list)                                                |#
+#| Description: Raises an error if two files of a batch run are in the same directory |#
+#|    (their pfm/dfm files would overwrite each other)                                |#
+#+------------------------------------------------------------------------------------+#
+def check_batch_outputs(asm_paths):
+    out_dirs = {}
+    for asm_path in asm_paths:
+        out_dir = os.path.dirname(os.path.abspath(asm_path))
+        if out_dir in out_dirs:
+            raise ValueError(f"Batch Error! '{out_dirs[out_dir]}' and '{asm_path}' would write their pfm/dfm files "
+                             f"to the same directory, keep one program per directory!")
+        out_dirs[out_dir] = asm_path
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: assemble_next_to_source(string, string, int, iterable, bool, bool)       |#
+#| Description: Assembles one file and writes its pfm/dfm files in the same directory |#
+#|    as the source. This is the job executed by the batch worker processes           |#
+#| Input:                                                                             |#
+#|    string - the path of an assembly file (.asm)                                    |#
+#|    string - the build cache directory (None to disable the cache)                  |#
+#|    int - the maximum size of the build cache in bytes                              |#
+#|    iterable - the output format names                                              |#
+#|    bool - run the peephole optimizer (-O)                                          |#
+#|    bool - leave the runs of 0 words out of the formats with address records        |#
+#| Output:                                                                            |#
+#|    tuple - (path, error message or None, CacheStats or None)                       |#
+#+------------------------------------------------------------------------------------+#
+def assemble_next_to_source(asm_path, cache_dir=None, cache_size=riscv_build_cache.DEFAULT_MAX_BYTES,
+                            formats=riscv_image_formats.DEFAULT_FORMATS, optimize=False, sparse=False):
+    cache = open_build_cache(cache_dir, cache_size, optimize) if cache_dir else None
+    try:
+        write_image(assemble_file_cached(asm_path, cache, optimize), os.path.dirname(asm_path) or '.', formats,
+                    sparse)
+    except Exception as err:
+        return asm_path, f"{type(err).__name__}: {err}", cache and cache.stats
+    return asm_path, None, cache and cache.stats
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: assemble_batch(list, int, string, int, iterable, bool, bool)             |#
+#| Description: Assembles a list of files on a pool of worker processes, every image  |#
+#|    is written next to its source (one source per directory, checked by             |#
+#|    check_batch_outputs()). Files are handed out in chunks so that the              |#
+#|    inter-process traffic stays small compared to the assembly work                 |#
+#| Input:                                                                             |#
+#|    list - the paths of the assembly files                                          |#
+#|    int - number of worker processes (os.cpu_count() if None, 1 runs in-process)    |#
+#|    string - the build cache directory (None to disable the cache)                  |#
+#|    int - the maximum size of the build cache in bytes                              |#
+#|    iterable - the output format names                                              |#
+#|    bool - run the peephole optimizer (-O)                                          |#
+#|    bool - leave the runs of 0 words out of the formats with address records        |#
+#| Output:                                                                            |#
+#|    list - (path, error message or None, CacheStats or None) for every file, in the |#
+#|           input order                                                              |#
+#+------------------------------------------------------------------------------------+#
+def assemble_batch(asm_paths, jobs=None, cache_dir=None, cache_size=riscv_build_cache.DEFAULT_MAX_BYTES,
+                   formats=riscv_image_formats.DEFAULT_FORMATS, optimize=False, sparse=False):
+    check_batch_outputs(asm_paths)
+    job = functools.partial(assemble_next_to_source, cache_dir=cache_dir, cache_size=cache_size, formats=formats,
+                            optimize=optimize, sparse=sparse)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(asm_paths) <= 1:
+        return [job(asm_path) for asm_path in asm_paths]
+
+    chunksize = max(1, len(asm_paths) // (jobs * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(job, asm_paths, chunksize=chunksize))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: print_batch_summary(list)                                                |#
+#| Description: Prints the result of every file of a batch run and the totals         |#
+#| Input:                                                                             |#
+#|    list - (path, error message or None, CacheStats or None) for every file         |#
+#| Output:                                                                            |#
+#|    int - the number of files that failed                                           |#
+#+------------------------------------------------------------------------------------+#
+def print_batch_summary(results):
+    failed = 0
+    for asm_path, error, stats in results:
+        if error is not None:
+            failed += 1
+            print(f"FAIL  {asm_path}: {error}")
+        elif stats is not None and stats.hits:
+            print(f"OK    {asm_path} (cached)")
+        else:
+            print(f"OK    {asm_path}")
+    print(f"{len(results)} file(s) assembled, {len(results) - failed} passed, {failed} failed")
+    return failed
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: main(list)                                                               |#
+#| Description: This is the main function (command line entry point)                  |#
+#| Input:                                                                             |#
+#|    list - the command line arguments (sys.argv[1:] if None)                        |#
+#| Output:                                                                            |#
+#|    int - the exit code                                                             |#
+#+------------------------------------------------------------------------------------+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RV32I assembler, generates the pfm/dfm memory files")
+    parser.add_argument("asm_file", nargs="?", help="assembly source file (.asm)")
+    parser.add_argument("-o", "--output-dir", default=".", help="directory of the pfm/dfm files (default: current directory)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not print the data memory map")
+    parser.add_argument("-b", "--batch", action="append", metavar="GLOB",
+                        help="batch mode: assemble every file matching GLOB, images are written next to the sources")
+    parser.add_argument("-m", "--manifest", help="batch mode: file with one .asm path per line")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="batch mode: number of worker processes (default: all cores)")
+    parser.add_argument("--cache-dir", help="reuse the images of unchanged sources from this build cache directory")
+    parser.add_argument("--cache-size", type=int, default=riscv_build_cache.DEFAULT_MAX_BYTES // (1024*1024),
+                        metavar="MB", help="build cache size limit, least recently used entries are evicted (default: %(default)s)")
+    parser.add_argument("--cache-stats", action="store_true", help="print the build cache hits/misses report")
+    parser.add_argument("-f", "--format", action="append", choices=sorted(riscv_image_formats.FORMATS),
+                        help="output format, repeat for several formats (default: bin and hex): bin ($readmemb), "
+                             "hex (0x prefixed words), img (raw Little Endian), ihex (Intel HEX), "
+                             "memh ($readmemh with @addr records)")
+    parser.add_argument("--sparse", action="store_true",
+                        help="leave the runs of 0 words out of the ihex/memh files (the memory must be 0 initialized)")
+    parser.add_argument("-l", "--listing", action="store_true",
+                        help="write the listing <program>.lst (address, word, file:line, source) in the output directory")
+    parser.add_argument("--debug-map", action="store_true",
+                        help="write the debug map <program>.map.json (source line of every PFM word and symbol addresses)")
+    parser.add_argument("--stream", action="store_true",
+                        help="single pass assembly that reads the source line by line (for very large sources)")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="peephole optimizer: removes dead moves and redundant loads, folds constants and "
+                             "fills load use slots (prints the estimated cycles saved)")
+    parser.add_argument("-c", "--object", action="store_true",
+                        help="assemble one module into the relocatable object <program>.rvo in the output directory "
+                             "(linked with riscv_linker.py)")
+    args = parser.parse_args(argv)
+    cache_size = args.cache_size * 1024 * 1024
+    formats = args.format or riscv_image_formats.DEFAULT_FORMATS
+
+    if args.batch or args.manifest:
+        if args.listing or args.debug_map or args.stream or args.object:
+            parser.error("--listing, --debug-map, --stream and --object cannot be combined with --batch/--manifest")
+        asm_paths = collect_batch_files(args.batch, args.manifest, [args.asm_file] if args.asm_file else [])
+        try:
+            results = assemble_batch(asm_paths, args.jobs, args.cache_dir, cache_size, formats, args.optimize,
+                                     args.sparse)
+        except ValueError as err:
+            parser.error(str(err))
+        failed = print_batch_summary(results)
+        if args.cache_stats and args.cache_dir:
+            stats = riscv_build_cache.CacheStats()
+            for _, _, file_stats in results:
+                stats.merge(file_stats)
+            print(stats.report())
+        return 1 if failed or not asm_paths else 0
+
+    if args.asm_file is None:
+        parser.error("an assembly file or --batch/--manifest is required")
+
+    if args.stream and args.cache_dir:
+        parser.error("--stream cannot be combined with --cache-dir (the cache key needs the whole source)")
+    if args.stream and args.optimize:
+        parser.error("--stream cannot be combined with -O (the optimizer needs the whole text segment)")
+    if args.object and (args.stream or args.optimize or args.cache_dir):
+        parser.error("--object cannot be combined with --stream, -O or --cache-dir")
+    if args.object:
+        with open(args.asm_file, "r") as asm_file:
+            obj = assemble_object(asm_file.read(), args.asm_file)
+        program = os.path.join(args.output_dir, os.path.splitext(os.path.basename(args.asm_file))[0])
+        riscv_object.write_object(obj, program + riscv_object.OBJECT_SUFFIX)
+        return 0
+    cache = open_build_cache(args.cache_dir, cache_size, args.optimize) if args.cache_dir else None
+    if args.stream:
+        image = assemble_file_streaming(args.asm_file)
+    else:
+        image = assemble_file_cached(args.asm_file, cache, args.optimize)
+    if image.peephole is not None:
+        print(image.peephole.report())
+    elif args.optimize:
+        #The statistics of the optimizer are not part of the cache entries
+        print("peephole: unchanged source, the optimized images were taken from the build cache")
+    write_image(image, args.output_dir, formats, args.sparse)
+    program = os.path.join(args.output_dir, os.path.splitext(os.path.basename(args.asm_file))[0])
+    if args.listing:
+        riscv_debug_map.write_listing(image, args.asm_file, program + ".lst")
+    if args.debug_map:
+        riscv_debug_map.write_debug_map(image, args.asm_file, program + ".map.json")
+    if args.cache_stats and cache is not None:
+        print(cache.stats.report())
+
+    if not args.quiet:
+        #Print the Data memory Map
+        print_data_memory_map(image.dfm + bytes(-len(image.dfm) % 4), int(data_seg_start_addr, 16))
+    return 0
 
 
-#Execute the main()
-main() 
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
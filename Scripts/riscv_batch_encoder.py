@@ -0,0 +1,186 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Vectorized (NumPy) encoder for large generated instruction streams.     #
+#              The instructions are given as columns (mnemonic id, rd, rs1, rs2, imm)  #
+#              and are packed with the field layouts of the build_*type_instr          #
+#              functions of riscv_assembler.py in a few array passes, without going    #
+#              through the assembly text.                                              #
+# Input: Columnar instruction arrays                                                   #
+# Output: uint32 machine word array and the pfm .bin/.hex memory files                 #
+########################################################################################
+
+import riscv_assembler
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#Mnemonic ids, the position of every (lower case) mnemonic of the assembler tables
+MNEMONICS = tuple(mnemonic for mnemonic in riscv_assembler.opc if mnemonic.islower())
+MNEMONIC_ID = {mnemonic: index for index, mnemonic in enumerate(MNEMONICS)}
+
+#Instruction type codes of the TYPE table
+TYPE_R, TYPE_I, TYPE_S, TYPE_B, TYPE_U, TYPE_J = range(6)
+TYPE_CODE = {'R': TYPE_R, 'I': TYPE_I, 'S': TYPE_S, 'B': TYPE_B, 'U': TYPE_U, 'J': TYPE_J}
+
+#Length in bits of the immediate operand of every instruction type (same as the
+#immediate_field_length of the build_*type_instr functions, R-type has none)
+IMMEDIATE_LENGTH = {TYPE_I: 12, TYPE_S: 12, TYPE_B: 13, TYPE_U: 32, TYPE_J: 21}
+
+#Per mnemonic encoding tables (indexed by mnemonic id)
+OPCODE = [riscv_assembler.opc_int[mnemonic] for mnemonic in MNEMONICS]
+FUNCT3 = [riscv_assembler.function3_int.get(mnemonic, 0) for mnemonic in MNEMONICS]
+FUNCT7 = [riscv_assembler.function7_int.get(mnemonic, 0) for mnemonic in MNEMONICS]
+TYPE   = [TYPE_CODE[riscv_assembler.instrcution_type[mnemonic]] for mnemonic in MNEMONICS]
+#I-type shifts (slli/srli/srai), their funct7 takes the upper bits of the immediate field
+SHIFT  = [mnemonic in riscv_assembler.function7_int and TYPE[index] == TYPE_I
+          for index, mnemonic in enumerate(MNEMONICS)]
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: require_numpy()                                                          |#
+#| Description: Raises an error if NumPy is not installed                             |#
+#+------------------------------------------------------------------------------------+#
+def require_numpy():
+    if np is None:
+        raise ImportError("Batch Encoder Error! The batch encoder requires NumPy (pip install numpy)!")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: mnemonic_ids(iterable)                                                   |#
+#| Description: Converts mnemonics (any case) to the mnemonic id column               |#
+#| Input:                                                                             |#
+#|    iterable - the mnemonics                                                        |#
+#| Output:                                                                            |#
+#|    ndarray - uint8 mnemonic ids                                                    |#
+#+------------------------------------------------------------------------------------+#
+def mnemonic_ids(mnemonics):
+    require_numpy()
+    try:
+        return np.array([MNEMONIC_ID[mnemonic.lower()] for mnemonic in mnemonics], dtype=np.uint8)
+    except KeyError as err:
+        raise ValueError(f"Syntax Error! Unsupported RV32I instruction {err}!") from None
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: check_range(ndarray, ndarray, int, int, string)                          |#
+#| Description: Raises an error that names the first element outside [low, high]      |#
+#+------------------------------------------------------------------------------------+#
+def check_range(values, selected, low, high, what):
+    bad = selected & ((values < low) | (values > high))
+    if bad.any():
+        index = int(np.argmax(bad))
+        raise ValueError(f"Assemble Error! Instruction {index}: {what} {int(values[index])} is out of range "
+                         f"[{low}, {high}]!")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: encode_batch(array_like, array_like, array_like, array_like, array_like) |#
+#| Description: Encodes a batch of instructions. Every column has one element per     |#
+#|    instruction, the unused operands of an instruction type are ignored:            |#
+#|    - R-type: rd, rs1, rs2                                                          |#
+#|    - I-type: rd, rs1, imm (lw/jalr included: imm is the offset of rs1)             |#
+#|    - S-type: rs1 (base), rs2 (stored register), imm                                |#
+#|    - B-type: rs1, rs2, imm = byte offset from the branch to the target             |#
+#|    - U-type: rd, imm = the 32 bit value whose upper 20 bits are encoded            |#
+#|    - J-type: rd, imm = byte offset from the jump to the target                     |#
+#|    The immediates accept the same ranges as the assembler (two's complement or     |#
+#|    unsigned values of the field length, 0..31 for the shift amount of the I-type   |#
+#|    shifts), every column is range checked before any word is built                 |#
+#| Input:                                                                             |#
+#|    array_like - mnemonic ids (MNEMONIC_ID / mnemonic_ids())                        |#
+#|    array_like - rd register numbers                                                |#
+#|    array_like - rs1 register numbers                                               |#
+#|    array_like - rs2 register numbers                                               |#
+#|    array_like - immediates                                                         |#
+#| Output:                                                                            |#
+#|    ndarray - uint32 machine words                                                  |#
+#+------------------------------------------------------------------------------------+#
+def encode_batch(mnemonic, rd, rs1, rs2, imm):
+    require_numpy()
+    mnemonic = np.asarray(mnemonic, dtype=np.int64)
+    rd, rs1, rs2 = (np.asarray(column, dtype=np.int64) for column in (rd, rs1, rs2))
+    imm = np.asarray(imm, dtype=np.int64)
+    if not mnemonic.ndim == rd.ndim == rs1.ndim == rs2.ndim == imm.ndim == 1 or \
+       not len(mnemonic) == len(rd) == len(rs1) == len(rs2) == len(imm):
+        raise ValueError("Batch Encoder Error! The columns must be 1-D arrays of the same length!")
+
+    everything = np.ones(len(mnemonic), dtype=bool)
+    check_range(mnemonic, everything, 0, len(MNEMONICS) - 1, "mnemonic id")
+    kind = np.array(TYPE, dtype=np.int64)[mnemonic]
+    uses_rd = (kind != TYPE_S) & (kind != TYPE_B)
+    uses_rs1 = (kind != TYPE_U) & (kind != TYPE_J)
+    uses_rs2 = (kind == TYPE_R) | (kind == TYPE_S) | (kind == TYPE_B)
+    check_range(rd, uses_rd, 0, 31, "rd")
+    check_range(rs1, uses_rs1, 0, 31, "rs1")
+    check_range(rs2, uses_rs2, 0, 31, "rs2")
+    for code, length in IMMEDIATE_LENGTH.items():
+        check_range(imm, kind == code, -(1 << (length - 1)), (1 << length) - 1, f"{length} bit immediate")
+    check_range(imm, np.array(SHIFT)[mnemonic], 0, 31, "shift amount")
+
+    #Work on 64 bit integers, the negative immediates wrap around in the masks
+    word = np.array(OPCODE, dtype=np.int64)[mnemonic]
+    word |= np.array(FUNCT3, dtype=np.int64)[mnemonic] << 12
+    word |= np.where(uses_rd, rd, 0) << 7
+    word |= np.where(uses_rs1, rs1, 0) << 15
+    word |= np.where(uses_rs2, rs2, 0) << 20
+    #R-type funct7, the I-type shifts carry it in the upper bits of the immediate field
+    word |= np.where((kind == TYPE_R) | (kind == TYPE_I), np.array(FUNCT7, dtype=np.int64)[mnemonic], 0) << 25
+
+    itype = (imm & 0xFFF) << 20
+    stype = ((imm & 0xFE0) << 20) | ((imm & 0x1F) << 7)
+    #B-type: imm[12|10:5] rs2 rs1 funct3 imm[4:1|11] opcode
+    btype = (((imm >> 12) & 0x1) << 31) | (((imm >> 5) & 0x3F) << 25) | \
+            (((imm >> 1) & 0xF) << 8) | (((imm >> 11) & 0x1) << 7)
+    utype = imm & 0xFFFFF000
+    #J-type: imm[20|10:1|11|19:12] rd opcode
+    jtype = (((imm >> 20) & 0x1) << 31) | (((imm >> 1) & 0x3FF) << 21) | \
+            (((imm >> 11) & 0x1) << 20) | (((imm >> 12) & 0xFF) << 12)
+    word |= np.select([kind == TYPE_I, kind == TYPE_S, kind == TYPE_B, kind == TYPE_U, kind == TYPE_J],
+                      [itype, stype, btype, utype, jtype], 0)
+    return word.astype(np.uint32)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: format_words(ndarray, int, string)                                       |#
+#| Description: Formats the words as fixed width text lines with a digit lookup table |#
+#|    (one array pass per digit instead of one format() call per word)                |#
+#| Input:                                                                             |#
+#|    ndarray - uint32 words                                                          |#
+#|    int - bits per digit (1 for .bin, 4 for .hex)                                   |#
+#|    string - prefix of every line                                                   |#
+#| Output:                                                                            |#
+#|    bytes - the text of the memory file                                             |#
+#+------------------------------------------------------------------------------------+#
+def format_words(words, bits, prefix=''):
+    digits = 32 // bits
+    table = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+    lines = np.empty((len(words), len(prefix) + digits + 1), dtype=np.uint8)
+    lines[:, :len(prefix)] = np.frombuffer(prefix.encode(), dtype=np.uint8)
+    words = words.astype(np.uint32)
+    for digit in range(digits):
+        shift = 32 - bits * (digit + 1)
+        lines[:, len(prefix) + digit] = table[(words >> shift) & ((1 << bits) - 1)]
+    lines[:, -1] = ord('\n')
+    return lines.tobytes()
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_words(ndarray, string, string)                                     |#
+#| Description: Writes the words in the .bin/.hex memory file formats, the files are  |#
+#|    the same as the ones of riscv_assembler.write_image                             |#
+#| Input:                                                                             |#
+#|    ndarray - uint32 words                                                          |#
+#|    string - path of the .bin file                                                  |#
+#|    string - path of the .hex file                                                  |#
+#| Output:                                                                            |#
+#|    void                                                                            |#
+#+------------------------------------------------------------------------------------+#
+def write_words(words, bin_path, hex_path):
+    require_numpy()
+    words = np.asarray(words)
+    with open(bin_path, "wb") as bin_file, \
+         open(hex_path, "wb") as hex_file:
+        bin_file.write(format_words(words, 1))
+        hex_file.write(format_words(words, 4, '0x'))
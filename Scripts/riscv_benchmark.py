@@ -0,0 +1,351 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Benchmark suite of the assembler and of the instruction set simulator.  #
+#              Programs of 1k to 1M instructions (data sections up to the full 4KB     #
+#              DFM) are synthesized and assembled in a fresh worker process each, the  #
+#              instructions/sec of the parsing (first pass + relaxation), encoding     #
+#              (second pass) and output writing phases and the peak RSS of the worker  #
+#              are measured. The ISS MIPS of the step and block modes are measured on  #
+#              the checked-in test programs. The results are written as JSON and can   #
+#              be compared against a saved baseline, a slowdown beyond the tolerance   #
+#              fails the run.                                                          #
+# Input: Program sizes, test program directories, baseline JSON                        #
+# Output: Benchmark report, results JSON                                               #
+########################################################################################
+
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import riscv_assembler
+import riscv_iss
+import riscv_program_generator
+
+#resource (peak RSS) is not available on Windows, the RSS is then not measured
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#Version of the results JSON layout
+RESULTS_FORMAT = 1
+
+#Instructions of the synthesized programs
+BENCHMARK_SIZES = (1000, 10000, 100000, 1000000)
+
+#Words of the full data memory
+DFM_WORDS = (int(riscv_assembler.data_seg_end_addr, 16) + 1 - int(riscv_assembler.data_seg_start_addr, 16)) // 4
+
+#Instructions between two labels of a synthesized program (every block ends with a
+#branch back to its label, so the relaxation pass has work to do)
+BLOCK_INSTRUCTIONS = 64
+
+#A case/program is repeated until its measured time reaches MIN_TIME seconds, the best
+#time of every phase is kept
+MIN_TIME = 0.5
+
+#Instruction limit of an ISS run (the programs that never halt stop there)
+ISS_MAX_INSTRUCTIONS = 1000000
+
+#Default tolerance of the baseline comparison (0.15 = 15% slower fails)
+DEFAULT_TOLERANCE = 0.15
+
+#Compared metrics: name -> True if a higher value is better
+METRICS = {
+    'parse_ips'   : True,
+    'encode_ips'  : True,
+    'write_ips'   : True,
+    'peak_rss_kb' : False,
+    'step_mips'   : True,
+    'block_mips'  : True,
+}
+
+TEST_PROGRAMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "Verification",
+                                 "MCU_v2_Pipeline_Tests")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_synthetic_program(string, int, int)                                |#
+#| Description: Writes a synthesized program: a data section of random words and a    |#
+#|    text of random instructions (riscv_program_generator) in blocks that end with a |#
+#|    backward branch. The file is written line by line, the source is never held in  |#
+#|    memory by the parent process                                                    |#
+#| Input:                                                                             |#
+#|    string - the path of the assembly file                                          |#
+#|    int - the number of source instructions                                         |#
+#|    int - the number of data words (at least riscv_program_generator.DATA_WORDS)    |#
+#+------------------------------------------------------------------------------------+#
+def write_synthetic_program(path, instructions, data_words):
+    rng = random.Random(instructions)
+    with open(path, "w") as asm_file:
+        asm_file.write(".section .data\n")
+        for i in range(data_words):
+            asm_file.write(f"d{i}: .word {hex(rng.getrandbits(32))}\n")
+        asm_file.write(".section .text\n")
+        for i in range(instructions):
+            if i % BLOCK_INSTRUCTIONS == 0:
+                asm_file.write(f"block_{i}:\n")
+            if i % BLOCK_INSTRUCTIONS == BLOCK_INSTRUCTIONS - 1:
+                asm_file.write(f"   bne   t0, t1, block_{i - i % BLOCK_INSTRUCTIONS}\n")
+            else:
+                asm_file.write(f"   {riscv_program_generator.random_instruction(rng)}\n")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: TimedAssembler                                                              |#
+#| Description: Assembler that measures the time of its passes                        |#
+#+------------------------------------------------------------------------------------+#
+class TimedAssembler(riscv_assembler.Assembler):
+    def __init__(self):
+        super().__init__()
+        self.parse_time = 0.0
+        self.encode_time = 0.0
+
+    def first_pass(self, lines):
+        start = time.perf_counter()
+        super().first_pass(lines)
+        self.parse_time = time.perf_counter() - start
+
+    def relax(self):
+        start = time.perf_counter()
+        super().relax()
+        self.parse_time += time.perf_counter() - start
+
+    def second_pass(self):
+        start = time.perf_counter()
+        pfm = super().second_pass()
+        self.encode_time = time.perf_counter() - start
+        return pfm
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: peak_rss_kb()                                                            |#
+#| Description: Returns the peak resident set size of the process in KB (None if it   |#
+#|    cannot be measured)                                                             |#
+#+------------------------------------------------------------------------------------+#
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in KB on Linux
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: run_assembler_case(string, float)                                        |#
+#| Description: Assembles a program and writes its images, repeated until MIN_TIME is |#
+#|    reached. This is the job executed by the (fresh) worker process of a case       |#
+#| Input:                                                                             |#
+#|    string - the path of the assembly file                                          |#
+#|    float - the minimum measured time in seconds                                    |#
+#| Output:                                                                            |#
+#|    dict - the metrics of the case                                                  |#
+#+------------------------------------------------------------------------------------+#
+def run_assembler_case(asm_path, min_time=MIN_TIME):
+    with open(asm_path, "r") as asm_file:
+        source = asm_file.read()
+    best = None
+    elapsed = 0.0
+    with tempfile.TemporaryDirectory() as out_dir:
+        while best is None or elapsed < min_time:
+            asm = TimedAssembler()
+            image = asm.assemble(source)
+            start = time.perf_counter()
+            riscv_assembler.write_image(image, out_dir)
+            times = (asm.parse_time, asm.encode_time, time.perf_counter() - start)
+            best = times if best is None else tuple(map(min, best, times))
+            elapsed += sum(times)
+
+    words = len(image.pfm)
+    return {
+        'instructions' : words,
+        'data_bytes'   : len(image.dfm),
+        'parse_ips'    : words / best[0] if best[0] > 0 else 0.0,
+        'encode_ips'   : words / best[1] if best[1] > 0 else 0.0,
+        'write_ips'    : words / best[2] if best[2] > 0 else 0.0,
+        'seconds'      : sum(best),
+        'peak_rss_kb'  : peak_rss_kb(),
+    }
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: benchmark_assembler(iterable, float, bool)                               |#
+#| Description: Runs the assembler cases, every case in a new worker process so its   |#
+#|    peak RSS is not hidden by the previous (larger) cases                           |#
+#| Input:                                                                             |#
+#|    iterable - the numbers of instructions                                          |#
+#|    float - the minimum measured time of a case in seconds                          |#
+#|    bool - print the result of every case                                           |#
+#| Output:                                                                            |#
+#|    dict - number of instructions (string) -> metrics                               |#
+#+------------------------------------------------------------------------------------+#
+def benchmark_assembler(sizes, min_time=MIN_TIME, verbose=False):
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            asm_path = os.path.join(work_dir, f"bench_{size}.asm")
+            data_words = min(DFM_WORDS, max(riscv_program_generator.DATA_WORDS, size // 16))
+            write_synthetic_program(asm_path, size, data_words)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1) as pool:
+                results[str(size)] = pool.submit(run_assembler_case, asm_path, min_time).result()
+            os.remove(asm_path)
+            if verbose:
+                print(format_assembler_result(str(size), results[str(size)]))
+    return results
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: benchmark_iss(list, float, int)                                          |#
+#| Description: Measures the MIPS of the step and block modes of the ISS on the test  |#
+#|    programs (riscv_iss.benchmark_modes() repeated until MIN_TIME is reached)       |#
+#| Input:                                                                             |#
+#|    list - the test program directories (prog_NN with one .asm file)                |#
+#|    float - the minimum measured time of a program in seconds                       |#
+#|    int - the instruction limit of a run                                            |#
+#| Output:                                                                            |#
+#|    dict - program name -> metrics                                                  |#
+#+------------------------------------------------------------------------------------+#
+def benchmark_iss(program_dirs, min_time=MIN_TIME, max_instructions=ISS_MAX_INSTRUCTIONS):
+    results = {}
+    for program_dir in program_dirs:
+        asm_paths = [name for name in sorted(os.listdir(program_dir)) if name.endswith('.asm')]
+        if not asm_paths:
+            continue
+        image = riscv_assembler.assemble_file(os.path.join(program_dir, asm_paths[0]))
+        totals = {'step': [0, 0.0], 'block': [0, 0.0]}
+        while min(elapsed for _, elapsed in totals.values()) < min_time or not totals['step'][0]:
+            runs = riscv_iss.benchmark_modes(lambda: riscv_iss.Simulator.from_image(image), max_instructions)
+            for mode, (retired, elapsed, _) in runs.items():
+                totals[mode][0] += retired
+                totals[mode][1] += elapsed
+            if not totals['step'][0]:
+                break
+        results[os.path.basename(os.path.normpath(program_dir))] = {
+            'instructions' : runs['step'][0],
+            'step_mips'    : totals['step'][0] / totals['step'][1] / 1e6 if totals['step'][1] > 0 else 0.0,
+            'block_mips'   : totals['block'][0] / totals['block'][1] / 1e6 if totals['block'][1] > 0 else 0.0,
+        }
+    return results
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: compare_results(dict, dict, float)                                       |#
+#| Description: Compares the METRICS of the results with a baseline, only the cases   |#
+#|    and metrics found in both are compared                                          |#
+#| Input:                                                                             |#
+#|    dict - the baseline results                                                     |#
+#|    dict - the current results                                                      |#
+#|    float - the tolerance (0.15 = a metric 15% worse fails)                         |#
+#| Output:                                                                            |#
+#|    list - (section, case, metric, baseline, current, change, regression) where the |#
+#|           change is the relative change of the value                              |#
+#+------------------------------------------------------------------------------------+#
+def compare_results(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    rows = []
+    for section in ('assembler', 'iss'):
+        for case, metrics in current.get(section, {}).items():
+            base_metrics = baseline.get(section, {}).get(case, {})
+            for metric, higher_is_better in METRICS.items():
+                base, value = base_metrics.get(metric), metrics.get(metric)
+                if not base or value is None:
+                    continue
+                change = (value - base) / base
+                regression = change < -tolerance if higher_is_better else change > tolerance
+                rows.append((section, case, metric, base, value, change, regression))
+    return rows
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: format_assembler_result(string, dict)                                    |#
+#| Description: Formats the metrics of an assembler case as one report line           |#
+#+------------------------------------------------------------------------------------+#
+def format_assembler_result(case, metrics):
+    rss = f"{metrics['peak_rss_kb'] / 1024:8.1f} MB" if metrics['peak_rss_kb'] is not None else "       n/a"
+    return (f"asm {case:>8s} instr {metrics['data_bytes']:5d} B data  parse {metrics['parse_ips']:10.0f}/s  "
+            f"encode {metrics['encode_ips']:10.0f}/s  write {metrics['write_ips']:10.0f}/s  peak RSS {rss}")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: run_benchmarks(iterable, list, float, int, bool)                         |#
+#| Description: Runs the assembler and ISS benchmarks                                 |#
+#| Output:                                                                            |#
+#|    dict - the results (JSON serializable)                                          |#
+#+------------------------------------------------------------------------------------+#
+def run_benchmarks(sizes, program_dirs, min_time=MIN_TIME, max_instructions=ISS_MAX_INSTRUCTIONS, verbose=False):
+    results = {
+        'format'            : RESULTS_FORMAT,
+        'assembler_version' : riscv_assembler.ASSEMBLER_VERSION,
+        'python'            : platform.python_version(),
+        'platform'          : platform.platform(),
+        'assembler'         : benchmark_assembler(sizes, min_time, verbose),
+        'iss'               : benchmark_iss(program_dirs, min_time, max_instructions),
+    }
+    if verbose:
+        for name, metrics in results['iss'].items():
+            print(f"iss {name:>14s}  {metrics['instructions']:8d} instr  step {metrics['step_mips']:6.2f} MIPS  "
+                  f"block {metrics['block_mips']:6.2f} MIPS")
+    return results
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: main(list)                                                               |#
+#| Description: This is the main function (command line entry point)                  |#
+#| Input:                                                                             |#
+#|    list - the command line arguments (sys.argv[1:] if None)                        |#
+#| Output:                                                                            |#
+#|    int - the exit code (1 if a metric regressed against the baseline)              |#
+#+------------------------------------------------------------------------------------+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Assembler throughput and ISS MIPS benchmarks")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(',') if size],
+                        default=list(BENCHMARK_SIZES),
+                        help="comma separated instruction counts of the synthesized programs (default: 1k to 1M)")
+    parser.add_argument("--programs", nargs="*", default=None, metavar="DIR",
+                        help="test program directories of the ISS benchmark (default: MCU_v2_Pipeline_Tests/prog_*)")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME,
+                        help="minimum measured time of a case in seconds (default: %(default)s)")
+    parser.add_argument("--iss-max-instructions", type=int, default=ISS_MAX_INSTRUCTIONS,
+                        help="instruction limit of an ISS run (default: %(default)s)")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this baseline JSON file")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="write the results to the --baseline file instead of comparing them")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="relative slowdown/RSS growth that fails the comparison (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if args.update_baseline and not args.baseline:
+        parser.error("--update-baseline requires --baseline")
+
+    if args.programs is None:
+        args.programs = sorted(os.path.join(TEST_PROGRAMS_DIR, name) for name in os.listdir(TEST_PROGRAMS_DIR)
+                               if name.startswith('prog_'))
+    results = run_benchmarks(args.sizes, args.programs, args.min_time, args.iss_max_instructions, verbose=True)
+    if args.output:
+        with open(args.output, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+    if not args.baseline:
+        return 0
+    if args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    with open(args.baseline, "r") as baseline_file:
+        rows = compare_results(json.load(baseline_file), results, args.tolerance)
+    for section, case, metric, base, value, change, regression in rows:
+        print(f"{'SLOWER' if regression else 'ok':6s} {section:9s} {case:>14s} {metric:12s} "
+              f"{base:14.2f} -> {value:14.2f} ({100 * change:+6.1f}%)")
+    regressions = sum(row[-1] for row in rows)
+    print(f"{len(rows)} metric(s) compared, {regressions} regression(s) beyond {100 * args.tolerance:.0f}%")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,205 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: On-disk build cache for the RV32I assembler. An entry is keyed by a     #
+#              hash of the assembly source, the assembler version and the memory map   #
+#              configuration, and holds the packed PFM/DFM images, the symbol table    #
+#              and the source line of every PFM word.                                  #
+# Input: Assembly source text + assembled images                                      #
+# Output: Cache entry files (*.rvimg) in the cache directory                           #
+########################################################################################
+
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+#Cache entry layout (all fields Little Endian):
+#   magic(4s) | pfm word count(I) | dfm byte count(I) | symbol table json length(I) |
+#   line map count(I)
+#   pfm words | dfm bytes | symbol table json (utf-8) | line map words
+ENTRY_MAGIC  = b'RVC2'
+ENTRY_HEADER = struct.Struct('<4sIIII')
+ENTRY_SUFFIX = '.rvimg'
+
+#Default cache size limit 256MB
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: CacheStats                                                                  |#
+#| Description: Counters of a cache session. bytes_saved is the amount of assembly    |#
+#|    source that was not parsed because its images came from the cache              |#
+#+------------------------------------------------------------------------------------+#
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    def merge(self, other):
+        self.hits += other.hits
+        self.misses += other.misses
+        self.bytes_saved += other.bytes_saved
+        self.evictions += other.evictions
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = (100.0 * self.hits / lookups) if lookups else 0.0
+        return (f"cache: {self.hits} hit(s), {self.misses} miss(es) ({hit_rate:.1f}% hit rate), "
+                f"{self.bytes_saved} source bytes not reassembled, {self.evictions} eviction(s)")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: cache_key(string, string, dict)                                          |#
+#| Description: Computes the key of a cache entry                                     |#
+#| Input:                                                                             |#
+#|    string - the assembly source                                                    |#
+#|    string - the assembler version                                                  |#
+#|    dict - the memory map/SFR configuration of the assembler (JSON serializable)    |#
+#| Output:                                                                            |#
+#|    string - hexadecimal SHA-256 digest                                             |#
+#+------------------------------------------------------------------------------------+#
+def cache_key(source, version, config):
+    digest = hashlib.sha256()
+    digest.update(version.encode())
+    digest.update(b'\0')
+    digest.update(json.dumps(config, sort_keys=True).encode())
+    digest.update(b'\0')
+    digest.update(source.encode())
+    return digest.hexdigest()
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: pack_entry(array, bytearray, dict, array)                                |#
+#| Description: Serializes the images, the symbol table and the line map of a program |#
+#| Output:                                                                            |#
+#|    bytes - the content of a cache entry                                            |#
+#+------------------------------------------------------------------------------------+#
+def pack_entry(pfm, dfm, symbol_table, line_map=()):
+    words = array('I', pfm)
+    lines = array('I', line_map)
+    if sys.byteorder == 'big':
+        words.byteswap()
+        lines.byteswap()
+    symbols = json.dumps(symbol_table).encode()
+    return b''.join((ENTRY_HEADER.pack(ENTRY_MAGIC, len(words), len(dfm), len(symbols), len(lines)),
+                     words.tobytes(), bytes(dfm), symbols, lines.tobytes()))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: unpack_entry(bytes)                                                      |#
+#| Description: Deserializes a cache entry                                            |#
+#| Output:                                                                            |#
+#|    tuple - (array('I') pfm, bytearray dfm, dict symbol_table, array('I') line_map) |#
+#+------------------------------------------------------------------------------------+#
+def unpack_entry(data):
+    magic, n_words, n_bytes, n_symbols, n_lines = ENTRY_HEADER.unpack_from(data)
+    if magic != ENTRY_MAGIC:
+        raise ValueError("Cache Error! Invalid cache entry!")
+    offset = ENTRY_HEADER.size
+    pfm = array('I')
+    pfm.frombytes(data[offset:offset + 4*n_words])
+    if sys.byteorder == 'big':
+        pfm.byteswap()
+    offset += 4*n_words
+    dfm = bytearray(data[offset:offset + n_bytes])
+    offset += n_bytes
+    symbol_table = json.loads(data[offset:offset + n_symbols].decode())
+    offset += n_symbols
+    line_map = array('I')
+    line_map.frombytes(data[offset:offset + 4*n_lines])
+    if sys.byteorder == 'big':
+        line_map.byteswap()
+    return pfm, dfm, symbol_table, line_map
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: BuildCache                                                                  |#
+#| Description: Size bounded on-disk cache with LRU eviction. The recency of an entry |#
+#|    is its file modification time, which is refreshed on every hit, so several      |#
+#|    processes (batch mode workers) can share one cache directory                    |#
+#| Input:                                                                             |#
+#|    string - the cache directory (created if missing)                               |#
+#|    string - the assembler version                                                  |#
+#|    dict - the memory map/SFR configuration of the assembler                        |#
+#|    int - the maximum size of the cache in bytes                                    |#
+#+------------------------------------------------------------------------------------+#
+class BuildCache:
+    def __init__(self, cache_dir, version, config, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.config = config
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: lookup(string)                                                       |#
+    #| Description: Returns the cached (pfm, dfm, symbol_table, line_map) of a source |#
+    #|    or None                                                                     |#
+    #+--------------------------------------------------------------------------------+#
+    def lookup(self, source):
+        path = self.entry_path(cache_key(source, self.version, self.config))
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = unpack_entry(entry_file.read())
+            os.utime(path)
+        except (OSError, ValueError, struct.error):
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self.stats.bytes_saved += len(source.encode())
+        return entry
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: store(string, array, bytearray, dict, array)                         |#
+    #| Description: Adds the images of a source to the cache and evicts the least     |#
+    #|    recently used entries if the cache grew over its size limit                 |#
+    #+--------------------------------------------------------------------------------+#
+    def store(self, source, pfm, dfm, symbol_table, line_map=()):
+        path = self.entry_path(cache_key(source, self.version, self.config))
+        #Write to a temporary file first, concurrent readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as entry_file:
+            entry_file.write(pack_entry(pfm, dfm, symbol_table, line_map))
+        os.replace(tmp_path, path)
+        self.evict(keep=path)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: evict()                                                              |#
+    #| Description: Removes the least recently used entries until the cache fits in   |#
+    #|    max_bytes. The entry given as 'keep' (the one just stored) is never removed |#
+    #+--------------------------------------------------------------------------------+#
+    def evict(self, keep=None):
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for dir_entry in it:
+                if dir_entry.name.endswith(ENTRY_SUFFIX):
+                    try:
+                        info = dir_entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((info.st_mtime_ns, info.st_size, dir_entry.path))
+                    total += info.st_size
+
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.stats.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
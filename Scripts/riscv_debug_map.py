@@ -0,0 +1,175 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Assembler listing and debug map. The listing shows the address,        #
+#              machine word and source position/text of every PFM word, the debug map  #
+#              (JSON) keeps the source line of every PFM word and the symbol           #
+#              addresses. SourceMap loads a debug map (or an assembled Image) into     #
+#              per word arrays, so the simulator and the triage tools get the source   #
+#              position and the label of a PC with two array lookups.                 #
+# Input: Assembled Image + assembly source file                                        #
+# Output: <program>.lst listing and <program>.map.json debug map                       #
+########################################################################################
+
+import json
+import os
+from array import array
+
+#Version of the debug map format
+DEBUG_MAP_VERSION = 1
+
+#Address of the first PFM word and value of gp (assembler prologue), the data labels
+#of the symbol table are 12 bit offsets from gp
+PFM_BASE = 0x00000000
+GP_VALUE = 0x10000800
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: symbol_addresses(dict)                                                   |#
+#| Description: Returns the absolute address of every symbol. Text labels hold their  |#
+#|    PC, data variables hold their gp relative offset as a 12 bit hexadecimal string |#
+#| Input:                                                                             |#
+#|    dict - the symbol table of the assembler                                        |#
+#| Output:                                                                            |#
+#|    dict - symbol -> (address, 'text' or 'data')                                    |#
+#+------------------------------------------------------------------------------------+#
+def symbol_addresses(symbol_table):
+    symbols = {}
+    for label, value in symbol_table.items():
+        if isinstance(value, str):
+            offset = int(value, 16)
+            offset -= (offset & 0x800) << 1
+            symbols[label] = (GP_VALUE + offset, 'data')
+        else:
+            symbols[label] = (value, 'text')
+    return symbols
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: SourceMap                                                                   |#
+#| Description: PC to source lookups. lines[i] is the source line of PFM word i (0    |#
+#|    for the instructions added by the assembler), labels[i] is the index + 1 of the |#
+#|    last text label at or before word i in label_names (0 before the first label)   |#
+#| Input:                                                                             |#
+#|    string - name of the assembly source file                                       |#
+#|    iterable - the source line of every PFM word                                    |#
+#|    dict - symbol -> (address, 'text' or 'data')                                    |#
+#+------------------------------------------------------------------------------------+#
+class SourceMap:
+    def __init__(self, source, lines, symbols):
+        self.source = source
+        self.lines = array('I', lines)
+        self.symbols = symbols
+        text_labels = sorted((address, label) for label, (address, kind) in symbols.items() if kind == 'text')
+        self.label_names = [label for _, label in text_labels]
+        self.label_addresses = [address for address, _ in text_labels]
+        self.labels = array('I', bytes(4 * len(self.lines)))
+        position = 0
+        for index in range(len(self.lines)):
+            while position < len(text_labels) and text_labels[position][0] <= PFM_BASE + 4 * index:
+                position += 1
+            self.labels[index] = position
+
+    @classmethod
+    def from_image(cls, image, source_path):
+        return cls(os.path.basename(source_path), image.line_map or (), symbol_addresses(image.symbol_table))
+
+    @classmethod
+    def from_file(cls, map_path):
+        with open(map_path, "r") as map_file:
+            debug_map = json.load(map_file)
+        if debug_map.get('version') != DEBUG_MAP_VERSION:
+            raise ValueError(f"Debug Map Error! Unsupported debug map version in '{map_path}'!")
+        symbols = {label: (address, kind) for label, (address, kind) in debug_map['symbols'].items()}
+        return cls(debug_map['source'], debug_map['lines'], symbols)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: line(int)                                                            |#
+    #| Description: Returns the source line of a PC (0 if the PC has no source line)  |#
+    #+--------------------------------------------------------------------------------+#
+    def line(self, pc):
+        index = (pc - PFM_BASE) >> 2
+        return self.lines[index] if 0 <= index < len(self.lines) else 0
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: location(int)                                                        |#
+    #| Description: Returns 'file:line' for a PC ('file:?' without a source line)     |#
+    #+--------------------------------------------------------------------------------+#
+    def location(self, pc):
+        line = self.line(pc)
+        return f"{self.source}:{line}" if line else f"{self.source}:?"
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: label(int)                                                           |#
+    #| Description: Returns 'label+offset' for a PC ('' before the first label)       |#
+    #+--------------------------------------------------------------------------------+#
+    def label(self, pc):
+        index = (pc - PFM_BASE) >> 2
+        position = self.labels[index] if 0 <= index < len(self.labels) else 0
+        if not position:
+            return ''
+        offset = pc - self.label_addresses[position - 1]
+        return self.label_names[position - 1] + (f"+0x{offset:x}" if offset else '')
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_debug_map(Image, string, string)                                   |#
+#| Description: Writes the debug map of a program (JSON)                              |#
+#| Input:                                                                             |#
+#|    Image - the assembled program                                                   |#
+#|    string - path of the assembly source file                                       |#
+#|    string - path of the debug map                                                  |#
+#| Output:                                                                            |#
+#|    void                                                                            |#
+#+------------------------------------------------------------------------------------+#
+def write_debug_map(image, source_path, map_path):
+    debug_map = {
+        'version' : DEBUG_MAP_VERSION,
+        'source'  : os.path.basename(source_path),
+        'pfm_base': PFM_BASE,
+        'lines'   : list(image.line_map or ()),
+        'symbols' : symbol_addresses(image.symbol_table),
+    }
+    with open(map_path, "w") as map_file:
+        json.dump(debug_map, map_file, separators=(',', ':'))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_listing(Image, string, string)                                     |#
+#| Description: Writes the listing of a program. The source file is read again line   |#
+#|    by line and merged with the PFM words (their line numbers only increase), the   |#
+#|    labels are listed in front of their first instruction and the data symbols at   |#
+#|    the end                                                                         |#
+#| Input:                                                                             |#
+#|    Image - the assembled program                                                   |#
+#|    string - path of the assembly source file                                       |#
+#|    string - path of the listing file                                               |#
+#| Output:                                                                            |#
+#|    void                                                                            |#
+#+------------------------------------------------------------------------------------+#
+def write_listing(image, source_path, listing_path):
+    source = os.path.basename(source_path)
+    symbols = symbol_addresses(image.symbol_table)
+    text_labels = {}
+    for label, (address, kind) in symbols.items():
+        if kind == 'text':
+            text_labels.setdefault(address, []).append(label)
+    line_map = image.line_map or array('I', bytes(4 * len(image.pfm)))
+
+    with open(source_path, "r") as source_file:
+        #The line map does not have to increase, the source text is indexed by line number
+        source_lines = source_file.read().splitlines()
+    with open(listing_path, "w") as listing_file:
+        listing_file.write(f"//Listing of {source}\n//Address    Word        Position              Source\n")
+        for index, word in enumerate(image.pfm):
+            address = PFM_BASE + 4 * index
+            for label in text_labels.get(address, ()):
+                listing_file.write(f"{'':48s}{label}:\n")
+            line = line_map[index]
+            text = source_lines[line - 1].strip() if 0 < line <= len(source_lines) else ''
+            position = f"{source}:{line}" if line else "(assembler)"
+            entry = f"0x{address:08x}  0x{word:08x}  {position:20s}  {text}"
+            listing_file.write(entry.rstrip() + "\n")
+
+        listing_file.write("\n//Symbols\n")
+        for label, (address, kind) in sorted(symbols.items(), key=lambda item: item[1]):
+            listing_file.write(f"0x{address:08x}  {kind:4s}  {label}\n")
@@ -0,0 +1,247 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Table driven disassembler of PFM images (pfm.hex/pfm.bin, raw memory    #
+#              dumps). The opc/function3/function7/register_map/sfr_map tables of the  #
+#              assembler are reversed once into lookup tables: every word is decoded   #
+#              with one list lookup on its opcode/funct3 bits (and one on funct7 for   #
+#              the R-Type and shift instructions). Branch/jump targets get labels and  #
+#              SFR addresses their names, so the output can be assembled again.       #
+# Input: A PFM image file or buffer                                                    #
+# Output: Assembly source (.asm)                                                       #
+########################################################################################
+
+import argparse
+import sys
+from array import array
+
+import riscv_assembler
+import riscv_image_diff
+
+#Words of a full program memory image
+PFM_WORDS = (int(riscv_assembler.prog_seg_end_addr, 16) + 1 - int(riscv_assembler.prog_seg_start_addr, 16)) // 4
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: build_format_table()                                                     |#
+#| Description: Reverses the opc/function3/function7 tables into a list indexed by    |#
+#|    the opcode and funct3 bits of a word (opcode | funct3 << 7). An entry is None   |#
+#|    (no instruction), (mnemonic, type) or, for the instructions that also need      |#
+#|    funct7, a dictionary funct7 -> (mnemonic, type). The U/J-Type instructions have |#
+#|    no funct3, they fill the 8 entries of their opcode                              |#
+#| Output:                                                                            |#
+#|    list - 1024 entries                                                             |#
+#+------------------------------------------------------------------------------------+#
+def build_format_table():
+    table = [None] * 1024
+    for mnemonic, op in riscv_assembler.opc_int.items():
+        if not mnemonic.islower():
+            continue
+        instr_type = riscv_assembler.instrcution_type[mnemonic]
+        funct3 = riscv_assembler.function3_int.get(mnemonic)
+        for key in ([op | (funct3 << 7)] if funct3 is not None else [op | (f << 7) for f in range(8)]):
+            if mnemonic in riscv_assembler.function7_int:
+                table[key] = table[key] or {}
+                table[key][riscv_assembler.function7_int[mnemonic]] = (mnemonic, instr_type)
+            else:
+                table[key] = (mnemonic, instr_type)
+    return table
+
+
+FORMAT_TABLE = build_format_table()
+
+#Register number -> ABI name
+REGISTER_NAMES = [riscv_assembler.register_name[code] for code in range(32)]
+
+#12 bit immediate field -> SFR name (the SFRs are addressed relative to x0)
+SFR_NAMES = {}
+for name, value in riscv_assembler.sfr_map.items():
+    if name.isupper():
+        SFR_NAMES[int(value, 16)] = name
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: branch_offset(int) / jump_offset(int)                                    |#
+#| Description: Return the signed offset of a B-Type/J-Type word                      |#
+#+------------------------------------------------------------------------------------+#
+def branch_offset(word):
+    imm = ((word >> 31) << 12) | (((word >> 7) & 0x1) << 11) | (((word >> 25) & 0x3F) << 5) | \
+          (((word >> 8) & 0xF) << 1)
+    return (imm ^ 0x1000) - 0x1000
+
+
+def jump_offset(word):
+    imm = ((word >> 31) << 20) | (((word >> 12) & 0xFF) << 12) | (((word >> 20) & 0x1) << 11) | \
+          (((word >> 21) & 0x3FF) << 1)
+    return (imm ^ 0x100000) - 0x100000
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: lookup(int)                                                              |#
+#| Description: Returns the (mnemonic, type) of a word, None if it is not an          |#
+#|    instruction of the supported RV32I subset                                       |#
+#+------------------------------------------------------------------------------------+#
+def lookup(word):
+    entry = FORMAT_TABLE[(word & 0x7F) | ((word >> 5) & 0x380)]
+    if entry.__class__ is dict:
+        return entry.get(word >> 25)
+    return entry
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: find_labels(array, int)                                                  |#
+#| Description: Returns the branch/jump targets that are inside the image             |#
+#| Input:                                                                             |#
+#|    array - the PFM words                                                           |#
+#|    int - the address of the first word                                             |#
+#| Output:                                                                            |#
+#|    dict - target address -> label name                                             |#
+#+------------------------------------------------------------------------------------+#
+def find_labels(words, base=0):
+    end = base + 4 * len(words)
+    targets = set()
+    for i, word in enumerate(words):
+        op = word & 0x7F
+        if op == riscv_assembler.opc_int['beq'] and lookup(word) is not None:
+            targets.add(base + 4 * i + branch_offset(word))
+        elif op == riscv_assembler.opc_int['jal']:
+            targets.add(base + 4 * i + jump_offset(word))
+    return {target: f"L_{target:08x}" for target in sorted(targets) if base <= target < end and not target % 4}
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: format_instruction(int, int, dict)                                       |#
+#| Description: Formats one word in the syntax of the assembler                       |#
+#| Input:                                                                             |#
+#|    int - the machine word                                                          |#
+#|    int - the address of the word                                                   |#
+#|    dict - target address -> label name                                             |#
+#| Output:                                                                            |#
+#|    string - the instruction, None if the word is not an instruction                |#
+#+------------------------------------------------------------------------------------+#
+def format_instruction(word, pc, labels):
+    entry = lookup(word)
+    if entry is None:
+        return None
+    mnemonic, instr_type = entry
+    rd  = REGISTER_NAMES[(word >> 7) & 0x1F]
+    rs1 = (word >> 15) & 0x1F
+    rs2 = (word >> 20) & 0x1F
+    if instr_type == 'R':
+        return f"{mnemonic:5s} {rd}, {REGISTER_NAMES[rs1]}, {REGISTER_NAMES[rs2]}"
+    if instr_type == 'I':
+        if mnemonic in riscv_assembler.function7_int:
+            return f"{mnemonic:5s} {rd}, {REGISTER_NAMES[rs1]}, {rs2}"
+        field = word >> 20
+        if mnemonic == 'lw':
+            if rs1 == 0 and field in SFR_NAMES:
+                return f"{mnemonic:5s} {rd}, {SFR_NAMES[field]}(zero)"
+            return f"{mnemonic:5s} {rd}, {(field ^ 0x800) - 0x800}({REGISTER_NAMES[rs1]})"
+        return f"{mnemonic:5s} {rd}, {REGISTER_NAMES[rs1]}, {(field ^ 0x800) - 0x800}"
+    if instr_type == 'S':
+        field = ((word >> 25) << 5) | ((word >> 7) & 0x1F)
+        if rs1 == 0 and field in SFR_NAMES:
+            return f"{mnemonic:5s} {REGISTER_NAMES[rs2]}, {SFR_NAMES[field]}(zero)"
+        return f"{mnemonic:5s} {REGISTER_NAMES[rs2]}, {(field ^ 0x800) - 0x800}({REGISTER_NAMES[rs1]})"
+    if instr_type == 'B':
+        target = pc + branch_offset(word)
+        #The assembler takes rs2 as the first operand and rs1 as the second one
+        return f"{mnemonic:5s} {REGISTER_NAMES[rs2]}, {REGISTER_NAMES[rs1]}, {labels.get(target, branch_offset(word))}"
+    if instr_type == 'U':
+        return f"{mnemonic:5s} {rd}, {hex(word & 0xFFFFF000)}"
+    target = pc + jump_offset(word)
+    return f"{mnemonic:5s} {rd}, {labels.get(target, jump_offset(word))}"
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: disassemble_words(iterable, int)                                         |#
+#| Description: Disassembles the words of a PFM image. Every line has the address and |#
+#|    the word as a comment, the words that are not instructions and the unknown      |#
+#|    words of a simulation dump (None) are written as comments                       |#
+#| Input:                                                                             |#
+#|    iterable - the PFM words (None for unknown words)                               |#
+#|    int - the address of the first word                                             |#
+#| Output:                                                                            |#
+#|    list - the lines of the assembly source                                         |#
+#+------------------------------------------------------------------------------------+#
+def disassemble_words(words, base=0):
+    words = list(words)
+    known = array('I', (word or 0 for word in words))
+    labels = find_labels(known, base)
+    lines = [".section .text"]
+    for i, word in enumerate(words):
+        pc = base + 4 * i
+        if pc in labels:
+            lines.append(f"{labels[pc]}:")
+        if word is None:
+            lines.append(f"   # 0x{pc:08x}: xxxxxxxx unknown word")
+            continue
+        instruction = format_instruction(word, pc, labels)
+        if instruction is None:
+            lines.append(f"   # 0x{pc:08x}: 0x{word:08x} not an instruction")
+        else:
+            lines.append(f"   {instruction:32s} # 0x{pc:08x}: 0x{word:08x}")
+    return lines
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: words_from_buffer(bytes)                                                 |#
+#| Description: Returns the words of a memory image held in a buffer: a text image    |#
+#|    (one binary or '0x' hexadecimal word per line, 'x' for unknown words) or a raw  |#
+#|    Little Endian image (.img or a memory dump)                                     |#
+#| Output:                                                                            |#
+#|    list - the words (None for unknown words)                                       |#
+#+------------------------------------------------------------------------------------+#
+def words_from_buffer(data):
+    if not data.translate(None, b'01xXzZ\r\n \t') or data.startswith(b'0x') or data.startswith(b'//'):
+        return riscv_image_diff.parse_memory_lines(data.decode())
+    if len(data) % 4:
+        raise ValueError("Disassembler Error! A raw image must contain a whole number of 32 bit words!")
+    words = array('I')
+    words.frombytes(data)
+    if sys.byteorder == 'big':
+        words.byteswap()
+    return list(words)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: disassemble_file(string, int)                                            |#
+#| Description: Disassembles a PFM image file, the 0 words at the end of a full       |#
+#|    memory image are left out                                                       |#
+#+------------------------------------------------------------------------------------+#
+def disassemble_file(path, base=0):
+    with open(path, "rb") as image_file:
+        words = words_from_buffer(image_file.read())
+    if len(words) > PFM_WORDS:
+        raise ValueError(f"Disassembler Error! '{path}' is larger than the program memory!")
+    while words and words[-1] == 0:
+        words.pop()
+    return disassemble_words(words, base)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: main(list)                                                               |#
+#| Description: This is the main function (command line entry point)                  |#
+#| Input:                                                                             |#
+#|    list - the command line arguments (sys.argv[1:] if None)                        |#
+#| Output:                                                                            |#
+#|    int - the exit code                                                             |#
+#+------------------------------------------------------------------------------------+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Disassemble a PFM image (pfm.hex, pfm.bin or a raw memory dump)")
+    parser.add_argument("image", help="PFM image file")
+    parser.add_argument("-o", "--output", help="assembly file written (default: standard output)")
+    parser.add_argument("--base", type=lambda value: int(value, 0), default=0,
+                        help="address of the first word of the image (default: 0)")
+    args = parser.parse_args(argv)
+
+    source = '\n'.join(disassemble_file(args.image, args.base)) + '\n'
+    if args.output:
+        with open(args.output, "w") as asm_file:
+            asm_file.write(source)
+    else:
+        sys.stdout.write(source)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Regression triage tool that compares dfm_gold.bin with the memory dump  #
+#              of a simulation (dfm_sim_result.bin). Every text memory file is         #
+#              converted once into a packed binary file (.rvmem, next to the text      #
+#              file) that is opened with mmap and read as NumPy arrays without a copy. #
+#              The words are compared with the 4-state semantics of the testbench      #
+#              (x only matches x) and the mismatches are reported as address ranges    #
+#              annotated with the data labels of the program.                          #
+# Input: Test directories (dfm_gold.bin, dfm_sim_result.bin and the .asm source)       #
+# Output: Mismatch report                                                              #
+########################################################################################
+
+import argparse
+import glob
+import mmap
+import os
+import struct
+import sys
+
+import riscv_assembler
+import riscv_debug_map
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+GOLD_FILE   = "dfm_gold.bin"
+RESULT_FILE = "dfm_sim_result.bin"
+
+#Number of compared words (dfm_gold[0:1023] in the testbenches)
+COMPARED_WORDS = 1024
+
+#Packed image layout (Little Endian):
+#   magic(4s) | word count(I) | text file size(Q) | text file mtime in ns(Q)
+#   words (uint32) | known flags (uint8, 0 for the words that contain x/z bits)
+PACKED_MAGIC  = b'RVM1'
+PACKED_HEADER = struct.Struct('<4sIQQ')
+PACKED_SUFFIX = '.rvmem'
+
+#Data memory address of the first word
+DFM_BASE = int(riscv_assembler.data_seg_start_addr, 16)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: require_numpy()                                                          |#
+#| Description: Raises an error if NumPy is not installed                             |#
+#+------------------------------------------------------------------------------------+#
+def require_numpy():
+    if np is None:
+        raise ImportError("Image Diff Error! The image differ requires NumPy (pip install numpy)!")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: parse_memory_lines(string)                                               |#
+#| Description: Parses a text memory file line by line (binary or '0x' hexadecimal    |#
+#|    words, one per line, '//' comments). A word with an x/z digit is unknown        |#
+#| Input:                                                                             |#
+#|    string - the content of the file                                                |#
+#| Output:                                                                            |#
+#|    list - the words (None for the unknown words)                                   |#
+#+------------------------------------------------------------------------------------+#
+def parse_memory_lines(text):
+    words = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
+        if line[:2] in ('0x', '0X'):
+            digits, base = line[2:], 16
+        else:
+            digits, base = line, 2
+        if any(c in digits for c in 'xXzZ'):
+            words.append(None)
+            continue
+        try:
+            words.append(int(digits, base))
+        except ValueError:
+            raise ValueError(f"Image Error! Invalid memory word '{line}'!") from None
+    return words
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: parse_memory_text(bytes)                                                 |#
+#| Description: Parses a text memory file (binary or '0x' hexadecimal words, one per  |#
+#|    line). The $readmemb/$writememb layout (32 binary digits + newline per line) is |#
+#|    parsed with array operations, any other layout by parse_memory_lines()          |#
+#| Input:                                                                             |#
+#|    bytes - the content of the file                                                 |#
+#| Output:                                                                            |#
+#|    tuple - (uint32 words, bool known flags)                                        |#
+#+------------------------------------------------------------------------------------+#
+def parse_memory_text(text):
+    if len(text) % 33 == 0:
+        lines = np.frombuffer(text, dtype=np.uint8).reshape(-1, 33)
+        digits = lines[:, :32]
+        binary = (digits == ord('0')) | (digits == ord('1'))
+        unknown = np.isin(digits, np.frombuffer(b'xXzZ', dtype=np.uint8))
+        if (lines[:, 32] == ord('\n')).all() and (binary | unknown).all():
+            bits = (digits == ord('1')).astype(np.uint32)
+            words = (bits << np.arange(31, -1, -1, dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+            return words, ~unknown.any(axis=1)
+
+    words = parse_memory_lines(text.decode())
+    return (np.array([word or 0 for word in words], dtype=np.uint32),
+            np.array([word is not None for word in words], dtype=bool))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: PackedImage                                                                 |#
+#| Description: A memory file mapped as NumPy arrays (words, known flags). The packed |#
+#|    file is rebuilt when it is missing or older than the text file, the arrays are  |#
+#|    views of the mapping                                                            |#
+#| Input:                                                                             |#
+#|    string - path of the text memory file                                           |#
+#+------------------------------------------------------------------------------------+#
+class PackedImage:
+    def __init__(self, path):
+        require_numpy()
+        self.path = path
+        info = os.stat(path)
+        packed_path = path + PACKED_SUFFIX
+        self.mapping = self.open_packed(packed_path, info)
+        if self.mapping is None:
+            with open(path, 'rb') as text_file:
+                words, known = parse_memory_text(text_file.read())
+            try:
+                self.write_packed(packed_path, info, words, known)
+                self.mapping = self.open_packed(packed_path, info)
+            except OSError:
+                #Read only regression area, use the parsed arrays
+                pass
+        if self.mapping is None:
+            self.words, self.known = words, known
+        else:
+            count = PACKED_HEADER.unpack_from(self.mapping)[1]
+            self.words = np.frombuffer(self.mapping, dtype='<u4', count=count, offset=PACKED_HEADER.size)
+            self.known = np.frombuffer(self.mapping, dtype=np.bool_, count=count,
+                                       offset=PACKED_HEADER.size + 4 * count)
+
+    #Returns the mapping of an up to date packed file or None
+    @staticmethod
+    def open_packed(packed_path, info):
+        try:
+            with open(packed_path, 'rb') as packed_file:
+                mapping = mmap.mmap(packed_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(mapping) < PACKED_HEADER.size:
+            return None
+        magic, count, size, mtime = PACKED_HEADER.unpack_from(mapping)
+        if (magic, size, mtime) != (PACKED_MAGIC, info.st_size, info.st_mtime_ns) or \
+           len(mapping) != PACKED_HEADER.size + 5 * count:
+            return None
+        return mapping
+
+    @staticmethod
+    def write_packed(packed_path, info, words, known):
+        tmp_path = packed_path + '.tmp'
+        with open(tmp_path, 'wb') as packed_file:
+            packed_file.write(PACKED_HEADER.pack(PACKED_MAGIC, len(words), info.st_size, info.st_mtime_ns))
+            packed_file.write(words.astype('<u4').tobytes())
+            packed_file.write(known.astype(np.bool_).tobytes())
+        os.replace(tmp_path, packed_path)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: padded(int)                                                          |#
+    #| Description: Returns the first 'count' (words, known flags), the words after   |#
+    #|    the end of the file are unknown (x in the testbench memories)               |#
+    #+--------------------------------------------------------------------------------+#
+    def padded(self, count):
+        words = np.zeros(count, dtype=np.uint32)
+        known = np.zeros(count, dtype=bool)
+        used = min(count, len(self.words))
+        words[:used] = self.words[:used]
+        known[:used] = self.known[:used]
+        return words, known
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: mismatch_ranges(PackedImage, PackedImage, int)                           |#
+#| Description: Compares two images word by word (x only matches x, like the !==      |#
+#|    comparison of the testbench)                                                    |#
+#| Output:                                                                            |#
+#|    list - (first word index, last word index) of every run of mismatching words    |#
+#+------------------------------------------------------------------------------------+#
+def mismatch_ranges(gold, result, count=COMPARED_WORDS):
+    gold_words, gold_known = gold.padded(count)
+    result_words, result_known = result.padded(count)
+    differ = (gold_known != result_known) | (gold_known & (gold_words != result_words))
+    indexes = np.flatnonzero(differ)
+    if not len(indexes):
+        return []
+    breaks = np.flatnonzero(np.diff(indexes) != 1)
+    starts = np.concatenate(([indexes[0]], indexes[breaks + 1]))
+    ends = np.concatenate((indexes[breaks], [indexes[-1]]))
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: data_labels(dict)                                                        |#
+#| Description: Returns the data labels of a symbol table sorted by address           |#
+#| Output:                                                                            |#
+#|    tuple - (sorted byte addresses, labels)                                         |#
+#+------------------------------------------------------------------------------------+#
+def data_labels(symbol_table):
+    labels = sorted((address, label) for label, (address, kind) in
+                    riscv_debug_map.symbol_addresses(symbol_table).items() if kind == 'data')
+    return [address for address, _ in labels], [label for _, label in labels]
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: annotate(int, tuple)                                                     |#
+#| Description: Returns 'label+offset' for a data memory address ('' if the address   |#
+#|    is before the first label)                                                      |#
+#+------------------------------------------------------------------------------------+#
+def annotate(address, labels):
+    addresses, names = labels
+    position = int(np.searchsorted(addresses, address, side='right')) - 1
+    if position < 0:
+        return ''
+    return f"{names[position]}+0x{address - addresses[position]:x}"
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: find_source(string)                                                      |#
+#| Description: Returns the assembly source of a test directory or None               |#
+#+------------------------------------------------------------------------------------+#
+def find_source(test_dir):
+    sources = sorted(glob.glob(os.path.join(test_dir, "*.asm")))
+    return sources[0] if sources else None
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: diff_directory(string, BuildCache)                                       |#
+#| Description: Compares the gold and result images of a test directory               |#
+#| Input:                                                                             |#
+#|    string - the test directory                                                     |#
+#|    BuildCache - build cache for the assembly of the sources (or None)              |#
+#| Output:                                                                            |#
+#|    list - report lines of the mismatching ranges (empty if the test passed)        |#
+#+------------------------------------------------------------------------------------+#
+def diff_directory(test_dir, cache=None):
+    gold = PackedImage(os.path.join(test_dir, GOLD_FILE))
+    result_path = os.path.join(test_dir, RESULT_FILE)
+    if not os.path.exists(result_path):
+        return [f"missing {RESULT_FILE}"]
+    ranges = mismatch_ranges(gold, PackedImage(result_path))
+    if not ranges:
+        return []
+
+    source = find_source(test_dir)
+    labels = ([], [])
+    if source is not None:
+        labels = data_labels(riscv_assembler.assemble_file_cached(source, cache).symbol_table)
+    lines = []
+    for first, last in ranges:
+        start, end = DFM_BASE + 4 * first, DFM_BASE + 4 * last
+        where = f"0x{start:08x}" if first == last else f"0x{start:08x}-0x{end:08x}"
+        label = annotate(start, labels)
+        lines.append(f"{where}{f' ({label})' if label else ''}: {last - first + 1} word(s) differ")
+    return lines
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: find_test_dirs(list)                                                     |#
+#| Description: Returns the directories under the given paths that hold a gold image  |#
+#+------------------------------------------------------------------------------------+#
+def find_test_dirs(paths):
+    test_dirs = set()
+    for path in paths:
+        if os.path.isfile(os.path.join(path, GOLD_FILE)):
+            test_dirs.add(path)
+        for root, _, files in os.walk(path):
+            if GOLD_FILE in files:
+                test_dirs.add(root)
+    return sorted(test_dirs)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: main(list)                                                               |#
+#| Description: This is the main function (command line entry point)                  |#
+#| Input:                                                                             |#
+#|    list - the command line arguments (sys.argv[1:] if None)                        |#
+#| Output:                                                                            |#
+#|    int - the exit code (1 if any test failed)                                      |#
+#+------------------------------------------------------------------------------------+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare dfm_gold.bin with dfm_sim_result.bin in test directories")
+    parser.add_argument("paths", nargs="+", help="test directories or regression roots (searched recursively)")
+    parser.add_argument("--cache-dir", help="build cache directory for the assembly of the sources")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print the failing tests")
+    args = parser.parse_args(argv)
+    require_numpy()
+
+    cache = riscv_assembler.open_build_cache(args.cache_dir) if args.cache_dir else None
+    test_dirs = find_test_dirs(args.paths)
+    failed = 0
+    for test_dir in test_dirs:
+        lines = diff_directory(test_dir, cache)
+        if lines:
+            failed += 1
+            print(f"FAIL  {test_dir}")
+            for line in lines:
+                print(f"      {line}")
+        elif not args.quiet:
+            print(f"PASS  {test_dir}")
+    print(f"{len(test_dirs)} test(s) compared, {len(test_dirs) - failed} passed, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
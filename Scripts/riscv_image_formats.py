@@ -0,0 +1,177 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Memory image writers of the RV32I assembler. Every format is a writer   #
+#              function registered in FORMATS with its file extension, the assembler   #
+#              writes pfm<ext>/dfm<ext> for each selected format:                      #
+#              - bin:  one binary word per line ($readmemb, default)                   #
+#              - hex:  one '0x' prefixed hexadecimal word per line (default)           #
+#              - img:  raw Little Endian words                                         #
+#              - ihex: Intel HEX with extended linear address records                  #
+#              - memh: $readmemh file with '@addr' records                             #
+# Input: The 32 bit words of a memory and the address of its first word                #
+# Output: Memory image files                                                           #
+########################################################################################
+
+import sys
+from array import array
+
+#Data bytes in one Intel HEX data record
+IHEX_RECORD_BYTES = 16
+
+#Shortest run of 0 words that splits a sparse image into two regions (shorter runs are
+#cheaper to write than a new address record)
+SPARSE_MIN_GAP = 8
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: split_regions(list, bool)                                                |#
+#| Description: Splits the words of a memory into regions (word index, words). A      |#
+#|    dense image is a single region, a sparse image leaves out the runs of at least  |#
+#|    SPARSE_MIN_GAP 0 words (the memory must be 0 initialized to load it)            |#
+#| Input:                                                                             |#
+#|    list - the 32 bit words of the memory                                           |#
+#|    bool - leave out the runs of 0 words                                            |#
+#| Output:                                                                            |#
+#|    list - (word index, list of words) regions                                      |#
+#+------------------------------------------------------------------------------------+#
+def split_regions(words, sparse=False):
+    words = list(words)
+    if not sparse:
+        return [(0, words)] if words else []
+
+    regions = []
+    start = None
+    zeros = 0
+    for index, word in enumerate(words):
+        if word:
+            if start is None:
+                start = index
+            elif zeros >= SPARSE_MIN_GAP:
+                regions.append((start, words[start:index - zeros]))
+                start = index
+            zeros = 0
+        else:
+            zeros += 1
+    if start is not None:
+        regions.append((start, words[start:len(words) - zeros]))
+    return regions
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_readmemb(file, int, list)                                          |#
+#| Description: One 32 bit binary word per line, the regions must be contiguous       |#
+#+------------------------------------------------------------------------------------+#
+def write_readmemb(out_file, base_addr, regions):
+    for _, words in regions:
+        out_file.write(''.join(format(word, '032b') + '\n' for word in words).encode())
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_prefixed_hex(file, int, list)                                      |#
+#| Description: One '0x' prefixed hexadecimal word per line                           |#
+#+------------------------------------------------------------------------------------+#
+def write_prefixed_hex(out_file, base_addr, regions):
+    for _, words in regions:
+        out_file.write(''.join('0x' + format(word, '08x') + '\n' for word in words).encode())
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_raw(file, int, list)                                               |#
+#| Description: Raw Little Endian words from the first word of the memory, the gaps   |#
+#|    between regions are filled with 0's                                             |#
+#+------------------------------------------------------------------------------------+#
+def write_raw(out_file, base_addr, regions):
+    position = 0
+    for index, words in regions:
+        out_file.write(bytes(4 * (index - position)))
+        data = array('I', words)
+        if sys.byteorder == 'big':
+            data.byteswap()
+        out_file.write(data.tobytes())
+        position = index + len(words)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: ihex_record(int, int, bytes)                                             |#
+#| Description: Formats an Intel HEX record ':LLAAAATT<data>CC'                       |#
+#+------------------------------------------------------------------------------------+#
+def ihex_record(record_type, address, data=b''):
+    record = bytes((len(data), (address >> 8) & 0xFF, address & 0xFF, record_type)) + data
+    return ':' + (record + bytes(((-sum(record)) & 0xFF,))).hex().upper() + '\n'
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_intel_hex(file, int, list)                                         |#
+#| Description: Intel HEX file, the bytes are placed at their system addresses. An    |#
+#|    extended linear address record (type 04) gives the upper 16 bits of the address |#
+#|    whenever they change, data records never cross a 64KB boundary                  |#
+#+------------------------------------------------------------------------------------+#
+def write_intel_hex(out_file, base_addr, regions):
+    lines = []
+    upper = None
+    for index, words in regions:
+        data = array('I', words)
+        if sys.byteorder == 'big':
+            data.byteswap()
+        data = data.tobytes()
+        address = base_addr + 4 * index
+        offset = 0
+        while offset < len(data):
+            if address >> 16 != upper:
+                upper = address >> 16
+                lines.append(ihex_record(0x04, 0, upper.to_bytes(2, 'big')))
+            length = min(IHEX_RECORD_BYTES, len(data) - offset, 0x10000 - (address & 0xFFFF))
+            lines.append(ihex_record(0x00, address & 0xFFFF, data[offset:offset + length]))
+            offset += length
+            address += length
+    lines.append(ihex_record(0x01, 0))
+    out_file.write(''.join(lines).encode())
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_readmemh(file, int, list)                                          |#
+#| Description: $readmemh file, every region starts with an '@addr' record that holds |#
+#|    the index of its first word in the memory array (hexadecimal)                   |#
+#+------------------------------------------------------------------------------------+#
+def write_readmemh(out_file, base_addr, regions):
+    for index, words in regions:
+        out_file.write((f"@{index:08x}\n" + ''.join(format(word, '08x') + '\n' for word in words)).encode())
+
+
+#Output formats: name -> (file extension, writer)
+FORMATS = {
+    'bin'  : ('.bin', write_readmemb),
+    'hex'  : ('.hex', write_prefixed_hex),
+    'img'  : ('.img', write_raw),
+    'ihex' : ('.ihx', write_intel_hex),
+    'memh' : ('.mem', write_readmemh),
+}
+
+#Formats written when none is selected (the files loaded by the testbenches)
+DEFAULT_FORMATS = ('bin', 'hex')
+
+#Formats that can represent the gaps of a sparse image
+SPARSE_FORMATS = ('ihex', 'memh')
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_memory(string, int, list, iterable, bool)                          |#
+#| Description: Writes the image of one memory in the selected formats                |#
+#| Input:                                                                             |#
+#|    string - path of the files without extension (e.g. out_dir/pfm)                 |#
+#|    int - system address of the first word of the memory                            |#
+#|    list - the 32 bit words of the memory                                           |#
+#|    iterable - the format names                                                     |#
+#|    bool - leave out the runs of 0 words (the formats with addresses only)          |#
+#| Output:                                                                            |#
+#|    void                                                                            |#
+#+------------------------------------------------------------------------------------+#
+def write_memory(path, base_addr, words, formats=DEFAULT_FORMATS, sparse=False):
+    dense = split_regions(words)
+    regions = split_regions(words, True) if sparse else dense
+    for name in formats:
+        if name not in FORMATS:
+            raise ValueError(f"Output Error! Unknown image format '{name}'!")
+        extension, writer = FORMATS[name]
+        with open(path + extension, "wb") as out_file:
+            writer(out_file, base_addr, regions if name in SPARSE_FORMATS else dense)
@@ -0,0 +1,1426 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Instruction set simulator (golden model) for the RV32I subset that is   #
+#              supported by riscv_assembler.py. Every PFM word is decoded once into a  #
+#              handler (dispatch table keyed by mnemonic). The default 'block' mode    #
+#              also translates straight-line runs of instructions into cached Python   #
+#              functions, the 'step' mode calls one handler per instruction. The SFR   #
+#              space is served by the peripheral models of riscv_peripherals.py, the   #
+#              'timing' mode gives them the cycles of the pipeline timing model (the   #
+#              other modes count one cycle per instruction). Idle SFR polling loops are #
+#              fast-forwarded to the next peripheral event in the block/timing modes.  #
+# Input: The PFM/DFM images of a program (assembler Image or pfm/dfm .bin/.hex files)  #
+# Output: Final data memory in the dfm_sim_result.bin format                           #
+########################################################################################
+
+import argparse
+import sys
+import time
+from array import array
+
+import riscv_assembler
+import riscv_debug_map
+import riscv_peripherals
+import riscv_profiler
+import riscv_trace
+
+MASK32 = 0xFFFFFFFF
+
+#Memory map (same decoding as RTL/Memory/mem_map_dec.sv)
+PFM_BASE  = 0x00000000
+PFM_SIZE  = 0x00010000    #64KB program memory
+DFM_BASE  = 0x10000000
+DFM_SIZE  = 0x00010000    #64KB decoded for the data memory (the assembler uses the first 4KB)
+IO_BASE   = 0xFFFFF000
+SFR_BASE  = 0xFFFFF800
+
+#Global pointer set up by the two instructions that the assembler adds in front of
+#every program (lui gp, 0x10001000 / addi gp, gp, 0x800)
+GP_VALUE  = 0x10000800
+
+#Number of words written in dfm_sim_result.bin (dfm_gold[0:1023] in the testbenches)
+DFM_RESULT_WORDS = 1024
+
+#Default limit of retired instructions for a run
+DEFAULT_MAX_INSTRUCTIONS = 10000000
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: sign_extend(int, int)                                                    |#
+#| Description: Sign extends an N bit value                                           |#
+#| Input:                                                                             |#
+#|    int - the value (N LSbits are used)                                             |#
+#|    int - N, the number of bits of the value                                        |#
+#| Output:                                                                            |#
+#|    int - the signed value                                                          |#
+#+------------------------------------------------------------------------------------+#
+def sign_extend(value, bits):
+    sign = 1 << (bits - 1)
+    return (value & (sign - 1)) - (value & sign)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: build_decode_table()                                                     |#
+#| Description: Reverses the opc/function3/function7 tables of the assembler into a   |#
+#|    table keyed by (opcode, funct3, funct7). funct3/funct7 are None in the key when |#
+#|    they are not part of the encoding of the instruction                            |#
+#| Output:                                                                            |#
+#|    dict - (opcode, funct3, funct7) -> mnemonic                                     |#
+#+------------------------------------------------------------------------------------+#
+def build_decode_table():
+    table = {}
+    for mnemonic, op in riscv_assembler.opc_int.items():
+        if not mnemonic.islower():
+            continue
+        funct3 = riscv_assembler.function3_int.get(mnemonic)
+        #funct7 is only part of the R-type encoding and of the shift immediates
+        funct7 = riscv_assembler.function7_int.get(mnemonic)
+        table[(op, funct3, funct7)] = mnemonic
+    return table
+
+
+DECODE_TABLE = build_decode_table()
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Instruction                                                                 |#
+#| Description: A decoded machine word. rs1/rs2 are always the raw register fields    |#
+#|    of the word (bits [19:15]/[24:20]) even for types that do not use them, the     |#
+#|    same way the RTL decode stage presents them to the hazard unit                  |#
+#+------------------------------------------------------------------------------------+#
+class Instruction:
+    __slots__ = ('word', 'mnemonic', 'type', 'rd', 'rs1', 'rs2', 'imm')
+
+    def __init__(self, word, mnemonic, instr_type, rd, rs1, rs2, imm):
+        self.word = word
+        self.mnemonic = mnemonic
+        self.type = instr_type
+        self.rd = rd
+        self.rs1 = rs1
+        self.rs2 = rs2
+        self.imm = imm
+
+    def __repr__(self):
+        return f"Instruction({self.mnemonic} rd={self.rd} rs1={self.rs1} rs2={self.rs2} imm={self.imm})"
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: decode(int)                                                              |#
+#| Description: Decodes a 32 bit machine word                                         |#
+#| Input:                                                                             |#
+#|    int - the machine word                                                          |#
+#| Output:                                                                            |#
+#|    Instruction - the decoded instruction or None if the word is not supported      |#
+#+------------------------------------------------------------------------------------+#
+def decode(word):
+    op     = word & 0x7F
+    funct3 = (word >> 12) & 0x7
+    funct7 = word >> 25
+    mnemonic = DECODE_TABLE.get((op, funct3, funct7)) or \
+               DECODE_TABLE.get((op, funct3, None)) or \
+               DECODE_TABLE.get((op, None, None))
+    if mnemonic is None:
+        return None
+
+    instr_type = riscv_assembler.instrcution_type[mnemonic]
+    rd  = (word >> 7)  & 0x1F
+    rs1 = (word >> 15) & 0x1F
+    rs2 = (word >> 20) & 0x1F
+    if instr_type == 'I':
+        if mnemonic in riscv_assembler.function7_int:
+            imm = rs2                                   #shift amount
+        else:
+            imm = sign_extend(word >> 20, 12)
+    elif instr_type == 'S':
+        imm = sign_extend(((word >> 25) << 5) | ((word >> 7) & 0x1F), 12)
+    elif instr_type == 'B':
+        imm = sign_extend(((word >> 31) << 12) | (((word >> 7) & 0x1) << 11) |
+                          (((word >> 25) & 0x3F) << 5) | (((word >> 8) & 0xF) << 1), 13)
+    elif instr_type == 'U':
+        imm = word & 0xFFFFF000
+    elif instr_type == 'J':
+        imm = sign_extend(((word >> 31) << 20) | (((word >> 12) & 0xFF) << 12) |
+                          (((word >> 20) & 0x1) << 11) | (((word >> 21) & 0x3FF) << 1), 21)
+    else:
+        imm = 0
+    return Instruction(word, mnemonic, instr_type, rd, rs1, rs2, imm)
+
+
+#Exceptions used by the handlers to stop the main loop
+class Halt(Exception):
+    pass
+
+class EndOfProgram(Exception):
+    pass
+
+
+#+------------------------------------------------------------------------------------+#
+#|                                Instruction handlers                                |#
+#| Every exec_* function receives the simulator and a decoded instruction and returns |#
+#| a closure f(pc) -> next_pc that executes it. The decoded fields are bound once as  |#
+#| default arguments, so the closures only touch local variables. Writes to x0 are    |#
+#| removed at decode time.                                                            |#
+#+------------------------------------------------------------------------------------+#
+def nop(pc):
+    return pc + 4
+
+
+def make_alu_imm(operation):
+    def factory(sim, ins):
+        if ins.rd == 0:
+            return nop
+        def execute(pc, x=sim.x, rd=ins.rd, rs1=ins.rs1, imm=ins.imm, operation=operation):
+            x[rd] = operation(x[rs1], imm) & MASK32
+            return pc + 4
+        return execute
+    return factory
+
+
+def make_alu_reg(operation):
+    def factory(sim, ins):
+        if ins.rd == 0:
+            return nop
+        def execute(pc, x=sim.x, rd=ins.rd, rs1=ins.rs1, rs2=ins.rs2, operation=operation):
+            x[rd] = operation(x[rs1], x[rs2]) & MASK32
+            return pc + 4
+        return execute
+    return factory
+
+
+def signed32(value):
+    return value - ((value & 0x80000000) << 1)
+
+
+def exec_addi(sim, ins):
+    if ins.rd == 0:
+        return nop
+    def addi(pc, x=sim.x, rd=ins.rd, rs1=ins.rs1, imm=ins.imm):
+        x[rd] = (x[rs1] + imm) & MASK32
+        return pc + 4
+    return addi
+
+
+def exec_add(sim, ins):
+    if ins.rd == 0:
+        return nop
+    def add(pc, x=sim.x, rd=ins.rd, rs1=ins.rs1, rs2=ins.rs2):
+        x[rd] = (x[rs1] + x[rs2]) & MASK32
+        return pc + 4
+    return add
+
+
+def exec_and(sim, ins):
+    if ins.rd == 0:
+        return nop
+    def and_(pc, x=sim.x, rd=ins.rd, rs1=ins.rs1, rs2=ins.rs2):
+        x[rd] = x[rs1] & x[rs2]
+        return pc + 4
+    return and_
+
+
+def exec_lui(sim, ins):
+    if ins.rd == 0:
+        return nop
+    def lui(pc, x=sim.x, rd=ins.rd, imm=ins.imm):
+        x[rd] = imm
+        return pc + 4
+    return lui
+
+
+def exec_auipc(sim, ins):
+    if ins.rd == 0:
+        return nop
+    def auipc(pc, x=sim.x, rd=ins.rd, imm=ins.imm):
+        x[rd] = (pc + imm) & MASK32
+        return pc + 4
+    return auipc
+
+
+def exec_lw(sim, ins):
+    def lw(pc, x=sim.x, rd=ins.rd, rs1=ins.rs1, imm=ins.imm, dfm=sim.dfm, load=sim.load):
+        addr = (x[rs1] + imm) & MASK32
+        offset = addr - DFM_BASE
+        if 0 <= offset < DFM_SIZE:
+            value = dfm[offset >> 2]
+        else:
+            value = load(addr)
+        if rd:
+            x[rd] = value
+        return pc + 4
+    return lw
+
+
+def exec_sw(sim, ins):
+    def sw(pc, x=sim.x, rs1=ins.rs1, rs2=ins.rs2, imm=ins.imm, dfm=sim.dfm, valid=sim.dfm_valid, store=sim.store):
+        addr = (x[rs1] + imm) & MASK32
+        offset = addr - DFM_BASE
+        if 0 <= offset < DFM_SIZE:
+            dfm[offset >> 2] = x[rs2]
+            valid[offset >> 2] = 1
+        else:
+            store(addr, x[rs2])
+        return pc + 4
+    return sw
+
+
+def exec_beq(sim, ins):
+    def beq(pc, x=sim.x, rs1=ins.rs1, rs2=ins.rs2, imm=ins.imm):
+        if x[rs1] == x[rs2]:
+            return (pc + imm) & MASK32
+        return pc + 4
+    return beq
+
+
+def exec_bne(sim, ins):
+    def bne(pc, x=sim.x, rs1=ins.rs1, rs2=ins.rs2, imm=ins.imm):
+        if x[rs1] != x[rs2]:
+            return (pc + imm) & MASK32
+        return pc + 4
+    return bne
+
+
+def exec_jal(sim, ins):
+    rd, imm = ins.rd, ins.imm
+    if imm == 0:
+        #Jump to itself, the program is halted
+        def halt(pc, x=sim.x):
+            if rd:
+                x[rd] = pc + 4
+            raise Halt()
+        return halt
+    if rd == 0:
+        def j(pc):
+            return (pc + imm) & MASK32
+        return j
+    def jal(pc, x=sim.x):
+        x[rd] = pc + 4
+        return (pc + imm) & MASK32
+    return jal
+
+
+def exec_jalr(sim, ins):
+    def jalr(pc, x=sim.x, rd=ins.rd, rs1=ins.rs1, imm=ins.imm):
+        target = (x[rs1] + imm) & 0xFFFFFFFE
+        if rd:
+            x[rd] = pc + 4
+        return target
+    return jalr
+
+
+#Dispatch table: mnemonic -> handler factory
+EXECUTE = {
+    'lw'    : exec_lw,
+    'addi'  : exec_addi,
+    'slli'  : make_alu_imm(lambda a, shamt: a << shamt),
+    'slti'  : make_alu_imm(lambda a, imm: int(signed32(a) < imm)),
+    'sltiu' : make_alu_imm(lambda a, imm: int(a < (imm & MASK32))),
+    'xori'  : make_alu_imm(lambda a, imm: a ^ imm),
+    'srli'  : make_alu_imm(lambda a, shamt: a >> shamt),
+    'srai'  : make_alu_imm(lambda a, shamt: signed32(a) >> shamt),
+    'ori'   : make_alu_imm(lambda a, imm: a | imm),
+    'andi'  : make_alu_imm(lambda a, imm: a & imm),
+    'auipc' : exec_auipc,
+    'sw'    : exec_sw,
+    'add'   : exec_add,
+    'sub'   : make_alu_reg(lambda a, b: a - b),
+    'sll'   : make_alu_reg(lambda a, b: a << (b & 0x1F)),
+    'slt'   : make_alu_reg(lambda a, b: int(signed32(a) < signed32(b))),
+    'sltu'  : make_alu_reg(lambda a, b: int(a < b)),
+    'xor'   : make_alu_reg(lambda a, b: a ^ b),
+    'srl'   : make_alu_reg(lambda a, b: a >> (b & 0x1F)),
+    'sra'   : make_alu_reg(lambda a, b: signed32(a) >> (b & 0x1F)),
+    'or'    : make_alu_reg(lambda a, b: a | b),
+    'and'   : exec_and,
+    'lui'   : exec_lui,
+    'beq'   : exec_beq,
+    'bne'   : exec_bne,
+    'jalr'  : exec_jalr,
+    'jal'   : exec_jal,
+}
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: trace_handler(Simulator, Instruction, function, TraceWriter)             |#
+#| Description: Wraps the handler of an instruction with the recording of its trace   |#
+#|    record (rd write data, lw address and loaded word, sw address and stored word). |#
+#|    The record words are appended straight to the buffer of the writer              |#
+#| Input:                                                                             |#
+#|    Simulator - the simulator                                                       |#
+#|    Instruction - the decoded instruction                                           |#
+#|    function - the handler of the instruction                                       |#
+#|    TraceWriter - the trace writer (riscv_trace.py)                                 |#
+#| Output:                                                                            |#
+#|    function - the tracing handler                                                  |#
+#+------------------------------------------------------------------------------------+#
+def trace_handler(sim, ins, op, writer):
+    x, word, rd, rs1, rs2, imm = sim.x, ins.word, ins.rd, ins.rs1, ins.rs2, ins.imm
+    words, chunk_words, flush = writer.words, writer.chunk_words, writer.flush
+    if ins.mnemonic == 'lw':
+        rd_flags = rd | (riscv_trace.TRACE_LOAD | (riscv_trace.TRACE_RD_WRITE if rd else 0)) << 8
+        def traced_lw(pc):
+            addr = (x[rs1] + imm) & MASK32
+            next_pc = op(pc)
+            words.extend((pc, word, rd_flags, x[rd], addr, x[rd]))
+            if len(words) >= chunk_words:
+                flush()
+            return next_pc
+        return traced_lw
+    if ins.mnemonic == 'sw':
+        store_flags = riscv_trace.TRACE_STORE << 8
+        def traced_sw(pc):
+            addr, data = (x[rs1] + imm) & MASK32, x[rs2]
+            next_pc = op(pc)
+            words.extend((pc, word, store_flags, 0, addr, data))
+            if len(words) >= chunk_words:
+                flush()
+            return next_pc
+        return traced_sw
+    if not rd or ins.type in ('S', 'B'):
+        rd = 0
+    rd_flags = rd | (riscv_trace.TRACE_RD_WRITE << 8 if rd else 0)
+    def traced(pc):
+        try:
+            next_pc = op(pc)
+        except Halt:
+            words.extend((pc, word, rd_flags, x[rd], 0, 0))
+            raise
+        words.extend((pc, word, rd_flags, x[rd], 0, 0))
+        if len(words) >= chunk_words:
+            flush()
+        return next_pc
+    return traced
+
+
+#+------------------------------------------------------------------------------------+#
+#|                                   Basic blocks                                     |#
+#| A block is the straight-line run of instructions that starts at an entry PC. The   |#
+#| run continues through the fall-through path of conditional branches (each one is a |#
+#| side exit of the block) and through the target of direct jumps (jal), and it ends  |#
+#| at jalr, at a halt, at an instruction that is already part of the block or after   |#
+#| MAX_BLOCK_LENGTH instructions. The block is translated once into the source of one |#
+#| Python function that executes all of its instructions inline and returns the       |#
+#| tuple (next PC, number of retired instructions), so the main loop makes one call   |#
+#| per block instead of one per instruction.                                          |#
+#+------------------------------------------------------------------------------------+#
+
+#Maximum number of instructions in a basic block
+MAX_BLOCK_LENGTH = 64
+
+#Compiled block code, keyed by the generated source
+BLOCK_CODE_CACHE = {}
+
+SIGNED = "((x[{rs1}] ^ 0x80000000) - 0x80000000)"
+
+#Python expression of the value written to rd, for the instructions without side effects
+BLOCK_EXPRESSIONS = {
+    'addi'  : "(x[{rs1}] + {imm}) & 0xFFFFFFFF",
+    'slli'  : "(x[{rs1}] << {imm}) & 0xFFFFFFFF",
+    'slti'  : "int(" + SIGNED + " < {imm})",
+    'sltiu' : "int(x[{rs1}] < {uimm})",
+    'xori'  : "x[{rs1}] ^ {uimm}",
+    'srli'  : "x[{rs1}] >> {imm}",
+    'srai'  : "(" + SIGNED + " >> {imm}) & 0xFFFFFFFF",
+    'ori'   : "x[{rs1}] | {uimm}",
+    'andi'  : "x[{rs1}] & {uimm}",
+    'auipc' : "{auipc}",
+    'lui'   : "{imm}",
+    'add'   : "(x[{rs1}] + x[{rs2}]) & 0xFFFFFFFF",
+    'sub'   : "(x[{rs1}] - x[{rs2}]) & 0xFFFFFFFF",
+    'sll'   : "(x[{rs1}] << (x[{rs2}] & 0x1F)) & 0xFFFFFFFF",
+    'slt'   : "int(" + SIGNED + " < ((x[{rs2}] ^ 0x80000000) - 0x80000000))",
+    'sltu'  : "int(x[{rs1}] < x[{rs2}])",
+    'xor'   : "x[{rs1}] ^ x[{rs2}]",
+    'srl'   : "x[{rs1}] >> (x[{rs2}] & 0x1F)",
+    'sra'   : "(" + SIGNED + " >> (x[{rs2}] & 0x1F)) & 0xFFFFFFFF",
+    'or'    : "x[{rs1}] | x[{rs2}]",
+    'and'   : "x[{rs1}] & x[{rs2}]",
+}
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: block_code(Instruction, int, int)                                        |#
+#| Description: Translates one instruction of a block into Python source lines        |#
+#| Input:                                                                             |#
+#|    Instruction - the decoded instruction                                           |#
+#|    int - the PC of the instruction                                                 |#
+#|    int - the position of the instruction inside the block                          |#
+#| Output:                                                                            |#
+#|    tuple - (list of source lines, PC of the next instruction of the block or None  |#
+#|             if the instruction leaves the block)                                   |#
+#+------------------------------------------------------------------------------------+#
+def block_code(ins, pc, position):
+    m = ins.mnemonic
+    fields = {'rd': ins.rd, 'rs1': ins.rs1, 'rs2': ins.rs2, 'imm': ins.imm,
+              'uimm': ins.imm & MASK32, 'auipc': (pc + ins.imm) & MASK32}
+    retired = position + 1
+
+    if m in BLOCK_EXPRESSIONS:
+        if ins.rd == 0:
+            return [], pc + 4
+        return ["x[{rd}] = ".format(**fields) + BLOCK_EXPRESSIONS[m].format(**fields)], pc + 4
+
+    if m == 'lw':
+        lines = [f"a = (x[{ins.rs1}] + {ins.imm}) & 0xFFFFFFFF",
+                 f"o = a - {DFM_BASE}",
+                 f"v = dfm[o >> 2] if 0 <= o < {DFM_SIZE} else load(a, {position})"]
+        if ins.rd:
+            lines.append(f"x[{ins.rd}] = v")
+        return lines, pc + 4
+
+    if m == 'sw':
+        return [f"a = (x[{ins.rs1}] + {ins.imm}) & 0xFFFFFFFF",
+                f"o = a - {DFM_BASE}",
+                f"if 0 <= o < {DFM_SIZE}:",
+                f"    dfm[o >> 2] = x[{ins.rs2}]",
+                f"    valid[o >> 2] = 1",
+                f"else:",
+                f"    store(a, x[{ins.rs2}], {position})"], pc + 4
+
+    if m in ('beq', 'bne'):
+        compare = '==' if m == 'beq' else '!='
+        return [f"if x[{ins.rs1}] {compare} x[{ins.rs2}]:",
+                f"    return ({(pc + ins.imm) & MASK32}, {retired})"], pc + 4
+
+    if m == 'jal':
+        lines = [f"x[{ins.rd}] = {pc + 4}"] if ins.rd else []
+        if ins.imm == 0:
+            return lines + [f"raise Halt({retired}, {pc})"], None
+        return lines, (pc + ins.imm) & MASK32
+
+    if m == 'jalr':
+        lines = [f"t = (x[{ins.rs1}] + {ins.imm}) & 0xFFFFFFFE"]
+        if ins.rd:
+            lines.append(f"x[{ins.rd}] = {pc + 4}")
+        return lines + [f"return (t, {retired})"], None
+
+    raise ValueError(f"Simulation Error! No block translation for '{m}'!")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: PipelineTiming                                                              |#
+#| Description: Cycle approximate model of RTL/CPU/cpu_pipeline_v2.sv (5 stages:      |#
+#|    Fetch, Decode, Execute, Memory, Write Back) and of cpu_hazard_unit.sv:          |#
+#|    - load hazard: a lw in Execute whose destination matches one of the raw source  |#
+#|      fields of the instruction in Decode stalls Fetch/Decode 1 cycle and puts a    |#
+#|      bubble in Execute (the unit does not check the instruction type nor x0)       |#
+#|    - forwarding: an Execute source register (not x0) that matches the destination  |#
+#|      of a register writing instruction in Memory (priority) or Write Back is       |#
+#|      forwarded, it costs no cycle but it is counted                                |#
+#|    - control hazard: branches are predicted not taken and resolved in Execute, a   |#
+#|      taken branch or any jump (jal/jalr) flushes Decode and Execute (2 cycles)     |#
+#|    The pipeline fill adds 4 cycles to the first instruction.                       |#
+#| Input:                                                                             |#
+#|    list - the decoded PFM words (None for words that are not instructions)         |#
+#+------------------------------------------------------------------------------------+#
+class PipelineTiming:
+    #Cycles lost by a taken branch/jump and by a load hazard, cycles to fill the pipeline
+    FLUSH_PENALTY = 2
+    LOAD_USE_PENALTY = 1
+    PIPELINE_FILL = 4
+
+    def __init__(self, decoded):
+        size = len(decoded)
+        #Static information of every PFM word, indexed by PC/4
+        self.src1 = array('B', (ins.rs1 if ins else 0 for ins in decoded))
+        self.src2 = array('B', (ins.rs2 if ins else 0 for ins in decoded))
+        self.dest = array('B', (ins.rd if ins and ins.type not in ('S', 'B') else 0 for ins in decoded))
+        self.load_dest = array('b', (ins.rd if ins and ins.mnemonic == 'lw' else -1 for ins in decoded))
+        self.control = bytearray(1 if ins and ins.type in ('B', 'J') or (ins and ins.mnemonic == 'jalr') else 0
+                                 for ins in decoded)
+        #Dynamic counters
+        self.executed = array('Q', bytes(8 * size))
+        self.load_use_stalls = array('Q', bytes(8 * size))
+        self.flush_cycles = array('Q', bytes(8 * size))
+        self.forward_from_mem = 0
+        self.forward_from_wb = 0
+        self.instructions = 0
+        #Pipeline state between two runs: destination registers of the instructions in
+        #the Memory and Write Back stages and the destination of a lw in Execute
+        self.m_dest = 0
+        self.w_dest = 0
+        self.e_load_dest = -1
+
+    @property
+    def stall_cycles(self):
+        return sum(self.load_use_stalls)
+
+    @property
+    def flush_total(self):
+        return sum(self.flush_cycles)
+
+    @property
+    def cycles(self):
+        if not self.instructions:
+            return 0
+        return self.instructions + self.stall_cycles + self.flush_total + self.PIPELINE_FILL
+
+    @property
+    def cpi(self):
+        return self.cycles / self.instructions if self.instructions else 0.0
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: stall_breakdown(list)                                                |#
+    #| Description: Returns the PCs that lost cycles, the most expensive first        |#
+    #| Input:                                                                         |#
+    #|    list - the decoded PFM words                                                |#
+    #| Output:                                                                        |#
+    #|    list - (pc, mnemonic, executed, load use stall cycles, flush cycles)        |#
+    #+--------------------------------------------------------------------------------+#
+    def stall_breakdown(self, decoded):
+        rows = [(i * 4, decoded[i].mnemonic if decoded[i] else '?', self.executed[i],
+                 self.load_use_stalls[i], self.flush_cycles[i])
+                for i in range(len(self.executed)) if self.load_use_stalls[i] or self.flush_cycles[i]]
+        rows.sort(key=lambda row: (-(row[3] + row[4]), row[0]))
+        return rows
+
+    def report(self, decoded, top=20):
+        lines = [f"cycles: {self.cycles}  instructions: {self.instructions}  CPI: {self.cpi:.3f}",
+                 f"load use stalls: {self.stall_cycles} cycles  branch/jump flushes: {self.flush_total} cycles",
+                 f"forwarding: {self.forward_from_mem} from Memory, {self.forward_from_wb} from Write Back",
+                 "PC          instr   executed   load-use      flush"]
+        for pc, mnemonic, executed, stalls, flushes in self.stall_breakdown(decoded)[:top]:
+            lines.append(f"0x{pc:08x}  {mnemonic:6s} {executed:9d} {stalls:10d} {flushes:10d}")
+        return '\n'.join(lines)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: ExecutionCounters                                                           |#
+#| Description: Per PC execution counters of the 'step' and 'block' modes (the        |#
+#|    'timing' mode counts in PipelineTiming). The step mode counts every instruction |#
+#|    in executed, the block mode counts the (entry PC, length) of every executed     |#
+#|    trace in a histogram: slots[i] is the offset of the histogram of the traces     |#
+#|    that start at PFM word i (-1 if none ran yet), traces[slot + length] their      |#
+#|    count. fold() adds the histograms to executed through the covered words of the  |#
+#|    cached blocks                                                                   |#
+#| Input:                                                                             |#
+#|    int - the number of PFM words                                                   |#
+#+------------------------------------------------------------------------------------+#
+class ExecutionCounters:
+    TRACE_SLOT = MAX_BLOCK_LENGTH + 1
+
+    def __init__(self, size):
+        self.executed = array('Q', bytes(8 * size))
+        self.slots = array('l', [-1]) * size
+        self.traces = array('Q')
+        self.entries = []
+
+    def count_trace(self, index, length, times=1):
+        slot = self.slots[index]
+        if slot < 0:
+            slot = self.slots[index] = len(self.traces)
+            self.traces.extend(array('Q', bytes(8 * self.TRACE_SLOT)))
+            self.entries.append(index)
+        self.traces[slot + length] += times
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: fold(list)                                                           |#
+    #| Description: Adds the trace histograms to the per PC counters and clears them, |#
+    #|    the word at position p of a block ran once per trace longer than p         |#
+    #| Input:                                                                         |#
+    #|    list - the block cache of the simulator (the blocks that ran must be cached)|#
+    #+--------------------------------------------------------------------------------+#
+    def fold(self, blocks):
+        executed, traces = self.executed, self.traces
+        for index in self.entries:
+            slot = self.slots[index]
+            covered = blocks[index][1]
+            running = 0
+            for length in range(self.TRACE_SLOT - 1, 0, -1):
+                running += traces[slot + length]
+                if running:
+                    executed[covered[length - 1]] += running
+                traces[slot + length] = 0
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: source_registers(Instruction)                                            |#
+#| Description: Returns the registers that an instruction reads                       |#
+#+------------------------------------------------------------------------------------+#
+def source_registers(ins):
+    if ins.type in ('R', 'S', 'B'):
+        return (ins.rs1, ins.rs2)
+    if ins.type == 'I':
+        return (ins.rs1,)
+    return ()
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: IdleLoop                                                                    |#
+#| Description: A loop without side effects (a polling loop): the PFM word indexes of |#
+#|    its head and of its last instruction and the fast-forward statistics            |#
+#+------------------------------------------------------------------------------------+#
+class IdleLoop:
+    __slots__ = ('head', 'end', 'fast_forwards', 'iterations', 'cycles')
+
+    def __init__(self, head, end):
+        self.head = head
+        self.end = end
+        self.fast_forwards = 0
+        self.iterations = 0
+        self.cycles = 0
+
+    def report(self):
+        return (f"idle loop 0x{self.head * 4:08x}-0x{self.end * 4:08x}: {self.fast_forwards} fast-forward(s), "
+                f"{self.iterations} iterations, {self.cycles} cycles skipped")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: find_idle_loops(list)                                                    |#
+#| Description: Finds the loops that can be fast-forwarded. A loop is the PC range    |#
+#|    from the target of a backward branch/jump to the branch/jump and it qualifies   |#
+#|    if it:                                                                          |#
+#|    - only contains lw, ALU instructions, beq/bne and jal zero (no sw, no calls)    |#
+#|    - has no branch into the middle of the loop (every path starts at the head)     |#
+#|    - has no loop carried register (read before it is written in the loop)          |#
+#|    - reads memory (the exit condition depends on a load)                           |#
+#|    Such a loop repeats the same iteration as long as its loads return the same     |#
+#|    values                                                                          |#
+#| Input:                                                                             |#
+#|    list - the decoded PFM words                                                    |#
+#| Output:                                                                            |#
+#|    dict - PFM word index of the head -> IdleLoop                                   |#
+#+------------------------------------------------------------------------------------+#
+def find_idle_loops(decoded):
+    loops = {}
+    for end, ins in enumerate(decoded):
+        if ins is None or ins.type not in ('B', 'J') or ins.imm >= 0 or (ins.type == 'J' and ins.rd):
+            continue
+        head = end + (ins.imm >> 2)
+        if head < 0:
+            continue
+        body = decoded[head:end + 1]
+        if any(i is None for i in body):
+            continue
+        written = {i.rd for i in body if i.rd and i.type not in ('S', 'B')}
+        defined = set()
+        qualifies = any(i.mnemonic == 'lw' for i in body)
+        for index, i in enumerate(body, head):
+            if i.mnemonic in ('sw', 'jalr') or (i.type == 'J' and i.rd):
+                qualifies = False
+            elif i.type in ('B', 'J'):
+                target = index + (i.imm >> 2)
+                if head < target <= end:
+                    qualifies = False
+            if any(r and r in written and r not in defined for r in source_registers(i)):
+                qualifies = False
+            if not qualifies:
+                break
+            if i.type not in ('S', 'B'):
+                defined.add(i.rd)
+        if qualifies:
+            loops[head] = IdleLoop(head, end)
+    return loops
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: FastForward                                                                 |#
+#| Description: Idle loop fast-forward engine. When an idle loop completes an         |#
+#|    iteration, the SFRs that the iteration read are read again: if they still hold  |#
+#|    the same values, the next iterations are identical until the peripheral models |#
+#|    report a change (Mcu.next_event). The iterations whose SFR reads all happen     |#
+#|    before the change are skipped at once: the caller adds their instructions,      |#
+#|    cycles and counters, the registers and memories are already in their final      |#
+#|    state. An idle loop that never sees an event runs until the instruction limit   |#
+#| Input:                                                                             |#
+#|    list - the decoded PFM words                                                    |#
+#+------------------------------------------------------------------------------------+#
+class FastForward:
+    #Longest list of SFR reads recorded for one iteration
+    MAX_RECORDED_READS = 64
+
+    def __init__(self, decoded):
+        self.loops = find_idle_loops(decoded)
+        self.heads = bytearray(PFM_SIZE // 4)
+        for head in self.loops:
+            self.heads[head] = 1
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: skip_count(Simulator, list, int, int, int, int)                      |#
+    #| Description: Returns the number of iterations that can be skipped              |#
+    #| Input:                                                                         |#
+    #|    Simulator - the simulator (SFR space)                                       |#
+    #|    list - the SFR reads of the last iteration (address, value, cycle)          |#
+    #|    int - the cycle at which the next iteration starts                          |#
+    #|    int - the cycles of one iteration                                           |#
+    #|    int - the instructions of one iteration                                     |#
+    #|    int - the instructions that can still be executed                           |#
+    #+--------------------------------------------------------------------------------+#
+    def skip_count(self, sim, reads, start, cycles, instructions, budget):
+        if reads is None or cycles <= 0 or instructions <= 0:
+            return 0
+        for addr, value, _ in reads:
+            if sim.sfr_peek(addr, start) != value:
+                return 0
+        count = budget // instructions
+        event = sim.mcu.next_event(start)
+        if reads and event is not None:
+            #Offset of the last SFR read inside the iteration, every read must happen
+            #before the cycle in which the change becomes visible
+            last = max(cycle for _, _, cycle in reads) - (start - cycles)
+            if start + last >= event:
+                return 0
+            count = min(count, (event - 1 - start - last) // cycles + 1)
+        return count
+
+    def record(self, head, iterations, cycles):
+        loop = self.loops[head]
+        loop.fast_forwards += 1
+        loop.iterations += iterations
+        loop.cycles += iterations * cycles
+
+    def report(self):
+        return '\n'.join(loop.report() for loop in self.loops.values() if loop.fast_forwards)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: read_memory_file(string)                                                 |#
+#| Description: Reads a memory file with one 32 bit word per line, in binary          |#
+#|    (pfm.bin/dfm.bin) or hexadecimal with '0x' prefix (pfm.hex/dfm.hex). Unknown    |#
+#|    words ('x' in simulation dumps) are returned as None                            |#
+#| Input:                                                                             |#
+#|    string - path of the memory file                                                |#
+#| Output:                                                                            |#
+#|    list - the words of the file                                                    |#
+#+------------------------------------------------------------------------------------+#
+def read_memory_file(path):
+    words = []
+    with open(path, "r") as mem_file:
+        for line in mem_file:
+            line = line.strip()
+            if not line or line.startswith('//'):
+                continue
+            if 'x' in line[2:] or 'X' in line[2:] or line in ('x', 'X'):
+                words.append(None)
+            elif line.startswith('0x'):
+                words.append(int(line, 16))
+            else:
+                words.append(int(line, 2))
+    return words
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Simulator                                                                   |#
+#| Description: RV32I instruction set simulator                                       |#
+#| Input:                                                                             |#
+#|    iterable - the PFM words (from PFM_BASE)                                        |#
+#|    iterable - the DFM words (from DFM_BASE), None entries are unknown words        |#
+#+------------------------------------------------------------------------------------+#
+class Simulator:
+    def __init__(self, pfm_words, dfm_words=()):
+        #Register file, x0 is never written by the handlers
+        self.x = [0] * 32
+        self.pc = PFM_BASE
+        self.instret = 0
+        self.stop_reason = None
+
+        #Data memory, dfm_valid marks the words that were loaded or written (the others
+        #are dumped as 'x' like in the RTL simulation)
+        self.dfm = array('I', bytes(DFM_SIZE))
+        self.dfm_valid = bytearray(DFM_SIZE // 4)
+        for i, word in enumerate(dfm_words):
+            if word is not None:
+                self.dfm[i] = word
+                self.dfm_valid[i] = 1
+
+        #SFR/IO space: the peripheral models of the MCU, the other addresses are plain
+        #registers. cycle is the system clock cycle of the instruction (or of the first
+        #instruction of the block) being executed, the peripherals run on this time base
+        self.mcu = riscv_peripherals.Mcu()
+        self.sfr_regs = {}
+        self.cycle = 0
+        #SFR reads (address, value, cycle) of the idle loop iteration being recorded
+        self.sfr_reads = None
+
+        #Trace record writer (riscv_trace.TraceWriter), set by enable_trace()
+        self.trace = None
+
+        #Pre-decode the program memory
+        self.pfm = array('I', pfm_words)
+        self.decoded = [decode(word) for word in self.pfm]
+        self.ops = [self.compile(i, ins) for i, ins in enumerate(self.decoded)]
+        self.ops.extend([self.end_of_program] * (PFM_SIZE // 4 - len(self.ops)))
+
+        #Basic block cache, indexed by the PFM word index of the block entry PC
+        self.blocks = [None] * len(self.ops)
+
+        #Pipeline timing model, created by the first run in 'timing' mode
+        self.timing = None
+
+        #Execution counters of the step/block modes, created by enable_profiling()
+        self.profile = None
+        #Idle loop fast-forward engine
+        self.idle_loops = FastForward(self.decoded)
+
+        #PC -> source lookups (riscv_debug_map.SourceMap), None if the source is unknown
+        self.source_map = None
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: from_image(Image)                                                    |#
+    #| Description: Creates a simulator loaded with an assembled program              |#
+    #+--------------------------------------------------------------------------------+#
+    @classmethod
+    def from_image(cls, image):
+        return cls(image.pfm, image.dfm_words())
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: from_files(string, string)                                           |#
+    #| Description: Creates a simulator loaded with pfm/dfm .bin/.hex files           |#
+    #+--------------------------------------------------------------------------------+#
+    @classmethod
+    def from_files(cls, pfm_path, dfm_path=None):
+        pfm_words = [word or 0 for word in read_memory_file(pfm_path)]
+        dfm_words = read_memory_file(dfm_path) if dfm_path else ()
+        return cls(pfm_words, dfm_words)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: compile(int, Instruction)                                            |#
+    #| Description: Returns the handler closure of the PFM word at the given index    |#
+    #+--------------------------------------------------------------------------------+#
+    def compile(self, index, ins):
+        if ins is None:
+            word = self.pfm[index]
+            def illegal(pc):
+                raise ValueError(f"Simulation Error! Illegal instruction 0x{word:08x} at PC 0x{pc:08x}!")
+            return illegal
+        op = EXECUTE[ins.mnemonic](self, ins)
+        return op if self.trace is None else trace_handler(self, ins, op, self.trace)
+
+    def end_of_program(self, pc):
+        raise EndOfProgram()
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: load(int, int) / store(int, int, int)                                |#
+    #| Description: Bus accesses outside of the DFM (SFR and IO space). position is   |#
+    #|    the index of the instruction inside the basic block being executed          |#
+    #+--------------------------------------------------------------------------------+#
+    def load(self, addr, position=0):
+        if addr >= IO_BASE:
+            return self.sfr_read(addr & ~0x3, self.cycle + position)
+        raise ValueError(f"Simulation Error! Load from unmapped address 0x{addr:08x} at PC 0x{self.pc:08x}!")
+
+    def store(self, addr, value, position=0):
+        if addr >= IO_BASE:
+            self.sfr_write(addr & ~0x3, value, self.cycle + position)
+            return
+        raise ValueError(f"Simulation Error! Store to unmapped address 0x{addr:08x} at PC 0x{self.pc:08x}!")
+
+    def sfr_read(self, addr, cycle):
+        value = self.sfr_peek(addr, cycle)
+        reads = self.sfr_reads
+        if reads is not None:
+            if len(reads) < FastForward.MAX_RECORDED_READS:
+                reads.append((addr, value, cycle))
+            else:
+                self.sfr_reads = None
+        return value
+
+    def sfr_peek(self, addr, cycle):
+        if addr in self.mcu:
+            return self.mcu.read(addr, cycle)
+        return self.sfr_regs.get(addr, 0)
+
+    def sfr_write(self, addr, value, cycle):
+        if addr in self.mcu:
+            self.mcu.write(addr, value, cycle)
+        else:
+            self.sfr_regs[addr] = value
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: build_block(int)                                                     |#
+    #| Description: Translates the block that starts at a PFM word index and stores   |#
+    #|    it in the block cache. Blocks are keyed by their entry PC, so a jump into   |#
+    #|    the middle of a cached block builds a new block from that PC instead of     |#
+    #|    reusing the one that covers it. A block also ends before a word that cannot |#
+    #|    be translated (illegal instruction or end of the programmed PFM)            |#
+    #| Input:                                                                         |#
+    #|    int - the PFM word index of the entry PC                                    |#
+    #| Output:                                                                        |#
+    #|    tuple - (block function f(pc) -> (next_pc, retired), PFM word indexes that  |#
+    #|             the block covers)                                                  |#
+    #+--------------------------------------------------------------------------------+#
+    def build_block(self, index):
+        lines = []
+        covered = []
+        pc = index * 4
+        while len(covered) < MAX_BLOCK_LENGTH:
+            i = pc >> 2
+            if i in covered or i >= len(self.decoded) or self.decoded[i] is None:
+                break
+            code, next_pc = block_code(self.decoded[i], pc, len(covered))
+            lines.extend(code)
+            covered.append(i)
+            if next_pc is None:
+                break
+            pc = next_pc
+        else:
+            next_pc = pc
+
+        if not covered:
+            #Nothing to translate, the single instruction handler reports the error
+            ops = self.ops
+            def single(pc):
+                return ops[index](pc), 1
+            block = (single, [index])
+        else:
+            if next_pc is not None:
+                lines.append(f"return ({pc}, {len(covered)})")
+            source = "def block(pc, x=x, dfm=dfm, valid=valid, load=load, store=store, Halt=Halt):\n" + \
+                     ''.join("    " + line + "\n" for line in lines)
+            #The generated source only depends on the instructions and their PCs, so the
+            #compiled code is shared by every simulator that runs the same program
+            code = BLOCK_CODE_CACHE.get(source)
+            if code is None:
+                code = BLOCK_CODE_CACHE[source] = compile(source, f"<block 0x{index * 4:08x}>", "exec")
+            namespace = {'x': self.x, 'dfm': self.dfm, 'valid': self.dfm_valid,
+                         'load': self.load, 'store': self.store, 'Halt': Halt}
+            exec(code, namespace)
+            block = (namespace['block'], covered)
+        self.blocks[index] = block
+        return block
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: patch_pfm(int, int)                                                  |#
+    #| Description: Replaces a PFM word (e.g. when the program is reloaded in place)  |#
+    #|    and drops every cached block that contains the address                      |#
+    #| Input:                                                                         |#
+    #|    int - the PFM address                                                       |#
+    #|    int - the new machine word                                                  |#
+    #+--------------------------------------------------------------------------------+#
+    def patch_pfm(self, addr, word):
+        index = (addr - PFM_BASE) >> 2
+        if self.profile is not None:
+            self.profile.fold(self.blocks)
+        while index >= len(self.pfm):
+            self.pfm.append(0)
+            self.decoded.append(None)
+        self.pfm[index] = word
+        self.decoded[index] = decode(word)
+        self.ops[index] = self.compile(index, self.decoded[index])
+        #Blocks follow jumps, so any block may cover the address
+        for start, block in enumerate(self.blocks):
+            if block is not None and index in block[1]:
+                self.blocks[start] = None
+        self.idle_loops = FastForward(self.decoded)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: enable_profiling()                                                   |#
+    #| Description: Counts the executed instructions of the next runs in every mode   |#
+    #|    (the runs without profiling do not pay for the counters)                    |#
+    #+--------------------------------------------------------------------------------+#
+    def enable_profiling(self):
+        if self.profile is None:
+            self.profile = ExecutionCounters(len(self.ops))
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: enable_trace(TraceWriter)                                            |#
+    #| Description: Records every retired instruction of the next runs. The block     |#
+    #|    mode runs as step mode and the idle loops are not fast-forwarded while the  |#
+    #|    trace is enabled (every instruction gets its record)                        |#
+    #| Input:                                                                         |#
+    #|    TraceWriter - the trace writer (riscv_trace.py)                             |#
+    #+--------------------------------------------------------------------------------+#
+    def enable_trace(self, writer):
+        self.trace = writer
+        for i, ins in enumerate(self.decoded):
+            self.ops[i] = self.compile(i, ins)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: executed_counts()                                                    |#
+    #| Description: Returns the number of executions of every PFM word in all modes   |#
+    #+--------------------------------------------------------------------------------+#
+    def executed_counts(self):
+        counts = array('Q', bytes(8 * len(self.ops)))
+        if self.profile is not None:
+            self.profile.fold(self.blocks)
+            counts = array('Q', self.profile.executed)
+        if self.timing is not None:
+            for i, count in enumerate(self.timing.executed):
+                counts[i] += count
+        return counts
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: run(int, string)                                                     |#
+    #| Description: Executes the program from the current PC until it halts (jump to  |#
+    #|    itself), runs out of the programmed PFM or max_instructions are retired     |#
+    #| Input:                                                                         |#
+    #|    int - the maximum number of instructions to execute                         |#
+    #|    string - 'block' (cached basic blocks), 'step' (one handler call per        |#
+    #|             instruction) or 'timing' (step mode with the pipeline timing model)|#
+    #|    bool - skip the idle loop iterations (block and timing modes, the step mode |#
+    #|           always executes every instruction)                                   |#
+    #| Output:                                                                        |#
+    #|    string - the stop reason: 'halt', 'end' or 'limit'                          |#
+    #+--------------------------------------------------------------------------------+#
+    def run(self, max_instructions=DEFAULT_MAX_INSTRUCTIONS, mode='block', fast_forward=True):
+        if self.trace is not None:
+            fast_forward = False
+            mode = 'step' if mode == 'block' else mode
+        if mode == 'block':
+            self.run_blocks(max_instructions, fast_forward)
+        elif mode == 'timing':
+            self.run_timed(max_instructions, fast_forward)
+        else:
+            self.run_steps(max_instructions)
+        return self.stop_reason
+
+    def run_steps(self, max_instructions):
+        ops = self.ops
+        pc = self.pc
+        start_cycle = self.cycle
+        retired = 0
+        profile = self.profile
+        try:
+            if profile is None:
+                for retired in range(max_instructions):
+                    self.cycle = start_cycle + retired
+                    pc = ops[pc >> 2](pc)
+            else:
+                executed = profile.executed
+                for retired in range(max_instructions):
+                    self.cycle = start_cycle + retired
+                    i = pc >> 2
+                    pc = ops[i](pc)
+                    executed[i] += 1
+            retired = max_instructions
+            self.stop_reason = 'limit'
+        except Halt:
+            retired += 1
+            if profile is not None:
+                profile.executed[pc >> 2] += 1
+            self.stop_reason = 'halt'
+        except (EndOfProgram, IndexError):
+            self.stop_reason = 'end'
+        except Exception:
+            self.pc = pc
+            self.instret += retired
+            raise
+        self.pc = pc
+        self.instret += retired
+        self.cycle = start_cycle + retired
+
+    def run_timed(self, max_instructions, fast_forward=True):
+        if self.timing is None:
+            self.timing = PipelineTiming(self.decoded)
+        timing = self.timing
+        src1, src2, dest = timing.src1, timing.src2, timing.dest
+        load_dest, control = timing.load_dest, timing.control
+        executed, stalls, flushes = timing.executed, timing.load_use_stalls, timing.flush_cycles
+        m_dest, w_dest, e_load_dest = timing.m_dest, timing.w_dest, timing.e_load_dest
+        fwd_mem = fwd_wb = 0
+        flush_penalty = PipelineTiming.FLUSH_PENALTY
+        idle_loops = self.idle_loops
+        heads = idle_loops.heads if fast_forward else bytearray(len(self.ops))
+        #State at the last arrival on an idle loop head
+        arrival = None
+
+        ops = self.ops
+        pc = self.pc
+        #The SFR accesses see the cycle of the Memory stage, the first instruction gets
+        #there after the pipeline fill
+        cycle = self.cycle + (0 if timing.instructions else PipelineTiming.PIPELINE_FILL)
+        retired = 0
+        i = pc >> 2
+        try:
+            while retired < max_instructions:
+                i = pc >> 2
+                if heads[i]:
+                    loop = idle_loops.loops[i]
+                    body = range(i, loop.end + 1)
+                    counters = [array('Q', (c[j] for j in body)) for c in (executed, stalls, flushes)]
+                    state = (m_dest, w_dest, e_load_dest)
+                    if arrival is not None and arrival[0] == i and arrival[4] == state:
+                        #One iteration completed since the last arrival, it stayed in the
+                        #loop if the body counters account for all the instructions
+                        _, last_retired, last_cycle, last_counters, _, last_fwd = arrival
+                        deltas = [[now - before for now, before in zip(c, last)]
+                                  for c, last in zip(counters, last_counters)]
+                        instructions = retired - last_retired
+                        if sum(deltas[0]) == instructions:
+                            skip = idle_loops.skip_count(self, self.sfr_reads, cycle, cycle - last_cycle,
+                                                         instructions, max_instructions - retired)
+                            if skip:
+                                idle_loops.record(i, skip, cycle - last_cycle)
+                                for c, delta in zip((executed, stalls, flushes), deltas):
+                                    for j, d in zip(body, delta):
+                                        c[j] += skip * d
+                                fwd_mem += skip * (fwd_mem - last_fwd[0])
+                                fwd_wb += skip * (fwd_wb - last_fwd[1])
+                                retired += skip * instructions
+                                cycle += skip * (cycle - last_cycle)
+                                counters = [array('Q', (c[j] for j in body)) for c in (executed, stalls, flushes)]
+                                if retired >= max_instructions:
+                                    break
+                    arrival = (i, retired, cycle, counters, state, (fwd_mem, fwd_wb))
+                    self.sfr_reads = []
+                s1 = src1[i]
+                s2 = src2[i]
+                #Load hazard: the previous instruction is a lw in Execute
+                if e_load_dest >= 0 and (s1 == e_load_dest or s2 == e_load_dest):
+                    stalls[i] += 1
+                    cycle += 1
+                    w_dest = m_dest
+                    m_dest = 0
+                #Forwarding to the Execute stage
+                if s1:
+                    if s1 == m_dest:
+                        fwd_mem += 1
+                    elif s1 == w_dest:
+                        fwd_wb += 1
+                if s2:
+                    if s2 == m_dest:
+                        fwd_mem += 1
+                    elif s2 == w_dest:
+                        fwd_wb += 1
+                self.cycle = cycle
+                next_pc = ops[i](pc)
+                cycle += 1
+                executed[i] += 1
+                w_dest = m_dest
+                m_dest = dest[i]
+                e_load_dest = load_dest[i]
+                if control[i] and next_pc != pc + 4:
+                    #Taken branch/jump, Decode and Execute are flushed
+                    flushes[i] += flush_penalty
+                    cycle += flush_penalty
+                    m_dest = w_dest = 0
+                pc = next_pc
+                retired += 1
+            self.stop_reason = 'limit'
+        except Halt:
+            #The halt is a taken jump to itself
+            executed[i] += 1
+            flushes[i] += flush_penalty
+            cycle += 1 + flush_penalty
+            m_dest = w_dest = 0
+            retired += 1
+            self.stop_reason = 'halt'
+        except (EndOfProgram, IndexError):
+            self.stop_reason = 'end'
+        finally:
+            self.sfr_reads = None
+            timing.m_dest, timing.w_dest, timing.e_load_dest = m_dest, w_dest, e_load_dest
+            timing.forward_from_mem += fwd_mem
+            timing.forward_from_wb += fwd_wb
+            timing.instructions += retired
+            self.pc = pc
+            self.instret += retired
+            self.cycle = cycle
+
+    def run_blocks(self, max_instructions, fast_forward=True):
+        blocks = self.blocks
+        build_block = self.build_block
+        idle_loops = self.idle_loops
+        heads = idle_loops.heads if fast_forward else bytearray(len(self.ops))
+        profile = self.profile
+        pc = self.pc
+        retired = 0
+        #A whole block always fits in the budget while retired <= safe_limit, the
+        #remaining instructions are executed one by one
+        safe_limit = max_instructions - MAX_BLOCK_LENGTH
+        start_cycle = self.cycle
+        stopped = False
+        try:
+            while retired <= safe_limit:
+                self.cycle = start_cycle + retired
+                index = pc >> 2
+                if not heads[index]:
+                    pc, length = (blocks[index] or build_block(index))[0](pc)
+                    retired += length
+                    if profile is not None:
+                        profile.count_trace(index, length)
+                    continue
+                #Idle loop head: an iteration is one block (a trace that starts at the head)
+                #whose executed part stays in the loop and branches back to the head
+                self.sfr_reads = []
+                block = blocks[index] or build_block(index)
+                pc, length = block[0](pc)
+                retired += length
+                if profile is not None:
+                    profile.count_trace(index, length)
+                end = idle_loops.loops[index].end
+                if pc == index << 2 and all(index <= covered <= end for covered in block[1][:length]):
+                    skip = idle_loops.skip_count(self, self.sfr_reads, start_cycle + retired, length, length,
+                                                 max_instructions - retired)
+                    if skip:
+                        idle_loops.record(index, skip, length)
+                        retired += skip * length
+                        if profile is not None:
+                            profile.count_trace(index, length, skip)
+                self.sfr_reads = None
+        except Halt as stop:
+            #Blocks report the number of retired instructions and the PC of the halt
+            retired += stop.args[0] if stop.args else 1
+            if profile is not None:
+                profile.count_trace(index, stop.args[0] if stop.args else 1)
+            pc = stop.args[1] if stop.args else pc
+            self.stop_reason = 'halt'
+            stopped = True
+        except (EndOfProgram, IndexError):
+            self.stop_reason = 'end'
+            stopped = True
+        except Exception:
+            self.pc = pc
+            self.instret += retired
+            raise
+        finally:
+            self.sfr_reads = None
+        self.pc = pc
+        self.instret += retired
+        self.cycle = start_cycle + retired
+        #A halt/end in the last blocks stops the run, the rest of the budget is not stepped
+        if not stopped and retired > safe_limit:
+            self.run_steps(max_instructions - retired)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: dfm_result_lines(int)                                                |#
+    #| Description: Returns the data memory in the dfm_sim_result.bin format          |#
+    #+--------------------------------------------------------------------------------+#
+    def dfm_result_lines(self, num_words=DFM_RESULT_WORDS):
+        unknown = 'x' * 32
+        return [format(self.dfm[i], '032b') if self.dfm_valid[i] else unknown for i in range(num_words)]
+
+    def write_dfm_result(self, path, num_words=DFM_RESULT_WORDS):
+        with open(path, "w") as result_file:
+            result_file.write(''.join(line + '\n' for line in self.dfm_result_lines(num_words)))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: simulate(Image, int)                                                     |#
+#| Description: Runs an assembled program                                             |#
+#| Input:                                                                             |#
+#|    Image - the assembled program                                                   |#
+#|    int - the maximum number of instructions to execute                             |#
+#| Output:                                                                            |#
+#|    Simulator - the simulator in its final state                                    |#
+#+------------------------------------------------------------------------------------+#
+def simulate(image, max_instructions=DEFAULT_MAX_INSTRUCTIONS):
+    sim = Simulator.from_image(image)
+    sim.run(max_instructions)
+    return sim
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: build_simulator(argparse.Namespace)                                      |#
+#| Description: Creates the simulator from the program arguments of the command line  |#
+#+------------------------------------------------------------------------------------+#
+def build_simulator(args):
+    if args.program.endswith('.asm'):
+        image = riscv_assembler.assemble_file(args.program)
+        sim = Simulator.from_image(image)
+        sim.source_map = riscv_debug_map.SourceMap.from_image(image, args.program)
+        return sim
+    sim = Simulator.from_files(args.program, args.dfm)
+    if args.debug_map:
+        sim.source_map = riscv_debug_map.SourceMap.from_file(args.debug_map)
+    return sim
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: add_program_arguments(argparse.ArgumentParser)                           |#
+#| Description: Adds the program selection arguments of the command line              |#
+#+------------------------------------------------------------------------------------+#
+def add_program_arguments(parser):
+    parser.add_argument("program", help="assembly file (.asm) or PFM memory file (pfm.bin/pfm.hex)")
+    parser.add_argument("--dfm", help="DFM memory file (dfm.bin/dfm.hex) when a PFM file is simulated")
+    parser.add_argument("--debug-map", help="debug map (.map.json) of the program when a PFM file is simulated")
+    parser.add_argument("-n", "--max-instructions", type=int, default=DEFAULT_MAX_INSTRUCTIONS,
+                        help="maximum number of instructions to execute (default: %(default)s)")
+    parser.add_argument("-o", "--output", default="dfm_sim_result.bin", help="data memory dump (default: %(default)s)")
+    parser.add_argument("--mode", choices=("block", "step", "timing"), default="block",
+                        help="basic block execution, one dispatch per instruction or per instruction with the "
+                             "pipeline timing model (default: %(default)s)")
+    parser.add_argument("--stall-report", type=int, default=20, metavar="N",
+                        help="timing mode: number of PCs listed in the stall breakdown (default: %(default)s)")
+    parser.add_argument("--no-fast-forward", dest="fast_forward", action="store_false",
+                        help="execute every iteration of the idle SFR polling loops")
+    parser.add_argument("--profile", type=int, nargs="?", const=20, metavar="N",
+                        help="print the N hottest labels, basic blocks and PCs of the run (default N: 20)")
+    parser.add_argument("--folded", metavar="PATH",
+                        help="write the profile as a folded stack file (flamegraph.pl/speedscope)")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="write the binary trace of the retired instructions (compare with riscv_trace.py, "
+                             "the block mode runs as step mode and the idle loops are not fast-forwarded)")
+    parser.add_argument("--trace-codec", choices=sorted(riscv_trace.CODECS), default="zlib",
+                        help="compression of the trace chunks (default: %(default)s)")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: benchmark_modes(callable, int)                                           |#
+#| Description: Runs the same program in 'step' and 'block' mode                      |#
+#| Input:                                                                             |#
+#|    callable - returns a new Simulator loaded with the program                      |#
+#|    int - the maximum number of instructions to execute                             |#
+#| Output:                                                                            |#
+#|    dict - mode -> (retired instructions, seconds, MIPS)                            |#
+#+------------------------------------------------------------------------------------+#
+def benchmark_modes(new_simulator, max_instructions=DEFAULT_MAX_INSTRUCTIONS):
+    results = {}
+    for mode in ('step', 'block'):
+        sim = new_simulator()
+        start = time.perf_counter()
+        sim.run(max_instructions, mode)
+        elapsed = time.perf_counter() - start
+        results[mode] = (sim.instret, elapsed, sim.instret / elapsed / 1e6 if elapsed > 0 else 0.0)
+    return results
+
+
+def print_mode_comparison(args):
+    results = benchmark_modes(lambda: build_simulator(args), args.max_instructions)
+    for mode, (retired, elapsed, mips) in results.items():
+        print(f"{mode:6s} {retired:12d} instructions {elapsed:9.3f}s {mips:8.2f} MIPS")
+    if results['block'][1] > 0:
+        print(f"speedup {results['step'][1] / results['block'][1]:.2f}x")
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: main(list)                                                               |#
+#| Description: This is the main function (command line entry point)                  |#
+#| Input:                                                                             |#
+#|    list - the command line arguments (sys.argv[1:] if None)                        |#
+#| Output:                                                                            |#
+#|    int - the exit code                                                             |#
+#+------------------------------------------------------------------------------------+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RV32I instruction set simulator")
+    add_program_arguments(parser)
+    parser.add_argument("--compare-modes", action="store_true",
+                        help="benchmark the block mode against the per instruction mode and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare_modes:
+        print_mode_comparison(args)
+        return 0
+
+    sim = build_simulator(args)
+    if args.profile is not None or args.folded:
+        sim.enable_profiling()
+    if args.trace:
+        sim.enable_trace(riscv_trace.TraceWriter(args.trace, args.trace_codec))
+    start = time.perf_counter()
+    try:
+        reason = sim.run(args.max_instructions, args.mode, args.fast_forward)
+    finally:
+        if sim.trace is not None:
+            sim.trace.close()
+    elapsed = time.perf_counter() - start
+    sim.write_dfm_result(args.output)
+
+    mips = sim.instret / elapsed / 1e6 if elapsed > 0 else 0.0
+    where = f" ({sim.source_map.label(sim.pc)} {sim.source_map.location(sim.pc)})" if sim.source_map else ''
+    print(f"Stopped ({reason}) at PC 0x{sim.pc:08x}{where} after {sim.instret} instructions "
+          f"({elapsed:.3f}s, {mips:.2f} MIPS)")
+    if sim.timing is not None:
+        print(sim.timing.report(sim.decoded, args.stall_report))
+    if sim.idle_loops.report():
+        print(sim.idle_loops.report())
+    if args.profile is not None or args.folded:
+        profile = riscv_profiler.Profile(sim)
+        if args.profile is not None:
+            print(profile.report(args.profile))
+        if args.folded:
+            profile.write_folded(args.folded)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
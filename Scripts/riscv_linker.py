@@ -0,0 +1,229 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Linker of the relocatable objects (.rvo) of the RV32I assembler. The    #
+#              PFM gets the gp initialization and then the text of every module in the #
+#              order of the inputs (the first module is the entry point), the DFM gets #
+#              the data of every module (word aligned). The symbols exported with      #
+#              .globl are resolved across the modules and the relocations patched.    #
+#              An .asm input is assembled into its object first, an object is only     #
+#              assembled again when its source (or the assembler) changed, so a change #
+#              of one module of a large firmware only reassembles that module.         #
+# Input: Assembly files (.asm) and/or object files (.rvo)                              #
+# Output: Two binary/hex file containing the machine code and data memory content      #
+########################################################################################
+
+import argparse
+import concurrent.futures
+import functools
+import os
+import struct
+import sys
+from array import array
+
+import riscv_assembler
+import riscv_image_formats
+import riscv_object
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: object_path(string, string)                                              |#
+#| Description: Returns the path of the object of an assembly file, next to the       |#
+#|    source or in the object directory                                               |#
+#+------------------------------------------------------------------------------------+#
+def object_path(asm_path, obj_dir=None):
+    name = os.path.splitext(os.path.basename(asm_path))[0] + riscv_object.OBJECT_SUFFIX
+    return os.path.join(obj_dir or os.path.dirname(asm_path), name)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: build_object(string, string)                                             |#
+#| Description: Returns the object of an assembly file. The object file is reused if  |#
+#|    its digest matches the source and the assembler, otherwise the source is        |#
+#|    assembled and the object file written again                                    |#
+#| Input:                                                                             |#
+#|    string - the path of an assembly file (.asm)                                    |#
+#|    string - the object directory (None to write the object next to the source)    |#
+#| Output:                                                                            |#
+#|    tuple - (ObjectFile, True if the source was assembled)                          |#
+#+------------------------------------------------------------------------------------+#
+def build_object(asm_path, obj_dir=None):
+    with open(asm_path, "r") as asm_file:
+        source = asm_file.read()
+    path = object_path(asm_path, obj_dir)
+    digest = riscv_object.source_digest(source, riscv_assembler.ASSEMBLER_VERSION, riscv_assembler.assembler_config())
+    try:
+        obj = riscv_object.read_object(path)
+        if obj.digest == digest:
+            return obj, False
+    except (OSError, ValueError, KeyError, struct.error):
+        pass
+
+    obj = riscv_assembler.assemble_object(source, asm_path)
+    if obj_dir:
+        os.makedirs(obj_dir, exist_ok=True)
+    riscv_object.write_object(obj, path)
+    return obj, True
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: build_objects(list, string, int)                                         |#
+#| Description: Returns the objects of the inputs, the .asm files are built with      |#
+#|    build_object() on a pool of worker processes                                    |#
+#| Input:                                                                             |#
+#|    list - the paths of the assembly (.asm) and object (.rvo) files                 |#
+#|    string - the object directory (None to write the objects next to the sources)   |#
+#|    int - number of worker processes (os.cpu_count() if None, 1 runs in-process)    |#
+#| Output:                                                                            |#
+#|    tuple - (list of ObjectFile in the input order, number of assembled sources)    |#
+#+------------------------------------------------------------------------------------+#
+def build_objects(paths, obj_dir=None, jobs=None):
+    asm_paths = [path for path in paths if not path.endswith(riscv_object.OBJECT_SUFFIX)]
+    job = functools.partial(build_object, obj_dir=obj_dir)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(asm_paths) <= 1:
+        built = [job(asm_path) for asm_path in asm_paths]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+            built = list(pool.map(job, asm_paths, chunksize=max(1, len(asm_paths) // (jobs * 4))))
+
+    built = dict(zip(asm_paths, built))
+    objects = [built[path][0] if path in built else riscv_object.read_object(path) for path in paths]
+    return objects, sum(assembled for _, assembled in built.values())
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: check_range(string, int, tuple)                                          |#
+#| Description: Raises an error if a relocated offset does not fit its field          |#
+#| Output:                                                                            |#
+#|    int - the offset                                                                |#
+#+------------------------------------------------------------------------------------+#
+def check_range(name, offset, target_range):
+    if not target_range[0] <= offset <= target_range[1]:
+        raise ValueError(f"Link Error! Symbol '{name}' is out of range ({offset} bytes from the instruction)!")
+    return offset
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: link(list, list)                                                         |#
+#| Description: Links the objects of a program. The text of the modules follows the  |#
+#|    gp initialization in the PFM, the data of the modules starts at                 |#
+#|    data_seg_start_addr, every module at a word boundary. A relocation refers to a  |#
+#|    symbol of its own module first, then to the symbols exported by the modules     |#
+#| Input:                                                                             |#
+#|    list - the ObjectFile of every module, the first one is the entry point         |#
+#|    list - the names of the modules for the error messages (None for the indexes)   |#
+#| Output:                                                                            |#
+#|    Image - the PFM and DFM content of the program, the symbol table has the        |#
+#|            exported symbols                                                        |#
+#+------------------------------------------------------------------------------------+#
+def link(objects, names=None):
+    names = names or [f"module {index}" for index in range(len(objects))]
+    gp = riscv_assembler.global_pointer()
+    prog_start, prog_end = int(riscv_assembler.prog_seg_start_addr, 16), int(riscv_assembler.prog_seg_end_addr, 16)
+    data_start, data_end = int(riscv_assembler.data_seg_start_addr, 16), int(riscv_assembler.data_seg_end_addr, 16)
+
+    pfm = array('I', (riscv_assembler.translate_menmonic(line, prog_start + 4 * index, {}) for index, line in
+                      enumerate(riscv_assembler.expand_pseudo(f'li gp, {hex(gp)}', {}))))
+    dfm = bytearray()
+    #(first word index, first data address) of every module
+    bases = []
+    for obj in objects:
+        dfm += bytes(-len(dfm) % 4)
+        bases.append((len(pfm), data_start + len(dfm)))
+        pfm.extend(obj.text)
+        dfm += obj.data
+    if prog_start + 4 * len(pfm) > prog_end + 1:
+        raise ValueError("Link Error! Program Segment is full!")
+    if data_start + len(dfm) > data_end + 1:
+        raise ValueError("Link Error! Data Segment is full!")
+
+    #Address and section of a symbol of a module
+    def address(module, name):
+        section, offset, _ = objects[module].symbols[name]
+        word_index, data_base = bases[module]
+        if section == riscv_object.TEXT:
+            return section, prog_start + 4 * word_index + offset
+        return section, data_base + offset
+
+    exported = {}
+    for module, obj in enumerate(objects):
+        for name in obj.exports():
+            if name in exported:
+                raise ValueError(f"Link Error! Symbol '{name}' is defined in {names[exported[name]]} and "
+                                 f"{names[module]}!")
+            exported[name] = module
+
+    sw_opcode = riscv_assembler.opc_int['sw']
+    for module, obj in enumerate(objects):
+        word_index = bases[module][0]
+        for index, reloc_type, name in obj.relocations:
+            if name in obj.symbols:
+                section, target = address(module, name)
+            elif name in exported:
+                section, target = address(exported[name], name)
+            else:
+                raise ValueError(f"Link Error! Symbol '{name}' used in {names[module]} is not defined!")
+            index += word_index
+            PC = prog_start + 4 * index
+            if reloc_type in (riscv_object.R_BRANCH, riscv_object.R_JUMP) and section != riscv_object.TEXT:
+                raise ValueError(f"Link Error! Branch/jump target '{name}' in {names[module]} is not a text symbol!")
+            if reloc_type == riscv_object.R_BRANCH:
+                offset = check_range(name, target - PC, riscv_assembler.BRANCH_RANGE)
+                pfm[index] |= riscv_assembler.Btype_immediate(offset & 0x1FFF)
+            elif reloc_type == riscv_object.R_JUMP:
+                offset = check_range(name, target - PC, riscv_assembler.JUMP_RANGE)
+                pfm[index] |= riscv_assembler.Jtype_immediate(offset & 0x1FFFFF)
+            elif reloc_type == riscv_object.R_HI20:
+                pfm[index] |= riscv_assembler.split_hi_lo(target)[0]
+            elif reloc_type == riscv_object.R_LO12:
+                pfm[index] |= (riscv_assembler.split_hi_lo(target)[1] & 0xFFF) << 20
+            else:
+                if section != riscv_object.DATA:
+                    raise ValueError(f"Link Error! '{name}' in {names[module]} is not a data variable!")
+                offset = target - gp
+                if (pfm[index] & 0x7F) == sw_opcode:
+                    pfm[index] |= (((offset >> 5) & 0x7F) << 25) | ((offset & 0x1F) << 7)
+                else:
+                    pfm[index] |= (offset & 0xFFF) << 20
+
+    #Exported symbols in the convention of the assembler: text labels as addresses, data
+    #variables as gp relative offsets
+    symbol_table = {}
+    for name, module in exported.items():
+        section, target = address(module, name)
+        symbol_table[name] = target if section == riscv_object.TEXT else \
+            riscv_assembler.compute_signed_Nbit_ta(12, gp, target)
+    return riscv_assembler.Image(pfm, dfm, symbol_table)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: main(list)                                                               |#
+#| Description: This is the main function (command line entry point)                  |#
+#| Input:                                                                             |#
+#|    list - the command line arguments (sys.argv[1:] if None)                        |#
+#| Output:                                                                            |#
+#|    int - the exit code                                                             |#
+#+------------------------------------------------------------------------------------+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Link RV32I modules (.asm/.rvo) into the pfm/dfm memory files")
+    parser.add_argument("inputs", nargs="+", help="assembly (.asm) and object (.rvo) files, the first one is the entry point")
+    parser.add_argument("-o", "--output-dir", default=".", help="directory of the pfm/dfm files (default: current directory)")
+    parser.add_argument("--obj-dir", help="directory of the objects of the .asm inputs (default: next to the sources)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes that assemble the changed sources (default: all cores)")
+    parser.add_argument("-f", "--format", action="append", choices=sorted(riscv_image_formats.FORMATS),
+                        help="output format, repeat for several formats (default: bin and hex)")
+    parser.add_argument("--sparse", action="store_true",
+                        help="leave the runs of 0 words out of the ihex/memh files (the memory must be 0 initialized)")
+    args = parser.parse_args(argv)
+
+    objects, assembled = build_objects(args.inputs, args.obj_dir, args.jobs)
+    image = link(objects, [f"'{path}'" for path in args.inputs])
+    riscv_assembler.write_image(image, args.output_dir, args.format or riscv_image_formats.DEFAULT_FORMATS, args.sparse)
+    print(f"{len(objects)} module(s) linked, {assembled} assembled: {len(image.pfm)} PFM words, "
+          f"{len(image.dfm)} DFM bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Relocatable object files (.rvo) of the RV32I assembler. An object holds #
+#              the encoded text of one module (placed at address 0, without the gp     #
+#              initialization), its data bytes, its symbols (section, offset, exported) #
+#              and the relocation entries of the instruction fields that depend on the  #
+#              final layout. riscv_linker.py places the objects in the PFM/DFM and      #
+#              patches the relocations.                                                #
+# Input: The text/data/symbols of an assembled module                                  #
+# Output: Object files (*.rvo)                                                         #
+########################################################################################
+
+import hashlib
+import json
+import struct
+import sys
+from array import array
+
+#Object file layout (all fields Little Endian):
+#   magic(4s) | text word count(I) | data byte count(I) | symbols json length(I) |
+#   relocation count(I) | source digest(32s)
+#   text words | data bytes | symbols json (utf-8) | relocations
+OBJECT_MAGIC  = b'RVO1'
+OBJECT_HEADER = struct.Struct('<4sIIII32s')
+OBJECT_SUFFIX = '.rvo'
+
+#Relocation: word index(I) | type(H) | index of the symbol name in the names list(H)
+RELOCATION = struct.Struct('<IHH')
+
+#Relocation types, the field of the instruction word that is patched
+R_BRANCH = 0    #B-Type offset to a text symbol
+R_JUMP   = 1    #J-Type offset to a text symbol
+R_HI20   = 2    #U-Type upper 20 bits of the address of a symbol (lui of %hi(symbol))
+R_LO12   = 3    #I-Type lower 12 bits of the address of a symbol (addi of %lo(symbol))
+R_GPREL  = 4    #I/S-Type gp relative offset of a data symbol (lw/sw/addi of symbol(gp))
+
+RELOCATION_NAMES = {R_BRANCH: 'branch', R_JUMP: 'jump', R_HI20: 'hi20', R_LO12: 'lo12', R_GPREL: 'gprel'}
+
+#Sections of a symbol
+TEXT = 'text'
+DATA = 'data'
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: source_digest(string, string, dict)                                      |#
+#| Description: Digest of a module source and of the assembler version/configuration, |#
+#|    stored in the object so the linker can tell if the object is up to date         |#
+#| Output:                                                                            |#
+#|    bytes - SHA-256 digest (32 bytes)                                               |#
+#+------------------------------------------------------------------------------------+#
+def source_digest(source, version, config):
+    digest = hashlib.sha256()
+    digest.update(version.encode())
+    digest.update(b'\0')
+    digest.update(json.dumps(config, sort_keys=True).encode())
+    digest.update(b'\0')
+    digest.update(source.encode())
+    return digest.digest()
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: ObjectFile                                                                  |#
+#| Description: A relocatable module                                                  |#
+#| Attributes:                                                                        |#
+#|    text - array('I') with the machine words, the relocated fields are 0            |#
+#|    data - bytearray with the data segment of the module                            |#
+#|    symbols - dictionary name -> (section, byte offset in the section, exported)    |#
+#|    relocations - list of (word index, relocation type, symbol name)                |#
+#|    digest - source_digest() of the module source (32 zero bytes if unknown)        |#
+#+------------------------------------------------------------------------------------+#
+class ObjectFile:
+    def __init__(self, text, data, symbols, relocations, digest=bytes(32)):
+        self.text = text
+        self.data = data
+        self.symbols = symbols
+        self.relocations = relocations
+        self.digest = digest
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: exports() / imports()                                                |#
+    #| Description: Names of the exported symbols / of the symbols used by the        |#
+    #|    relocations that the module does not define                                 |#
+    #+--------------------------------------------------------------------------------+#
+    def exports(self):
+        return [name for name, (_, _, exported) in self.symbols.items() if exported]
+
+    def imports(self):
+        return sorted({name for _, _, name in self.relocations if name not in self.symbols})
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: pack()                                                               |#
+    #| Description: Serializes the object                                             |#
+    #| Output:                                                                        |#
+    #|    bytes - the content of the object file                                      |#
+    #+--------------------------------------------------------------------------------+#
+    def pack(self):
+        words = array('I', self.text)
+        if sys.byteorder == 'big':
+            words.byteswap()
+        names = sorted({name for _, _, name in self.relocations})
+        name_index = {name: index for index, name in enumerate(names)}
+        symbols = json.dumps({'symbols': self.symbols, 'names': names}, separators=(',', ':')).encode()
+        relocations = b''.join(RELOCATION.pack(index, reloc_type, name_index[name])
+                               for index, reloc_type, name in self.relocations)
+        return b''.join((OBJECT_HEADER.pack(OBJECT_MAGIC, len(words), len(self.data), len(symbols),
+                                            len(self.relocations), self.digest),
+                         words.tobytes(), bytes(self.data), symbols, relocations))
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: unpack(bytes)                                                        |#
+    #| Description: Deserializes an object file                                       |#
+    #| Output:                                                                        |#
+    #|    ObjectFile - the object                                                     |#
+    #+--------------------------------------------------------------------------------+#
+    @classmethod
+    def unpack(cls, data):
+        if len(data) < OBJECT_HEADER.size:
+            raise ValueError("Object Error! Truncated object file!")
+        magic, n_words, n_bytes, n_symbols, n_relocations, digest = OBJECT_HEADER.unpack_from(data)
+        if magic != OBJECT_MAGIC:
+            raise ValueError("Object Error! Invalid object file!")
+        offset = OBJECT_HEADER.size
+        text = array('I')
+        text.frombytes(data[offset:offset + 4*n_words])
+        if sys.byteorder == 'big':
+            text.byteswap()
+        offset += 4*n_words
+        module_data = bytearray(data[offset:offset + n_bytes])
+        offset += n_bytes
+        tables = json.loads(data[offset:offset + n_symbols].decode())
+        offset += n_symbols
+        if len(data) != offset + n_relocations * RELOCATION.size:
+            raise ValueError("Object Error! Truncated object file!")
+        names = tables['names']
+        relocations = [(index, reloc_type, names[name]) for index, reloc_type, name in
+                       RELOCATION.iter_unpack(data[offset:])]
+        symbols = {name: tuple(symbol) for name, symbol in tables['symbols'].items()}
+        return cls(text, module_data, symbols, relocations, digest)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: write_object(ObjectFile, string) / read_object(string)                   |#
+#| Description: Write/read an object file                                             |#
+#+------------------------------------------------------------------------------------+#
+def write_object(obj, path):
+    with open(path, "wb") as object_file:
+        object_file.write(obj.pack())
+
+
+def read_object(path):
+    with open(path, "rb") as object_file:
+        return ObjectFile.unpack(object_file.read())
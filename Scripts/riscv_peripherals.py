@@ -0,0 +1,531 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Behavioral models of the MCU peripherals (clock prescaller, DCO, Timer  #
+#              and PWM) with the SFR layouts of RTL/Memory/pkg_sfrs_definition.sv.     #
+#              The models are event driven: the state of a peripheral is computed     #
+#              when the CPU accesses one of its SFRs (or when the simulator asks for   #
+#              the next event) instead of being ticked every system clock cycle.       #
+# Input: System clock cycle of every SFR access                                        #
+# Output: SFR read values, time of the next peripheral event                           #
+########################################################################################
+
+#Time is counted in system clock cycles since reset: the system clock rising edge n
+#happens at time n (n >= 1) and the state "at time t" is the state after the edge t
+
+MASK32 = 0xFFFFFFFF
+MASK16 = 0xFFFF
+
+#SFR base addresses (RTL/mcu_v2_pipeline.sv)
+CHIP_BASE_ADDR = 0xFFFFF800
+TMR0_BASE_ADDR = 0xFFFFF804
+TMR1_BASE_ADDR = 0xFFFFF814
+PWM0_BASE_ADDR = 0xFFFFF824
+PWM1_BASE_ADDR = 0xFFFFF834
+PWM2_BASE_ADDR = 0xFFFFF844
+DCO_BASE_ADDR  = 0xFFFFF854
+
+#CHIP_CTRL bits
+CHIP_LPM = 1 << 7
+
+#TMRx_CTRL bits (tmr_ctrl_t)
+TMR_ON       = 1 << 0
+TMR_RST      = 1 << 1
+TMR_LD       = 1 << 2
+TMR_RD       = 1 << 3
+TMR_STOP     = 1 << 6
+TMR_START    = 1 << 7
+TMR_MATCH0_F = 1 << 13
+TMR_MATCH1_F = 1 << 14
+TMR_OVF_F    = 1 << 15
+
+#PWMx_CTRL bits (pwm_ctrl_t)
+PWM_ON     = 1 << 0
+PWM_RST    = 1 << 1
+PWM_LD     = 1 << 2
+PWM_RD     = 1 << 3
+PWM_LD_TRG = 1 << 4
+PWM_PRM_F  = 1 << 28
+PWM_DCM_F  = 1 << 29
+PWM_PHM_F  = 1 << 30
+PWM_OFM_F  = 1 << 31
+
+#DCO_CTRL bits (dco_ctrl_t)
+DCO_ON = 1 << 0
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: SfrMasks                                                                    |#
+#| Description: Bit masks of an sfr_module_v1 instance                                |#
+#| Input:                                                                             |#
+#|    int - IMPLEMENTED_BITS_MASK                                                     |#
+#|    int - READABLE_BITS_MASK                                                        |#
+#|    int - SW_UPDATABLE_BITS_MASK                                                    |#
+#|    int - SW set only bits (the wrapper ORs them with the current value)            |#
+#+------------------------------------------------------------------------------------+#
+class SfrMasks:
+    def __init__(self, implemented, readable, sw_updatable, set_only=0):
+        self.implemented = implemented
+        self.readable = readable
+        self.sw_updatable = sw_updatable
+        self.set_only = set_only
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: write(int, int)                                                      |#
+    #| Description: Returns the value of the SFR after a software write               |#
+    #+--------------------------------------------------------------------------------+#
+    def write(self, old, value):
+        value |= old & self.set_only
+        return ((value & self.sw_updatable) | (old & ~self.sw_updatable)) & self.implemented
+
+
+#Register masks (RTL/Timer/tmr_32bit_v1.sv, RTL/PWM/pwm_16bit_v1.sv, RTL/DCO/dco_20bit_v1.sv)
+CHIP_CTRL_MASKS = SfrMasks(0x00000080, 0x00000080, 0x00000080)
+TMR_CTRL_MASKS  = SfrMasks(0x00E0E7CF, 0x00E0E701, 0x00E0E7CF, set_only=0x000000CE)
+TMR_WORD_MASKS  = SfrMasks(MASK32, MASK32, MASK32)
+PWM_CTRL_MASKS  = SfrMasks(0xFF0007DF, 0xFF0007C1, 0xFF0007DF, set_only=0x0000001E)
+PWM_TMR_MASKS   = SfrMasks(0x0000FFFF, 0x0000FFFF, 0x0000FFFF)
+PWM_CFG_MASKS   = SfrMasks(MASK32, MASK32, MASK32)
+DCO_CTRL_MASKS  = SfrMasks(0x00000701, 0x00000701, 0x00000701)
+DCO_CNT_MASKS   = SfrMasks(0x000FFFFF, 0x000FFFFF, 0x000FFFFF)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Clock                                                                       |#
+#| Description: Periodic clock with rising edges at times phase + k*period (k >= 0)   |#
+#+------------------------------------------------------------------------------------+#
+class Clock:
+    def __init__(self, period, phase):
+        self.period = period
+        self.phase = phase
+
+    #Number of rising edges in the time interval (start, end]
+    def edges(self, start, end):
+        if end < self.phase or end <= start:
+            return 0
+        last = (end - self.phase) // self.period
+        first = (start - self.phase) // self.period + 1 if start >= self.phase else 0
+        return last - first + 1
+
+    #Time of the n-th rising edge after start (n >= 1)
+    def edge_after(self, start, n=1):
+        if start < self.phase:
+            return self.phase + (n - 1) * self.period
+        return self.phase + ((start - self.phase) // self.period + n) * self.period
+
+
+SYS_CLOCK = Clock(1, 1)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: prescaller_clock(int)                                                    |#
+#| Description: Model of clk_prescaller_v1, a 4 bit counter incremented on every      |#
+#|    system clock, pclk_out[i] is bit i of the counter                               |#
+#| Input:                                                                             |#
+#|    int - the output index (0: sys_clk/2, 1: sys_clk/4, 2: sys_clk/8, 3: sys_clk/16)|#
+#| Output:                                                                            |#
+#|    Clock - the divided clock                                                       |#
+#+------------------------------------------------------------------------------------+#
+def prescaller_clock(index):
+    return Clock(2 << index, 1 << index)
+
+
+PRESCALLER_CLOCKS = [prescaller_clock(i) for i in range(4)]
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: select_clock(int, Dco)                                                   |#
+#| Description: Clock selector of the peripheral wrappers (clksrc field), the values  |#
+#|    that are not decoded select the system clock like the RTL default               |#
+#| Input:                                                                             |#
+#|    int - the clksrc field                                                          |#
+#|    Dco - the DCO wired to clksrc 5 (None for the peripherals without it)           |#
+#| Output:                                                                            |#
+#|    Clock - the selected clock (None if it is the DCO and the DCO is off)           |#
+#+------------------------------------------------------------------------------------+#
+def select_clock(clksrc, dco=None):
+    if 1 <= clksrc <= 4:
+        return PRESCALLER_CLOCKS[clksrc - 1]
+    if clksrc == 5 and dco is not None:
+        return dco.clock
+    return SYS_CLOCK
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: visited(int, int, int, int)                                              |#
+#| Description: Tests if a counter that moves from start by steps increments passes   |#
+#|    through target (start included)                                                 |#
+#+------------------------------------------------------------------------------------+#
+def visited(target, start, steps, mask):
+    return ((target - start) & mask) <= steps
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Peripheral                                                                  |#
+#| Description: Base class of the SFR mapped peripherals. A peripheral owns 'size'    |#
+#|    consecutive SFRs from base_addr and keeps its state at time 'now' (in the       |#
+#|    peripheral time base, see Mcu.peripheral_time)                                  |#
+#+------------------------------------------------------------------------------------+#
+class Peripheral:
+    masks = ()
+
+    def __init__(self, name, base_addr):
+        self.name = name
+        self.base_addr = base_addr
+        self.regs = [0] * len(self.masks)
+        self.now = 0
+
+    @property
+    def size(self):
+        return 4 * len(self.regs)
+
+    def advance(self, time):
+        self.now = max(self.now, time)
+
+    def read(self, offset, time):
+        self.advance(time)
+        return self.regs[offset] & self.masks[offset].readable
+
+    def write(self, offset, value, time):
+        self.advance(time)
+        self.regs[offset] = self.masks[offset].write(self.regs[offset], value)
+
+    #Time of the next change of a readable bit (None if nothing is going to happen)
+    def next_event(self):
+        return None
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Dco                                                                         |#
+#| Description: Model of dco_nbit_v1 (N=20) and of its wrapper dco_20bit_v1. The      |#
+#|    output toggles every dcnt+1 source clock edges. The counter and the output are  |#
+#|    restarted from 0 when the DCO is reconfigured                                   |#
+#+------------------------------------------------------------------------------------+#
+class Dco(Peripheral):
+    masks = (DCO_CTRL_MASKS, DCO_CNT_MASKS)
+    CTRL, CNT = range(2)
+
+    def __init__(self, name, base_addr):
+        super().__init__(name, base_addr)
+        self.clock = None
+
+    def write(self, offset, value, time):
+        super().write(offset, value, time)
+        ctrl, dcnt = self.regs
+        if not ctrl & DCO_ON:
+            self.clock = None
+            return
+        source = select_clock((ctrl >> 8) & 0x7)
+        #Rising output edges on the source edges (2j+1)*(dcnt+1)
+        self.clock = Clock(2 * (dcnt + 1) * source.period, source.edge_after(time, dcnt + 1))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Timer                                                                       |#
+#| Description: Model of timer_nbit_v1 (N=32) and of its wrapper tmr_32bit_v1         |#
+#|    - start/stop act on the next timer clock edge, rst/ld (sampled by the _dly      |#
+#|      flops) on the second one                                                      |#
+#|    - the match/overflow flags are set while the counter equals the match value (or |#
+#|      overflows), the hardware update has priority over a software clear            |#
+#|    - rd copies the counter in TMRx_VAL                                             |#
+#| Input:                                                                             |#
+#|    Dco - the DCO that drives clksrc 5                                              |#
+#+------------------------------------------------------------------------------------+#
+class Timer(Peripheral):
+    masks = (TMR_CTRL_MASKS, TMR_WORD_MASKS, TMR_WORD_MASKS, TMR_WORD_MASKS)
+    CTRL, VAL, MATCH_VAL0, MATCH_VAL1 = range(4)
+
+    def __init__(self, name, base_addr, dco=None):
+        super().__init__(name, base_addr)
+        self.dco = dco
+        self.value = 0
+        self.running = False
+        #Time of the timer clock edge that applies a pending rst/ld
+        self.pending_time = None
+
+    def clock(self):
+        ctrl = self.regs[self.CTRL]
+        if not ctrl & TMR_ON:
+            return None
+        return select_clock((ctrl >> 8) & 0x7, self.dco)
+
+    def update_flags(self, steps):
+        ctrl = self.regs[self.CTRL]
+        if not ctrl & TMR_ON:
+            return
+        if not self.running:
+            steps = 0
+        if visited(self.regs[self.MATCH_VAL0], self.value, steps, MASK32):
+            ctrl |= TMR_MATCH0_F
+        if visited(self.regs[self.MATCH_VAL1], self.value, steps, MASK32):
+            ctrl |= TMR_MATCH1_F
+        if self.running and visited(MASK32, self.value, steps, MASK32):
+            ctrl |= TMR_OVF_F
+        self.regs[self.CTRL] = ctrl
+
+    def count(self, time):
+        clock = self.clock()
+        steps = clock.edges(self.now, time) if clock and self.running else 0
+        self.update_flags(steps)
+        self.value = (self.value + steps) & MASK32
+        self.now = max(self.now, time)
+
+    def advance(self, time):
+        while self.pending_time is not None and self.pending_time <= time:
+            #Count up to the edge before the one that applies rst/ld
+            self.count(self.pending_time - 1)
+            ctrl = self.regs[self.CTRL]
+            if ctrl & TMR_RST:
+                self.value = 0
+            elif ctrl & TMR_LD:
+                self.value = self.regs[self.VAL]
+            self.regs[self.CTRL] = ctrl & ~(TMR_RST | TMR_LD)
+            self.now = self.pending_time
+            self.pending_time = None
+            self.update_flags(0)
+        self.count(time)
+
+    def write(self, offset, value, time):
+        super().write(offset, value, time)
+        ctrl = self.regs[self.CTRL]
+        if offset == self.CTRL:
+            #count_en_comb, stop has priority over start
+            if ctrl & TMR_STOP:
+                self.running = False
+            elif ctrl & TMR_START:
+                self.running = True
+            if ctrl & TMR_RD:
+                self.regs[self.VAL] = self.value
+            clock = self.clock()
+            if ctrl & (TMR_RST | TMR_LD) and clock and self.pending_time is None:
+                self.pending_time = clock.edge_after(time, 2)
+            #start/stop/rd are hardware cleared
+            ctrl &= ~(TMR_START | TMR_STOP | TMR_RD)
+            self.regs[self.CTRL] = ctrl
+        self.update_flags(0)
+
+    def next_event(self):
+        clock = self.clock()
+        if clock is None:
+            return None
+        events = []
+        if self.pending_time is not None:
+            events.append(self.pending_time)
+        if self.running:
+            ctrl = self.regs[self.CTRL]
+            targets = ((self.regs[self.MATCH_VAL0], TMR_MATCH0_F), (self.regs[self.MATCH_VAL1], TMR_MATCH1_F),
+                       (MASK32, TMR_OVF_F))
+            for target, flag in targets:
+                if not ctrl & flag:
+                    steps = (target - self.value) & MASK32
+                    events.append(clock.edge_after(self.now, steps) if steps else self.now)
+        return min(events) if events else None
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Pwm                                                                         |#
+#| Description: Model of pwm_nbit_v1 (N=16) and of its wrapper pwm_16bit_v1           |#
+#|    - the counter restarts from 0 on the edge after it equals the shadow period     |#
+#|    - the shadow pr/dc/ph/of registers are loaded from PWMx_CFG0/1 on a period      |#
+#|      match while ld_trg is set (then ld_trg is hardware cleared)                   |#
+#|    - rst/ld act on the second PWM clock edge after the write                       |#
+#|    - the prm/dcm/phm/ofm flags are set while the counter equals the shadow value   |#
+#|    - rd copies the counter in PWMx_TMR                                             |#
+#+------------------------------------------------------------------------------------+#
+class Pwm(Peripheral):
+    masks = (PWM_CTRL_MASKS, PWM_TMR_MASKS, PWM_CFG_MASKS, PWM_CFG_MASKS)
+    CTRL, TMR, CFG0, CFG1 = range(4)
+
+    def __init__(self, name, base_addr):
+        super().__init__(name, base_addr)
+        self.value = 0
+        #Shadow registers: period, duty cycle, phase, offset
+        self.shadow = (0, 0, 0, 0)
+        self.pending_time = None
+
+    def clock(self):
+        ctrl = self.regs[self.CTRL]
+        if not ctrl & PWM_ON:
+            return None
+        return select_clock((ctrl >> 8) & 0x7)
+
+    def update_flags(self, start, steps):
+        ctrl = self.regs[self.CTRL]
+        if not ctrl & PWM_ON:
+            return
+        for shadow, flag in zip(self.shadow, (PWM_PRM_F, PWM_DCM_F, PWM_PHM_F, PWM_OFM_F)):
+            if visited(shadow, start, steps, MASK16):
+                ctrl |= flag
+        self.regs[self.CTRL] = ctrl
+
+    #Period match edge: the counter restarts and the shadows are loaded if requested
+    def period_match(self):
+        ctrl = self.regs[self.CTRL]
+        if ctrl & PWM_LD_TRG:
+            cfg0, cfg1 = self.regs[self.CFG0], self.regs[self.CFG1]
+            self.shadow = (cfg0 & MASK16, cfg0 >> 16, cfg1 & MASK16, cfg1 >> 16)
+            self.regs[self.CTRL] = ctrl & ~PWM_LD_TRG
+        self.value = 0
+
+    def count(self, time):
+        clock = self.clock()
+        if clock is None:
+            self.now = max(self.now, time)
+            return
+        steps = clock.edges(self.now, time)
+        to_match = (self.shadow[0] - self.value) & MASK16
+        if steps <= to_match:
+            self.update_flags(self.value, steps)
+            self.value = (self.value + steps) & MASK16
+        else:
+            #Run up to the period match, the next edge restarts the counter (and may
+            #load new shadow values), then count the remaining whole periods
+            self.update_flags(self.value, to_match)
+            self.period_match()
+            steps -= to_match + 1
+            period = self.shadow[0]
+            self.update_flags(0, min(steps, period))
+            self.value = steps % (period + 1)
+        self.now = max(self.now, time)
+
+    def advance(self, time):
+        while self.pending_time is not None and self.pending_time <= time:
+            self.count(self.pending_time - 1)
+            ctrl = self.regs[self.CTRL]
+            if self.value == self.shadow[0]:
+                self.period_match()
+            elif ctrl & PWM_RST:
+                self.value = 0
+            elif ctrl & PWM_LD:
+                self.value = self.regs[self.TMR]
+            self.regs[self.CTRL] &= ~(PWM_RST | PWM_LD)
+            self.now = self.pending_time
+            self.pending_time = None
+            self.update_flags(self.value, 0)
+        self.count(time)
+
+    def write(self, offset, value, time):
+        super().write(offset, value, time)
+        if offset == self.CTRL:
+            ctrl = self.regs[self.CTRL]
+            if ctrl & PWM_RD:
+                self.regs[self.TMR] = self.value
+            clock = self.clock()
+            if ctrl & (PWM_RST | PWM_LD) and clock and self.pending_time is None:
+                self.pending_time = clock.edge_after(time, 2)
+            self.regs[self.CTRL] = ctrl & ~PWM_RD
+        self.update_flags(self.value, 0)
+
+    def next_event(self):
+        clock = self.clock()
+        if clock is None:
+            return None
+        events = []
+        if self.pending_time is not None:
+            events.append(self.pending_time)
+        period = self.shadow[0]
+        to_match = (period - self.value) & MASK16
+        if self.regs[self.CTRL] & PWM_LD_TRG:
+            #The shadows change on the edge after the period match
+            events.append(clock.edge_after(self.now, to_match + 1))
+        ctrl = self.regs[self.CTRL]
+        for shadow, flag in zip(self.shadow, (PWM_PRM_F, PWM_DCM_F, PWM_PHM_F, PWM_OFM_F)):
+            if ctrl & flag:
+                continue
+            steps = (shadow - self.value) & MASK16
+            if steps > to_match:
+                if shadow > period:
+                    continue
+                steps = to_match + 1 + shadow
+            events.append(clock.edge_after(self.now, steps) if steps else self.now)
+        return min(events) if events else None
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Mcu                                                                         |#
+#| Description: The SFR space of mcu_v2_pipeline: CHIP_CTRL and the peripherals. The  |#
+#|    low power mode (CHIP_CTRL.lpm) gates the clock of the prescaller and of the     |#
+#|    peripherals, the models run on a peripheral time base that does not advance     |#
+#|    while it is set                                                                 |#
+#+------------------------------------------------------------------------------------+#
+class Mcu:
+    def __init__(self):
+        self.chip_ctrl = 0
+        self.lpm_start = None
+        self.lpm_cycles = 0
+        self.dco = Dco('DCO', DCO_BASE_ADDR)
+        self.peripherals = [Timer('TMR0', TMR0_BASE_ADDR, self.dco), Timer('TMR1', TMR1_BASE_ADDR, self.dco),
+                            Pwm('PWM0', PWM0_BASE_ADDR), Pwm('PWM1', PWM1_BASE_ADDR), Pwm('PWM2', PWM2_BASE_ADDR),
+                            self.dco]
+        #SFR address -> (peripheral, register index)
+        self.sfr_map = {}
+        for peripheral in self.peripherals:
+            for offset in range(len(peripheral.regs)):
+                self.sfr_map[peripheral.base_addr + 4 * offset] = (peripheral, offset)
+
+    def __contains__(self, addr):
+        return addr == CHIP_BASE_ADDR or addr in self.sfr_map
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: peripheral_time(int) / system_time(int)                              |#
+    #| Description: Conversions between system clock cycles and peripheral clock      |#
+    #|    cycles (system cycles that were not spent in low power mode)                |#
+    #+--------------------------------------------------------------------------------+#
+    def peripheral_time(self, time):
+        if self.lpm_start is not None:
+            time = self.lpm_start
+        return time - self.lpm_cycles
+
+    def system_time(self, time):
+        return time + self.lpm_cycles
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: read(int, int) / write(int, int, int)                                |#
+    #| Description: SFR accesses of the CPU in the given system clock cycle. The SFR  |#
+    #|    flops sample the hardware updates one clock later, so a read sees the state |#
+    #|    of the previous cycle and a write reaches the peripheral on the next edge   |#
+    #+--------------------------------------------------------------------------------+#
+    def read(self, addr, time):
+        if addr == CHIP_BASE_ADDR:
+            return self.chip_ctrl & CHIP_CTRL_MASKS.readable
+        peripheral, offset = self.sfr_map[addr]
+        return peripheral.read(offset, self.peripheral_time(time - 1))
+
+    def write(self, addr, value, time):
+        if addr == CHIP_BASE_ADDR:
+            self.write_chip_ctrl(value, time)
+            return
+        peripheral, offset = self.sfr_map[addr]
+        if peripheral is self.dco:
+            #The timers that run on the DCO clock count with the old clock up to now
+            self.advance(time + 1)
+        peripheral.write(offset, value, self.peripheral_time(time + 1))
+
+    def write_chip_ctrl(self, value, time):
+        time += 1
+        self.advance(time)
+        self.chip_ctrl = CHIP_CTRL_MASKS.write(self.chip_ctrl, value)
+        if self.chip_ctrl & CHIP_LPM and self.lpm_start is None:
+            self.lpm_start = time
+        elif not self.chip_ctrl & CHIP_LPM and self.lpm_start is not None:
+            self.lpm_cycles += time - self.lpm_start
+            self.lpm_start = None
+
+    def advance(self, time):
+        time = self.peripheral_time(time)
+        for peripheral in self.peripherals:
+            peripheral.advance(time)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: next_event(int)                                                      |#
+    #| Description: Returns the first system clock cycle after 'time' in which a     |#
+    #|    read sees a change made by a peripheral (None if no event is scheduled)     |#
+    #+--------------------------------------------------------------------------------+#
+    def next_event(self, time):
+        if self.lpm_start is not None:
+            return None
+        self.advance(time - 1)
+        events = [event for event in (peripheral.next_event() for peripheral in self.peripherals)
+                  if event is not None]
+        if not events:
+            return None
+        return max(self.system_time(min(events)) + 1, time)
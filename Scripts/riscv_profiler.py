@@ -0,0 +1,175 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Instruction level profiler of the instruction set simulator. The per PC #
+#              counters of a run (Simulator.executed_counts() and, in 'timing' mode,   #
+#              the load use stall and flush cycles of the pipeline timing model) are   #
+#              aggregated per static basic block and per text label of the symbol      #
+#              table. The profile is printed as a hot-spot report and written as a     #
+#              folded stack file (one 'frame;frame;frame count' line per PC) for       #
+#              flamegraph.pl/speedscope.                                               #
+# Input: Simulator after a run with enable_profiling() (or in 'timing' mode)           #
+# Output: Hot-spot report and folded stack file                                        #
+########################################################################################
+
+from array import array
+
+#Frame of the PCs that come before the first label (the assembler prologue)
+NO_LABEL = '(prologue)'
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: block_leaders(list)                                                      |#
+#| Description: Returns the PFM word indexes that start a static basic block: the     |#
+#|    first word, the branch/jal targets and the words after a branch/jump            |#
+#| Input:                                                                             |#
+#|    list - the decoded PFM words (None for words that are not instructions)         |#
+#| Output:                                                                            |#
+#|    list - sorted word indexes                                                      |#
+#+------------------------------------------------------------------------------------+#
+def block_leaders(decoded):
+    leaders = {0} if decoded else set()
+    for i, ins in enumerate(decoded):
+        if ins is None or not (ins.type in ('B', 'J') or ins.mnemonic == 'jalr'):
+            continue
+        if i + 1 < len(decoded):
+            leaders.add(i + 1)
+        if ins.type in ('B', 'J'):
+            target = i + (ins.imm >> 2)
+            if 0 <= target < len(decoded):
+                leaders.add(target)
+    return sorted(leaders)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: Profile                                                                     |#
+#| Description: Execution profile of a simulator. cycles[i] is the number of cycles   |#
+#|    spent on PFM word i: one per execution plus, in 'timing' mode, the load use     |#
+#|    stalls charged to the instruction that waits in Decode and the flush cycles     |#
+#|    charged to the taken branch/jump (the attribution of cpu_hazard_unit.sv), the   |#
+#|    4 pipeline fill cycles are not charged to any PC                                |#
+#| Input:                                                                             |#
+#|    Simulator - the simulator after the profiled run                                |#
+#+------------------------------------------------------------------------------------+#
+class Profile:
+    def __init__(self, sim):
+        self.decoded = sim.decoded
+        self.source_map = sim.source_map
+        size = len(sim.decoded)
+        self.executed = array('Q', sim.executed_counts()[:size])
+        self.timed = sim.timing is not None
+        if self.timed:
+            self.load_use_stalls = array('Q', sim.timing.load_use_stalls[:size])
+            self.flush_cycles = array('Q', sim.timing.flush_cycles[:size])
+        else:
+            self.load_use_stalls = array('Q', bytes(8 * size))
+            self.flush_cycles = array('Q', bytes(8 * size))
+        self.cycles = array('Q', (e + s + f for e, s, f in
+                                  zip(self.executed, self.load_use_stalls, self.flush_cycles)))
+        leaders = block_leaders(self.decoded)
+        #Static basic blocks (first word, last word) and the block of every word
+        self.blocks = [(start, end - 1) for start, end in zip(leaders, leaders[1:] + [size])]
+        self.block_of = array('I', bytes(4 * size))
+        for number, (start, end) in enumerate(self.blocks):
+            for i in range(start, end + 1):
+                self.block_of[i] = number
+
+    @property
+    def instructions(self):
+        return sum(self.executed)
+
+    @property
+    def total_cycles(self):
+        return sum(self.cycles)
+
+    def mnemonic(self, i):
+        return self.decoded[i].mnemonic if self.decoded[i] else '?'
+
+    def label(self, i):
+        if self.source_map is None:
+            return NO_LABEL
+        position = self.source_map.labels[i] if i < len(self.source_map.labels) else 0
+        return self.source_map.label_names[position - 1] if position else NO_LABEL
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: hot_pcs()                                                            |#
+    #| Description: Returns the executed PCs, the most expensive first                |#
+    #| Output:                                                                        |#
+    #|    list - (pc, mnemonic, executed, cycles, load use stalls, flush cycles)      |#
+    #+--------------------------------------------------------------------------------+#
+    def hot_pcs(self):
+        rows = [(4 * i, self.mnemonic(i), self.executed[i], self.cycles[i],
+                 self.load_use_stalls[i], self.flush_cycles[i])
+                for i in range(len(self.executed)) if self.executed[i]]
+        rows.sort(key=lambda row: (-row[3], row[0]))
+        return rows
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: hot_blocks()                                                         |#
+    #| Description: Returns the executed basic blocks, the most expensive first       |#
+    #| Output:                                                                        |#
+    #|    list - (first pc, last pc, label, entries, cycles, stalls + flush cycles)   |#
+    #+--------------------------------------------------------------------------------+#
+    def hot_blocks(self):
+        rows = []
+        for start, end in self.blocks:
+            cycles = sum(self.cycles[start:end + 1])
+            if cycles:
+                lost = sum(self.load_use_stalls[start:end + 1]) + sum(self.flush_cycles[start:end + 1])
+                rows.append((4 * start, 4 * end, self.label(start), self.executed[start], cycles, lost))
+        rows.sort(key=lambda row: (-row[4], row[0]))
+        return rows
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: hot_labels()                                                         |#
+    #| Description: Returns the cycles of every text label (from the label to the    |#
+    #|    next one), the most expensive first                                         |#
+    #| Output:                                                                        |#
+    #|    list - (label, instructions, cycles, stalls + flush cycles)                 |#
+    #+--------------------------------------------------------------------------------+#
+    def hot_labels(self):
+        totals = {}
+        for i, cycles in enumerate(self.cycles):
+            if cycles:
+                total = totals.setdefault(self.label(i), [0, 0, 0])
+                total[0] += self.executed[i]
+                total[1] += cycles
+                total[2] += self.load_use_stalls[i] + self.flush_cycles[i]
+        rows = [(label, *total) for label, total in totals.items()]
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        return rows
+
+    def report(self, top=20):
+        total = self.total_cycles or 1
+        model = "pipeline timing model" if self.timed else "1 cycle per instruction"
+        lines = [f"profile: {self.instructions} instructions, {self.total_cycles} cycles ({model})",
+                 "Labels", "label                     instructions       cycles   stall+flush       %"]
+        for label, instructions, cycles, lost in self.hot_labels()[:top]:
+            lines.append(f"{label:24s} {instructions:13d} {cycles:12d} {lost:13d} {100 * cycles / total:6.2f}%")
+        lines += ["Basic blocks", "block                  label               entries       cycles   stall+flush       %"]
+        for start, end, label, entries, cycles, lost in self.hot_blocks()[:top]:
+            lines.append(f"0x{start:08x}-0x{end:08x}  {label:16s} {entries:10d} {cycles:12d} {lost:13d} "
+                         f"{100 * cycles / total:6.2f}%")
+        lines += ["PCs", "PC          instr  source             executed       cycles   load-use      flush       %"]
+        for pc, mnemonic, executed, cycles, stalls, flushes in self.hot_pcs()[:top]:
+            location = self.source_map.location(pc) if self.source_map else ''
+            lines.append(f"0x{pc:08x}  {mnemonic:6s} {location:16s} {executed:10d} {cycles:12d} {stalls:10d} "
+                         f"{flushes:10d} {100 * cycles / total:6.2f}%")
+        return '\n'.join(lines)
+
+    #+--------------------------------------------------------------------------------+#
+    #| Function: folded_stacks()                                                      |#
+    #| Description: Returns the folded stack lines of the profile, the stack of a PC  |#
+    #|    is program;label;basic block;pc_mnemonic and its count the cycles of the PC |#
+    #+--------------------------------------------------------------------------------+#
+    def folded_stacks(self):
+        program = self.source_map.source if self.source_map else 'program'
+        lines = []
+        for i, cycles in enumerate(self.cycles):
+            if cycles:
+                block = 4 * self.blocks[self.block_of[i]][0]
+                lines.append(f"{program};{self.label(i)};0x{block:08x};0x{4 * i:08x}_{self.mnemonic(i)} {cycles}")
+        return lines
+
+    def write_folded(self, path):
+        with open(path, "w") as folded_file:
+            folded_file.write(''.join(line + '\n' for line in self.folded_stacks()))
@@ -0,0 +1,237 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Constrained-random program generator for the MCU regression. Every     #
+#              seed gives one legal program of the RV32I subset of the assembler: a    #
+#              data section of random words (always in the gp range), straight-line    #
+#              code, forward branches/jumps, counted loops and leaf subroutines, so    #
+#              every program ends on the halt loop. The program is assembled and run   #
+#              on the ISS, the final data memory is the dfm_gold.bin of the test. The  #
+#              run is checked against the other ISS modes and the -O image before the  #
+#              prog_NNNN directory (same layout as MCU_v2_Pipeline_Tests) is written.  #
+#              The seeds are spread over a pool of worker processes, the output only   #
+#              depends on the seed.                                                    #
+# Input: Seeds                                                                         #
+# Output: prog_NNNN directories (.asm, pfm/dfm .bin/.hex, dfm_gold.bin)                #
+########################################################################################
+
+import argparse
+import concurrent.futures
+import functools
+import os
+import random
+import sys
+
+import riscv_assembler
+import riscv_iss
+
+#Registers written by the random instructions. ra (return address), gp (data pointer)
+#and s11 (loop counter) are reserved for the program structure
+WRITABLE_REGISTERS = ['sp', 'tp', 't0', 't1', 't2', 's0', 's1', 'a0', 'a1', 'a2', 'a3', 'a4', 'a5', 'a6',
+                      'a7', 's2', 's3', 's4', 's5', 's6', 's7', 's8', 's9', 's10', 't3', 't4', 't5', 't6']
+READABLE_REGISTERS = WRITABLE_REGISTERS + ['zero', 'gp']
+LOOP_COUNTER = 's11'
+
+R_MNEMONICS     = [m for m in riscv_assembler.opc if m.islower() and riscv_assembler.instrcution_type[m] == 'R']
+SHIFT_MNEMONICS = ['slli', 'srli', 'srai']
+IMM_MNEMONICS   = ['addi', 'slti', 'sltiu', 'xori', 'ori', 'andi']
+
+#Program shape
+DATA_WORDS = 32
+SEGMENTS = 24
+MAX_SEGMENT_INSTRUCTIONS = 8
+MAX_LOOP_COUNT = 8
+FUNCTIONS = 3
+
+#Limit of the reference run, far above the longest generated program
+MAX_INSTRUCTIONS = 200000
+
+#Differential runs of the reference program (ISS mode, peephole optimized image)
+CHECK_RUNS = (('block', False), ('timing', False), ('block', True))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: random_instruction(Random)                                               |#
+#| Description: Returns one random instruction without control flow: R-Type, I-Type,  |#
+#|    lui, lw/sw of a data word or a pseudo-instruction (li, mv, not, neg, nop). No   |#
+#|    auipc: its result depends on the code layout, which -O changes                  |#
+#+------------------------------------------------------------------------------------+#
+def random_instruction(rng):
+    rd = rng.choice(WRITABLE_REGISTERS)
+    rs1, rs2 = rng.choice(READABLE_REGISTERS), rng.choice(READABLE_REGISTERS)
+    kind = rng.randrange(10)
+    if kind < 3:
+        return f"{rng.choice(R_MNEMONICS):5s} {rd}, {rs1}, {rs2}"
+    if kind < 5:
+        return f"{rng.choice(IMM_MNEMONICS):5s} {rd}, {rs1}, {rng.randint(-2048, 2047)}"
+    if kind == 5:
+        return f"{rng.choice(SHIFT_MNEMONICS):5s} {rd}, {rs1}, {rng.randint(0, 31)}"
+    if kind == 6:
+        return f"lui   {rd}, {hex(rng.getrandbits(20) << 12)}"
+    if kind == 7:
+        return f"lw    {rd}, d{rng.randrange(DATA_WORDS)}(gp)"
+    if kind == 8:
+        return f"sw    {rs2}, d{rng.randrange(DATA_WORDS)}(gp)"
+    pseudo = rng.randrange(5)
+    if pseudo == 0:
+        return f"li    {rd}, {hex(rng.getrandbits(32))}"
+    if pseudo == 4:
+        return "nop"
+    return f"{['', 'mv', 'not', 'neg'][pseudo]:5s} {rd}, {rs1}"
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: generate_program(int)                                                    |#
+#| Description: Generates the assembly source of a seed. The text is a list of        |#
+#|    segments (seg_N labels), a segment is straight-line code that ends with nothing,|#
+#|    a forward branch/jump to a later segment, a call of a leaf subroutine or a loop |#
+#|    counted down in s11. Only the segment labels are branch targets, so a loop is   |#
+#|    always entered through its counter initialization. The registers are stored in  |#
+#|    the data memory before the halt loop                                            |#
+#| Input:                                                                             |#
+#|    int - the seed                                                                  |#
+#| Output:                                                                            |#
+#|    string - the content of the assembly file                                       |#
+#+------------------------------------------------------------------------------------+#
+def generate_program(seed):
+    rng = random.Random(seed)
+    body = lambda count: [f"   {random_instruction(rng)}" for _ in range(count)]
+
+    lines = ["//######################################## Header ########################################",
+             f"//# Description: Constrained-random program (seed {seed})".ljust(89) + "#",
+             "//########################################################################################",
+             "", ".section .data"]
+    lines += [f"d{i}: .word {hex(rng.getrandbits(32))}" for i in range(DATA_WORDS)]
+    lines += [f"r_{reg}: .word 0" for reg in WRITABLE_REGISTERS]
+
+    lines += ["", ".section .text"]
+    for segment in range(SEGMENTS):
+        lines.append(f"seg_{segment}:")
+        lines += body(rng.randint(0, MAX_SEGMENT_INSTRUCTIONS))
+        following = rng.randint(segment + 1, SEGMENTS)
+        target = f"seg_{following}" if following < SEGMENTS else "done"
+        ending = rng.randrange(5)
+        if ending == 1:
+            rs1, rs2 = rng.choice(READABLE_REGISTERS), rng.choice(READABLE_REGISTERS)
+            lines.append(f"   {rng.choice(['beq', 'bne']):5s} {rs1}, {rs2}, {target}")
+        elif ending == 2:
+            mnemonic = rng.choice(['beqz', 'bnez', 'j'])
+            operands = target if mnemonic == 'j' else f"{rng.choice(READABLE_REGISTERS)}, {target}"
+            lines.append(f"   {mnemonic:5s} {operands}")
+        elif ending == 3:
+            lines.append(f"   call  func_{rng.randrange(FUNCTIONS)}")
+        elif ending == 4:
+            lines.append(f"   addi  {LOOP_COUNTER}, zero, {rng.randint(1, MAX_LOOP_COUNT)}")
+            lines.append(f"loop_{segment}:")
+            lines += body(rng.randint(1, MAX_SEGMENT_INSTRUCTIONS))
+            lines.append(f"   addi  {LOOP_COUNTER}, {LOOP_COUNTER}, -1")
+            lines.append(f"   bne   {LOOP_COUNTER}, zero, loop_{segment}")
+
+    lines.append("done:")
+    lines += [f"   sw    {reg}, r_{reg}(gp)" for reg in WRITABLE_REGISTERS]
+    lines += ["halt:", "   jal   zero, halt"]
+    for function in range(FUNCTIONS):
+        lines.append(f"func_{function}:")
+        lines += body(rng.randint(1, MAX_SEGMENT_INSTRUCTIONS))
+        lines.append("   ret")
+    lines += ["", ".section .end"]
+    return '\n'.join(lines) + '\n'
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: reference_run(Image, string, bool)                                       |#
+#| Description: Runs an image on the ISS until the halt loop                          |#
+#| Output:                                                                            |#
+#|    Simulator - the simulator in its final state                                    |#
+#+------------------------------------------------------------------------------------+#
+def reference_run(image, mode='step'):
+    sim = riscv_iss.Simulator.from_image(image)
+    reason = sim.run(MAX_INSTRUCTIONS, mode=mode)
+    if reason != 'halt':
+        raise ValueError(f"Generator Error! The program did not reach the halt loop ({reason}) in '{mode}' mode!")
+    return sim
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: build_test(int, string)                                                  |#
+#| Description: Generates the program of a seed, computes its gold data memory in the |#
+#|    'step' mode of the ISS, checks it against the CHECK_RUNS and writes the         |#
+#|    prog_NNNN directory. This is the job executed by the worker processes           |#
+#| Input:                                                                             |#
+#|    int - the seed                                                                  |#
+#|    string - the output directory                                                   |#
+#| Output:                                                                            |#
+#|    tuple - (seed, error message or None, retired instructions of the program)      |#
+#+------------------------------------------------------------------------------------+#
+def build_test(seed, out_dir):
+    try:
+        source = generate_program(seed)
+        image = riscv_assembler.assemble(source)
+        gold = reference_run(image)
+        gold_lines = gold.dfm_result_lines()
+        for mode, optimize in CHECK_RUNS:
+            check = reference_run(riscv_assembler.assemble(source, optimize) if optimize else image, mode)
+            #The return address (ra) of a -O image depends on its layout, only its data memory is compared
+            if check.dfm_result_lines() != gold_lines or (not optimize and check.x != gold.x):
+                return seed, f"'{mode}' mode{' -O' if optimize else ''} differs from the 'step' mode", gold.instret
+
+        test_dir = os.path.join(out_dir, f"prog_{seed:04d}")
+        os.makedirs(test_dir, exist_ok=True)
+        with open(os.path.join(test_dir, f"test_prog_{seed:04d}.asm"), "w") as asm_file:
+            asm_file.write(source)
+        riscv_assembler.write_image(image, test_dir)
+        gold.write_dfm_result(os.path.join(test_dir, "dfm_gold.bin"))
+    except Exception as err:
+        return seed, f"{type(err).__name__}: {err}", 0
+    return seed, None, gold.instret
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: build_tests(iterable, string, int)                                       |#
+#| Description: Builds the tests of a list of seeds on a pool of worker processes     |#
+#| Input:                                                                             |#
+#|    iterable - the seeds                                                            |#
+#|    string - the output directory                                                   |#
+#|    int - number of worker processes (os.cpu_count() if None, 1 runs in-process)    |#
+#| Output:                                                                            |#
+#|    list - (seed, error message or None, retired instructions) in the seed order    |#
+#+------------------------------------------------------------------------------------+#
+def build_tests(seeds, out_dir, jobs=None):
+    seeds = list(seeds)
+    job = functools.partial(build_test, out_dir=out_dir)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(seeds) <= 1:
+        return [job(seed) for seed in seeds]
+
+    chunksize = max(1, len(seeds) // (jobs * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(job, seeds, chunksize=chunksize))
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: main(list)                                                               |#
+#| Description: This is the main function (command line entry point)                  |#
+#| Input:                                                                             |#
+#|    list - the command line arguments (sys.argv[1:] if None)                        |#
+#| Output:                                                                            |#
+#|    int - the exit code (1 if a seed failed)                                        |#
+#+------------------------------------------------------------------------------------+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate constrained-random test programs with their dfm_gold.bin")
+    parser.add_argument("-n", "--count", type=int, default=100, help="number of programs (default: %(default)s)")
+    parser.add_argument("-s", "--first-seed", type=int, default=0, help="seed of the first program (default: 0)")
+    parser.add_argument("-o", "--output-dir", default=".", help="directory of the prog_NNNN directories")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    results = build_tests(range(args.first_seed, args.first_seed + args.count), args.output_dir, args.jobs)
+    failed = [(seed, error) for seed, error, _ in results if error is not None]
+    for seed, error in failed:
+        print(f"FAIL  seed {seed}: {error}")
+    instructions = sum(retired for _, _, retired in results)
+    print(f"{len(results)} program(s) generated, {len(results) - len(failed)} passed, {len(failed)} failed "
+          f"({instructions} instructions in the reference runs)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
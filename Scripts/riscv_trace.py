@@ -0,0 +1,273 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Binary execution traces of retired instructions. Every record has a     #
+#              fixed width (PC, instruction word, rd, flags, rd write data, memory     #
+#              address and data) and the records are written in compressed chunks     #
+#              (zlib, lzma or stored), so a trace of millions of instructions stays    #
+#              small. The comparator streams two traces chunk by chunk (bounded        #
+#              memory) and reports the first record that differs. A file without the  #
+#              trace header is read as plain records, which is what a testbench writes #
+#              with $fwrite.                                                           #
+# Input: Trace records (riscv_iss.py --trace) or trace files (ISS and RTL side)        #
+# Output: Trace files, first divergence report                                         #
+########################################################################################
+
+import argparse
+import lzma
+import struct
+import sys
+import zlib
+from array import array
+
+import riscv_debug_map
+
+#Trace file layout (Little Endian):
+#   header: magic(4s) | version(B) | codec(B) | record size(H) | records per chunk(I)
+#   chunks: compressed size(I) | record count(I) | compressed records
+TRACE_MAGIC   = b'RVT1'
+TRACE_VERSION = 1
+TRACE_HEADER  = struct.Struct('<4sBBHI')
+CHUNK_HEADER  = struct.Struct('<II')
+
+#Record: pc(I) | instruction(I) | rd(B) | flags(B) | reserved(H) | rd data(I) |
+#        memory address(I) | memory data(I)
+#The writer builds it as 6 words (rd | flags << 8 is the third word)
+RECORD = struct.Struct('<IIBBHIII')
+RECORD_SIZE = RECORD.size
+RECORD_WORDS = RECORD_SIZE // 4
+
+#Record flags
+TRACE_RD_WRITE = 0x1    #rd (not x0) is written with the rd data
+TRACE_LOAD     = 0x2    #lw, the memory data is the loaded word
+TRACE_STORE    = 0x4    #sw, the memory data is the stored word
+
+#Codecs: name -> (id, compress, decompress)
+CODECS = {
+    'none' : (0, bytes, bytes),
+    'zlib' : (1, lambda data: zlib.compress(data, 1), zlib.decompress),
+    'lzma' : (2, lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+CODEC_NAMES = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+#Records per chunk (1.5MB of records), the memory used by a reader is about one chunk
+CHUNK_RECORDS = 65536
+
+#Records read at once from a file without header
+PLAIN_READ_RECORDS = 65536
+
+RECORD_FIELDS = ('pc', 'instr', 'rd', 'flags', 'reserved', 'wdata', 'addr', 'data')
+
+
+#+------------------------------------------------------------------------------------+#
+#| Class: TraceWriter                                                                 |#
+#| Description: Writes the records of a trace into a chunked file. The records are    |#
+#|    appended as 6 words to the words array (add(), or words.extend() and a flush()  |#
+#|    once chunk_words are buffered), a full chunk is compressed and written          |#
+#| Input:                                                                             |#
+#|    string - path of the trace file                                                 |#
+#|    string - codec name ('zlib', 'lzma' or 'none')                                  |#
+#|    int - records per chunk                                                         |#
+#+------------------------------------------------------------------------------------+#
+class TraceWriter:
+    def __init__(self, path, codec='zlib', chunk_records=CHUNK_RECORDS):
+        if codec not in CODECS:
+            raise ValueError(f"Trace Error! Unknown trace codec '{codec}'!")
+        codec_id, self.compress, _ = CODECS[codec]
+        self.file = open(path, "wb")
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, codec_id, RECORD_SIZE, chunk_records))
+        self.words = array('I')
+        self.chunk_words = chunk_records * RECORD_WORDS
+        self.records = 0
+
+    def add(self, pc, instr, rd, flags, wdata, addr, data):
+        self.words.extend((pc, instr, rd | (flags << 8), wdata, addr, data))
+        if len(self.words) >= self.chunk_words:
+            self.flush()
+
+    def flush(self):
+        if self.words:
+            if sys.byteorder == 'big':
+                self.words.byteswap()
+            count = len(self.words) // RECORD_WORDS
+            payload = self.compress(self.words.tobytes())
+            self.file.write(CHUNK_HEADER.pack(len(payload), count))
+            self.file.write(payload)
+            self.records += count
+            del self.words[:]
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: read_chunks(string)                                                      |#
+#| Description: Generator of the records of a trace file, one chunk at a time. A file |#
+#|    that does not start with the trace header is read as plain records              |#
+#| Input:                                                                             |#
+#|    string - path of the trace file                                                 |#
+#| Output:                                                                            |#
+#|    generator - bytes with a whole number of records                                |#
+#+------------------------------------------------------------------------------------+#
+def read_chunks(path):
+    with open(path, "rb") as trace_file:
+        header = trace_file.read(TRACE_HEADER.size)
+        if len(header) < TRACE_HEADER.size or header[:4] != TRACE_MAGIC:
+            data = header + trace_file.read(PLAIN_READ_RECORDS * RECORD_SIZE - len(header))
+            while data:
+                if len(data) % RECORD_SIZE:
+                    raise ValueError(f"Trace Error! '{path}' ends with a partial record!")
+                yield data
+                data = trace_file.read(PLAIN_READ_RECORDS * RECORD_SIZE)
+            return
+
+        _, version, codec_id, record_size, chunk_records = TRACE_HEADER.unpack(header)
+        if version != TRACE_VERSION or record_size != RECORD_SIZE or codec_id not in CODEC_NAMES:
+            raise ValueError(f"Trace Error! Unsupported trace format in '{path}'!")
+        decompress = CODECS[CODEC_NAMES[codec_id]][2]
+        while True:
+            chunk_header = trace_file.read(CHUNK_HEADER.size)
+            if not chunk_header:
+                return
+            if len(chunk_header) < CHUNK_HEADER.size:
+                raise ValueError(f"Trace Error! Truncated chunk in '{path}'!")
+            size, count = CHUNK_HEADER.unpack(chunk_header)
+            payload = trace_file.read(size)
+            if len(payload) < size or count > chunk_records:
+                raise ValueError(f"Trace Error! Truncated chunk in '{path}'!")
+            data = decompress(payload)
+            if len(data) != count * RECORD_SIZE:
+                raise ValueError(f"Trace Error! Corrupted chunk in '{path}'!")
+            yield data
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: read_records(string)                                                     |#
+#| Description: Generator of the unpacked records of a trace file                     |#
+#+------------------------------------------------------------------------------------+#
+def read_records(path):
+    for data in read_chunks(path):
+        yield from RECORD.iter_unpack(data)
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: compare_traces(string, string)                                           |#
+#| Description: Compares two traces record by record. The decompressed chunks of both |#
+#|    files are compared as bytes (the chunks of the two files do not need the same   |#
+#|    size), only the part that differs is unpacked                                   |#
+#| Input:                                                                             |#
+#|    string - path of the reference trace (ISS)                                      |#
+#|    string - path of the compared trace (RTL)                                       |#
+#| Output:                                                                            |#
+#|    tuple - (record index, reference record, compared record) of the first          |#
+#|            divergence (None for the trace that ended first), None if the traces    |#
+#|            are equal                                                               |#
+#+------------------------------------------------------------------------------------+#
+def compare_traces(ref_path, cmp_path):
+    ref_chunks, cmp_chunks = read_chunks(ref_path), read_chunks(cmp_path)
+    ref_data = cmp_data = b''
+    index = 0
+    while True:
+        if not ref_data:
+            ref_data = next(ref_chunks, None)
+        if not cmp_data:
+            cmp_data = next(cmp_chunks, None)
+        if ref_data is None or cmp_data is None:
+            if ref_data is None and cmp_data is None:
+                return None
+            return (index, ref_data and RECORD.unpack_from(ref_data), cmp_data and RECORD.unpack_from(cmp_data))
+
+        length = min(len(ref_data), len(cmp_data))
+        if ref_data[:length] != cmp_data[:length]:
+            for offset in range(0, length, RECORD_SIZE):
+                if ref_data[offset:offset + RECORD_SIZE] != cmp_data[offset:offset + RECORD_SIZE]:
+                    return (index + offset // RECORD_SIZE, RECORD.unpack_from(ref_data, offset),
+                            RECORD.unpack_from(cmp_data, offset))
+        index += length // RECORD_SIZE
+        ref_data, cmp_data = ref_data[length:], cmp_data[length:]
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: format_record(tuple, SourceMap)                                          |#
+#| Description: Formats a record as one line (with the label and source position of   |#
+#|    the PC if a source map is given)                                                |#
+#+------------------------------------------------------------------------------------+#
+def format_record(record, source_map=None):
+    pc, instr, rd, flags, _, wdata, addr, data = record
+    line = f"pc=0x{pc:08x} instr=0x{instr:08x}"
+    if flags & TRACE_RD_WRITE:
+        line += f" x{rd}=0x{wdata:08x}"
+    if flags & TRACE_LOAD:
+        line += f" load[0x{addr:08x}]=0x{data:08x}"
+    if flags & TRACE_STORE:
+        line += f" store[0x{addr:08x}]=0x{data:08x}"
+    if source_map is not None:
+        line += f" ({source_map.label(pc)} {source_map.location(pc)})"
+    return line
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: divergence_report(tuple, SourceMap)                                      |#
+#| Description: Returns the report lines of a divergence found by compare_traces      |#
+#+------------------------------------------------------------------------------------+#
+def divergence_report(divergence, source_map=None):
+    index, ref_record, cmp_record = divergence
+    lines = [f"First divergence at record {index}:"]
+    if ref_record is None or cmp_record is None:
+        lines[0] += f" the {'reference' if ref_record is None else 'compared'} trace ends"
+    else:
+        fields = [name for name, a, b in zip(RECORD_FIELDS, ref_record, cmp_record) if a != b]
+        lines[0] += f" {', '.join(fields)} differ"
+    lines.append(f"  reference: {format_record(ref_record, source_map) if ref_record else '(end of trace)'}")
+    lines.append(f"  compared:  {format_record(cmp_record, source_map) if cmp_record else '(end of trace)'}")
+    return lines
+
+
+#+------------------------------------------------------------------------------------+#
+#| Function: main(list)                                                               |#
+#| Description: This is the main function (command line entry point)                  |#
+#| Input:                                                                             |#
+#|    list - the command line arguments (sys.argv[1:] if None)                        |#
+#| Output:                                                                            |#
+#|    int - the exit code (1 if the traces differ)                                    |#
+#+------------------------------------------------------------------------------------+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare or print binary execution traces")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compare = commands.add_parser("compare", help="report the first record where two traces differ")
+    compare.add_argument("reference", help="reference trace (riscv_iss.py --trace)")
+    compare.add_argument("compared", help="compared trace (RTL simulation)")
+    dump = commands.add_parser("dump", help="print the records of a trace")
+    dump.add_argument("trace", help="trace file")
+    dump.add_argument("--start", type=int, default=0, help="index of the first printed record (default: 0)")
+    dump.add_argument("--count", type=int, default=100, help="number of printed records (default: %(default)s)")
+    for command in (compare, dump):
+        command.add_argument("--debug-map", help="debug map (.map.json) of the program, adds the source positions")
+    args = parser.parse_args(argv)
+    source_map = riscv_debug_map.SourceMap.from_file(args.debug_map) if args.debug_map else None
+
+    if args.command == "dump":
+        for index, record in enumerate(read_records(args.trace)):
+            if index >= args.start + args.count:
+                break
+            if index >= args.start:
+                print(f"{index:10d}  {format_record(record, source_map)}")
+        return 0
+
+    divergence = compare_traces(args.reference, args.compared)
+    if divergence is None:
+        print("Traces match")
+        return 0
+    print('\n'.join(divergence_report(divergence, source_map)))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,417 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Regression tests for the RV32I assembler (Scripts/riscv_assembler.py)   #
+########################################################################################
+
+import subprocess
+import sys
+from array import array
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+
+ASSEMBLER = REPO_ROOT / "Scripts" / "riscv_assembler.py"
+PROGRAM_DIRS = sorted((REPO_ROOT / "Verification" / "MCU_v2_Pipeline_Tests").glob("prog_*"))
+
+
+@pytest.mark.parametrize("prog_dir", PROGRAM_DIRS, ids=lambda p: p.name)
+def test_images_match_checked_in_files(prog_dir, tmp_path):
+    image = riscv_assembler.assemble_file(next(prog_dir.glob("*.asm")))
+    riscv_assembler.write_image(image, tmp_path)
+
+    for name in ("pfm.bin", "pfm.hex", "dfm.bin", "dfm.hex"):
+        assert (tmp_path / name).read_bytes() == (prog_dir / name).read_bytes(), name
+
+
+def test_assembler_object_is_reusable():
+    sources = [next(prog_dir.glob("*.asm")).read_text() for prog_dir in PROGRAM_DIRS]
+    asm = riscv_assembler.Assembler()
+    first = [asm.assemble(source) for source in sources]
+    second = [asm.assemble(source) for source in reversed(sources)][::-1]
+
+    for a, b in zip(first, second):
+        assert isinstance(a.pfm, array) and a.pfm.typecode == 'I'
+        assert isinstance(a.dfm, bytearray)
+        assert a.pfm == b.pfm and a.dfm == b.dfm and a.symbol_table == b.symbol_table
+
+
+def test_command_line(tmp_path):
+    prog_dir = PROGRAM_DIRS[-1]
+    subprocess.run([sys.executable, str(ASSEMBLER), str(next(prog_dir.glob("*.asm"))), "-o", str(tmp_path), "-q"],
+                   check=True, capture_output=True)
+
+    for name in ("pfm.bin", "pfm.hex", "dfm.bin", "dfm.hex"):
+        assert (tmp_path / name).read_bytes() == (prog_dir / name).read_bytes(), name
+
+
+def test_batch_mode(tmp_path):
+    for prog_dir in PROGRAM_DIRS:
+        (tmp_path / prog_dir.name).mkdir()
+        (tmp_path / prog_dir.name / "prog.asm").write_text(next(prog_dir.glob("*.asm")).read_text())
+    (tmp_path / "broken").mkdir()
+    (tmp_path / "broken" / "prog.asm").write_text(".section .text\n   bogus t0, t1, t2\n")
+
+    result = subprocess.run([sys.executable, str(ASSEMBLER), "-b", str(tmp_path / "*" / "*.asm"), "-j", "2"],
+                            capture_output=True, text=True)
+
+    assert result.returncode == 1
+    assert "FAIL" in result.stdout and "broken" in result.stdout
+    for prog_dir in PROGRAM_DIRS:
+        for name in ("pfm.hex", "dfm.hex"):
+            assert (tmp_path / prog_dir.name / name).read_bytes() == (prog_dir / name).read_bytes()
+
+    #The per-program outputs of the single file mode are rejected
+    for option in ("-l", "--debug-map", "--stream", "-c"):
+        result = subprocess.run([sys.executable, str(ASSEMBLER), "-b", str(tmp_path / "*" / "*.asm"), option],
+                                capture_output=True, text=True)
+        assert result.returncode == 2 and "cannot be combined with --batch" in result.stderr
+
+
+def test_batch_output_collisions(tmp_path):
+    source = next(PROGRAM_DIRS[0].glob("*.asm")).read_text()
+    for name in ("a.asm", "b.asm"):
+        (tmp_path / name).write_text(source)
+
+    #Two programs in one directory would overwrite each other's pfm/dfm files
+    with pytest.raises(ValueError, match="same directory"):
+        riscv_assembler.assemble_batch([str(tmp_path / "a.asm"), str(tmp_path / "b.asm")], jobs=1)
+    result = subprocess.run([sys.executable, str(ASSEMBLER), "-b", str(tmp_path / "*.asm")], capture_output=True, text=True)
+    assert result.returncode == 2 and "same directory" in result.stderr
+    assert not (tmp_path / "pfm.hex").exists()
+
+    #The same file given twice is assembled once
+    (tmp_path / "b.asm").unlink()
+    asm_paths = riscv_assembler.collect_batch_files([str(tmp_path / "*.asm")], extra_paths=[str(tmp_path / "a.asm")])
+    assert asm_paths == [str(tmp_path / "a.asm")]
+
+
+def test_batch_mode_sparse(tmp_path):
+    (tmp_path / "batch").mkdir()
+    (tmp_path / "single").mkdir()
+    asm_path = tmp_path / "batch" / "prog.asm"
+    asm_path.write_text(".section .data\na: .word 1\nb: .space 256\nc: .word 2\n.section .text\n   nop\n")
+
+    assert riscv_assembler.assemble_batch([str(asm_path)], jobs=1, formats=["memh"], sparse=True)[0][1] is None
+    riscv_assembler.write_image(riscv_assembler.assemble_file(asm_path), str(tmp_path / "single"), ["memh"], True)
+    for name in ("pfm.mem", "dfm.mem"):
+        assert (tmp_path / "batch" / name).read_bytes() == (tmp_path / "single" / name).read_bytes()
+    riscv_assembler.write_image(riscv_assembler.assemble_file(asm_path), str(tmp_path / "single"), ["memh"])
+    assert (tmp_path / "batch" / "dfm.mem").read_bytes() != (tmp_path / "single" / "dfm.mem").read_bytes()
+
+
+def test_build_cache(tmp_path, capsys):
+    asm_path = next(PROGRAM_DIRS[0].glob("*.asm"))
+    cache = riscv_assembler.open_build_cache(tmp_path / "cache")
+
+    built = riscv_assembler.assemble_file_cached(asm_path, cache)
+    cached = riscv_assembler.assemble_file_cached(asm_path, cache)
+
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+    assert cache.stats.bytes_saved == len(asm_path.read_bytes())
+    assert cached.pfm == built.pfm and cached.dfm == built.dfm and cached.symbol_table == built.symbol_table
+
+    #An -O cache hit says where the images come from instead of the optimizer report
+    argv = [str(asm_path), "-o", str(tmp_path), "-q", "-O", "--cache-dir", str(tmp_path / "cache")]
+    assert riscv_assembler.main(argv) == 0
+    assert "cycle(s) saved" in capsys.readouterr().out
+    assert riscv_assembler.main(argv) == 0
+    assert "taken from the build cache" in capsys.readouterr().out
+
+
+def test_build_cache_lru_eviction(tmp_path):
+    sources = [next(prog_dir.glob("*.asm")).read_text() for prog_dir in PROGRAM_DIRS]
+    cache = riscv_assembler.open_build_cache(tmp_path, max_bytes=1)
+
+    for source in sources:
+        image = riscv_assembler.assemble(source)
+        cache.store(source, image.pfm, image.dfm, image.symbol_table)
+
+    #Only the most recent entry is kept when the limit is smaller than one entry
+    assert cache.lookup(sources[0]) is None
+    assert cache.stats.evictions == len(sources) - 1
+
+
+@pytest.mark.parametrize("asm_path", [next(p.glob("*.asm")) for p in PROGRAM_DIRS] +
+                         sorted((REPO_ROOT / "Scripts").glob("*.asm")), ids=lambda p: p.name)
+def test_streaming_assembler_matches_two_pass(asm_path):
+    image = riscv_assembler.assemble_file(asm_path)
+    streamed = riscv_assembler.assemble_file_streaming(asm_path)
+
+    assert streamed.pfm == image.pfm and streamed.dfm == image.dfm and streamed.symbol_table == image.symbol_table
+
+
+def test_streaming_assembler_fixups():
+    source = """
+.section .text
+   beq   t0,   zero, forward
+   jal   ra,         far
+   lw    t1,         late(gp)
+forward:
+   addi  t0,   t0,   -1
+   bne   t0,   zero, forward
+far:
+   jal   zero,       forward
+.section .data
+late: .word 5
+"""
+    streamed = riscv_assembler.StreamingAssembler().assemble(source)
+    assert streamed.pfm == riscv_assembler.assemble(source).pfm
+
+    with pytest.raises(ValueError, match="Label 'nowhere' is not defined"):
+        riscv_assembler.StreamingAssembler().assemble(".section .text\n   jal zero, nowhere\n")
+
+
+def test_data_segment_directives():
+    source = """
+.section .data
+w:   .word 0x11223344, 5
+s:   .string "ab"
+b:   .byte 0xFF
+sp:  .space 3
+end: .word 0xAABBCCDD
+.section .text
+   lw    t0,         end(gp)
+"""
+    image = riscv_assembler.assemble(source)
+    assert image.dfm == bytes.fromhex("44332211" "05000000" "616200" "ff" "000000" "ddccbbaa")
+    #The last word is padded with 0's
+    assert list(image.dfm_words()) == [0x11223344, 5, 0xFF006261, 0xDD000000, 0x00AABBCC]
+    assert image.symbol_table['end'] == riscv_assembler.compute_signed_Nbit_ta(12, 0x10000800, 0x10000000 + 15)
+
+    with pytest.raises(ValueError, match="Data Segment is full"):
+        riscv_assembler.assemble(".section .data\nbig: .space 4096\n   .byte 1\n")
+
+
+@pytest.mark.parametrize("value, instructions", [
+    (5, ['addi a0, zero, 5']),
+    (-2048, ['addi a0, zero, -2048']),
+    (0x12345000, ['lui a0, 0x12345000']),
+    #bit 11 set: the upper part is increased by one and addi adds a negative value
+    (0x12345fff, ['lui a0, 0x12346000', 'addi a0, a0, -1']),
+    (0xFFFFFFFF, ['addi a0, zero, -1']),
+    (0x800, ['lui a0, 0x1000', 'addi a0, a0, -2048']),
+])
+def test_li_shortest_sequence(value, instructions):
+    assert riscv_assembler.expand_pseudo(f"li a0, {value}", {}) == instructions
+
+
+def test_pseudo_instructions():
+    import riscv_iss
+    source = """
+.section .text
+   li    a0,   0x12345fff
+   la    s0,   buf
+   la    s1,   far
+   mv    t0,   a0
+   not   t1,   a0
+   neg   t2,   a0
+   call  func
+   beqz  zero, done
+func:
+   addi  t3,   t3,   1
+   ret
+done:
+   j     done
+""" + "   nop\n" * 520 + """
+far:
+   nop
+.section .data
+buf: .word 7
+"""
+    image = riscv_assembler.assemble(source)
+    sim = riscv_iss.Simulator.from_image(image)
+    assert sim.run(1000) == 'halt'
+    reg = riscv_assembler.register_int
+    assert sim.x[reg['a0']] == sim.x[reg['t0']] == 0x12345fff
+    assert sim.x[reg['t1']] == 0xedcba000 and sim.x[reg['t2']] == 0xedcba001
+    assert sim.x[reg['s0']] == 0x10000000 and sim.x[reg['t3']] == 1
+    #la of a data variable is one gp relative addi, 'far' is placed after 0x800 so its
+    #la grows to lui + addi in the relaxation pass
+    assert sim.x[reg['s1']] == image.symbol_table['far'] > 0x800
+    assert len(image.pfm) == 2 + 2 + 1 + 2 + 8 + 520 + 1
+
+
+def test_branch_relaxation():
+    import riscv_iss
+    source = """
+.section .text
+   addi  t0,   zero, 2
+loop:
+   beqz  t0,   done
+   addi  t0,   t0,   -1
+   bne   t1,   zero, loop
+   bne   t0,   zero, skip
+""" + "   nop\n" * 1100 + """
+skip:
+   addi  t2,   t2,   1
+   bne   t0,   zero, loop
+   j     loop
+done:
+   j     done
+.section .end
+"""
+    image = riscv_assembler.assemble(source)
+    pfm = image.pfm
+    #beqz done, bne skip (forward) and bne loop (backward) are out of reach and become
+    #the inverted branch over a jal, bne t1 is in reach and stays one instruction
+    assert len(pfm) == 2 + 1 + 2 + 1 + 1 + 2 + 1100 + 1 + 2 + 1 + 1
+    assert [riscv_iss.decode(word).mnemonic for word in pfm[3:10]] == ['bne', 'jal', 'addi', 'bne', 'beq',
+                                                                       'jal', 'addi']
+    assert riscv_iss.decode(pfm[3]).imm == 8
+    sim = riscv_iss.Simulator.from_image(image)
+    assert sim.run(10000) == 'halt'
+    assert sim.pc == image.symbol_table['done'] and sim.x[riscv_assembler.register_int['t2']] == 2
+
+    #The streaming assembler relaxes the backward branches only
+    backward = ".section .text\nloop:\n" + "   nop\n" * 1100 + "   bne   t0,   zero, loop\n"
+    streamed = riscv_assembler.StreamingAssembler().assemble(backward)
+    assert streamed.pfm == riscv_assembler.assemble(backward).pfm and len(streamed.pfm) == 2 + 1100 + 2
+    with pytest.raises(ValueError, match="Label 'done' is out of range"):
+        riscv_assembler.StreamingAssembler().assemble(source)
+
+
+PEEPHOLE_PROGRAM = """
+.section .data
+a:   .word 7
+b:   .word 5
+res: .word 0
+sum: .word 0
+
+.section .text
+   lw    t0,         a(gp)
+   addi  t0,   t0,   0
+   sw    t0,         res(gp)
+   lw    t1,         res(gp)
+   addi  t2,   zero, 3
+   slli  t3,   t2,   4
+   addi  t3,   t3,   1
+   lw    t4,         b(gp)
+   add   t5,   t4,   t1
+   sw    t5,         sum(gp)
+halt:
+   jal   zero,       halt
+.section .end
+"""
+
+
+def run_program(image, mode='block', tmp_path=None, max_instructions=20000):
+    import riscv_iss
+    import riscv_trace
+    sim = riscv_iss.Simulator.from_image(image)
+    if tmp_path is None:
+        sim.run(max_instructions, mode=mode)
+        return sim, None
+    path = tmp_path / f"{id(image)}.rvt"
+    with riscv_trace.TraceWriter(str(path)) as writer:
+        sim.enable_trace(writer)
+        sim.run(max_instructions, mode=mode)
+    stores = [(record[6], record[7]) for record in riscv_trace.read_records(str(path))
+              if record[3] & riscv_trace.TRACE_STORE]
+    return sim, stores
+
+
+def test_peephole_optimizations():
+    image = riscv_assembler.assemble(PEEPHOLE_PROGRAM)
+    optimized = riscv_assembler.assemble(PEEPHOLE_PROGRAM, optimize=True)
+    stats = optimized.peephole
+    assert image.peephole is None
+    #addi t0, t0, 0 and the overwritten t3 = 48 are removed, lw t1 becomes a copy of t0,
+    #slli/addi t3 become constants, addi t2 and the t3 constant fill the lw slots
+    assert (stats.dead_moves, stats.forwarded_loads, stats.folded_constants) == (2, 1, 2)
+    assert stats.filled_load_slots == 2
+    assert (stats.instructions_before, stats.instructions_after) == (13, 11)
+    assert (stats.stalls_before, stats.stalls_after) == (2, 0) and stats.cycles_saved == 4
+    assert len(optimized.pfm) == 11 and optimized.symbol_table['halt'] == 40
+
+    sim, _ = run_program(image, 'timing')
+    optimized_sim, _ = run_program(optimized, 'timing')
+    assert sim.x == optimized_sim.x and sim.dfm == optimized_sim.dfm
+    assert sim.timing.cycles - optimized_sim.timing.cycles == stats.cycles_saved
+
+
+def test_peephole_keeps_numeric_branch_spans():
+    #beq skips 2 instructions by offset: the dead t1 write inside the span stays, the one
+    #after the target is removed
+    source = """
+.section .text
+   addi  t0,   zero, 0
+   beq   t0,   zero, 12
+   addi  t1,   zero, 1
+   addi  t1,   zero, 2
+   addi  t3,   zero, 9
+   addi  t4,   zero, 1
+   addi  t4,   zero, 2
+halt:
+   jal   zero,       halt
+.section .end
+"""
+    image = riscv_assembler.assemble(source)
+    optimized = riscv_assembler.assemble(source, optimize=True)
+    assert optimized.peephole.dead_moves == 1 and len(optimized.pfm) == len(image.pfm) - 1
+    sim, optimized_sim = run_program(image)[0], run_program(optimized)[0]
+    assert optimized_sim.x[riscv_assembler.register_int['t3']] == 9 and optimized_sim.x == sim.x
+
+    #A jump through a computed address depends on the whole layout
+    jump_table = source.replace("   beq   t0,   zero, 12", "   auipc t5,         0")
+    assert len(riscv_assembler.assemble(jump_table, optimize=True).pfm) == len(image.pfm)
+
+
+@pytest.mark.parametrize("asm_path", [next(p.glob("*.asm")) for p in PROGRAM_DIRS] +
+                         sorted((REPO_ROOT / "Scripts").glob("*.asm")), ids=lambda p: p.name)
+def test_peephole_is_equivalent(asm_path, tmp_path):
+    image = riscv_assembler.assemble_file(asm_path)
+    optimized = riscv_assembler.assemble_file(asm_path, optimize=True)
+    sim, stores = run_program(image, tmp_path=tmp_path)
+    optimized_sim, optimized_stores = run_program(optimized, tmp_path=tmp_path)
+
+    #Same memory writes, the programs that loop forever are compared up to the limit
+    assert stores and optimized_stores
+    assert stores[:len(optimized_stores)] == optimized_stores[:len(stores)]
+    if sim.stop_reason != 'limit':
+        assert optimized_sim.stop_reason == sim.stop_reason
+        assert optimized_sim.x == sim.x and optimized_sim.dfm == sim.dfm and stores == optimized_stores
+        timed, timed_optimized = run_program(image, 'timing')[0], run_program(optimized, 'timing')[0]
+        assert timed_optimized.timing.cycles <= timed.timing.cycles
+
+
+def test_tokenizer():
+    assert [tuple(token) for token in riscv_assembler.tokenize("loop: sw t0,-4(sp) # c", 7)] == \
+           [('label', 'loop', 7, 1), ('mnemonic', 'sw', 7, 7), ('operand', 't0', 7, 10),
+            ('operand', '-4', 7, 13), ('base', 'sp', 7, 16)]
+    assert [token.kind for token in riscv_assembler.tokenize("   .word 1, 0x2")] == ['directive', 'operand', 'operand']
+
+    #Label and instruction on the same line, operands without spaces, // comments
+    image = riscv_assembler.assemble(".section .text\nloop: addi t0,t0,1 // c\n   sw t0,0(t1)\n   j loop\n")
+    reference = riscv_assembler.assemble(".section .text\nloop:\n   addi t0, t0, 1\n   sw t0, 0(t1)\n   j loop\n")
+    assert image.pfm == reference.pfm and image.symbol_table == reference.symbol_table
+
+
+@pytest.mark.parametrize("source, location, message", [
+    ("   addi t0, t9, 1", "2:13", "Invalid register 't9'"),
+    ("   beq  t0, t1, nowhere", "2:17", "Label 'nowhere' is not defined"),
+    ("   lw   t0, y(gp)", "2:13", "Symbol 'y' is not defined"),
+    ("   addi t0, t1, 5000", "2:17", "Value 5000 cannot fit in 12 bits length"),
+    #The funct7 bits of the shifts are not part of the shift amount
+    ("   slli t0, t0, 40", "2:17", "Shift amount 40 is out of range"),
+    ("   srai t0, t0, -1", "2:17", "Shift amount -1 is out of range"),
+    ("   srli t0, t0, TMR0_CTRL", "2:17", "Shift amount 2052 is out of range"),
+    ("   add  t0, t1", "2:4", "'add' expects 3 operand"),
+    ("x: nop\nx: nop", "3:1", "Label 'x' is already defined"),
+    #The operand of the error, not the first token with the same text
+    ("L: addi t0, t0, t0", "2:17", "Symbol 't0' is not defined"),
+    ("   lw   t0, 0(t9)", "2:15", "Invalid register 't9'"),
+    ("   li   t0, zzz", "2:13", "Invalid number 'zzz'"),
+    (".section .data\nv: .word 1, 0xZZ", "3:13", "Invalid number '0xZZ'"),
+])
+def test_error_locations(source, location, message, tmp_path):
+    asm_path = tmp_path / "prog.asm"
+    asm_path.write_text(".section .text\n" + source + "\n")
+    with pytest.raises(ValueError, match=f"prog.asm:{location}: .*{message}"):
+        riscv_assembler.assemble_file(asm_path)
+    with pytest.raises(ValueError, match=f"^<source>:{location}: "):
+        riscv_assembler.assemble(".section .text\n" + source + "\n")
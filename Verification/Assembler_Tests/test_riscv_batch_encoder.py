@@ -0,0 +1,80 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the vectorized batch encoder (Scripts/riscv_batch_encoder.py) #
+########################################################################################
+
+import sys
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_batch_encoder as batch  # noqa: E402
+import riscv_image_formats  # noqa: E402
+
+
+#Assembly text of one instruction of the batch (operand order of the assembler)
+def instruction_text(mnemonic, rd, rs1, rs2, imm):
+    kind = riscv_assembler.instrcution_type[mnemonic]
+    if kind == 'R':
+        return f"{mnemonic} x{rd}, x{rs1}, x{rs2}"
+    if kind == 'I':
+        return f"{mnemonic} x{rd}, {imm}(x{rs1})" if mnemonic == 'lw' else f"{mnemonic} x{rd}, x{rs1}, {imm}"
+    if kind == 'S':
+        return f"{mnemonic} x{rs2}, {imm}(x{rs1})"
+    if kind == 'B':
+        return f"{mnemonic} x{rs2}, x{rs1}, {imm}"
+    return f"{mnemonic} x{rd}, {imm}"
+
+
+def random_batch(rng, count):
+    mnemonic = rng.integers(0, len(batch.MNEMONICS), count)
+    rd, rs1, rs2 = (rng.integers(0, 32, count) for _ in range(3))
+    kind = np.array(batch.TYPE)[mnemonic]
+    imm = rng.integers(-2048, 2048, count)
+    imm = np.where(kind == batch.TYPE_B, rng.integers(-2048, 2048, count) * 2, imm)
+    imm = np.where(kind == batch.TYPE_J, rng.integers(-(1 << 19), 1 << 19, count) * 2, imm)
+    imm = np.where(kind == batch.TYPE_U, rng.integers(0, 1 << 20, count) << 12, imm)
+    shift = np.isin(mnemonic, [batch.MNEMONIC_ID[m] for m in ('slli', 'srli', 'srai')])
+    imm = np.where(shift, rng.integers(0, 32, count), imm)
+    return mnemonic, rd, rs1, rs2, imm
+
+
+def test_batch_matches_translate_menmonic():
+    columns = random_batch(np.random.default_rng(1), 5000)
+    words = batch.encode_batch(*columns)
+    assert words.dtype == np.uint32
+
+    for index, (mnemonic, rd, rs1, rs2, imm) in enumerate(zip(*columns)):
+        text = instruction_text(batch.MNEMONICS[mnemonic], rd, rs1, rs2, imm)
+        assert int(words[index]) == riscv_assembler.translate_menmonic(text, 0, {}), text
+
+
+def test_batch_range_checks():
+    ids = batch.mnemonic_ids(['ADDI', 'beq', 'add'])
+    batch.encode_batch(ids, [1, 0, 2], [2, 3, 4], [0, 5, 6], [-2048, 4094, 99999])
+    with pytest.raises(ValueError, match="Instruction 0: 12 bit immediate 4096"):
+        batch.encode_batch(ids[:1], [1], [2], [0], [4096])
+    with pytest.raises(ValueError, match="Instruction 2: rs2 32"):
+        batch.encode_batch(ids, [1, 0, 2], [2, 3, 4], [0, 5, 32], [0, 0, 0])
+    #The shift amount would overwrite the funct7 bits of slli/srli/srai
+    with pytest.raises(ValueError, match="Instruction 0: shift amount 1056 is out of range"):
+        batch.encode_batch(batch.mnemonic_ids(['srli']), [5], [5], [0], [1056])
+    with pytest.raises(ValueError, match="Instruction 1: shift amount -1 is out of range"):
+        batch.encode_batch(batch.mnemonic_ids(['addi', 'slli']), [5, 5], [5, 5], [0, 0], [-1, -1])
+    with pytest.raises(ValueError, match="Unsupported"):
+        batch.mnemonic_ids(['mul'])
+
+
+def test_batch_memory_files_match_assembler(tmp_path):
+    words = batch.encode_batch(*random_batch(np.random.default_rng(2), 200))
+    batch.write_words(words, tmp_path / "batch.bin", tmp_path / "batch.hex")
+    riscv_image_formats.write_memory(str(tmp_path / "pfm"), 0, words.tolist())
+
+    assert (tmp_path / "batch.bin").read_bytes() == (tmp_path / "pfm.bin").read_bytes()
+    assert (tmp_path / "batch.hex").read_bytes() == (tmp_path / "pfm.hex").read_bytes()
@@ -0,0 +1,53 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the benchmark suite (Scripts/riscv_benchmark.py)              #
+########################################################################################
+
+import json
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_benchmark  # noqa: E402
+
+PROGRAM_DIR = REPO_ROOT / "Verification" / "MCU_v2_Pipeline_Tests" / "prog_01"
+
+
+def test_assembler_case(tmp_path):
+    asm_path = tmp_path / "bench.asm"
+    riscv_benchmark.write_synthetic_program(str(asm_path), 300, 40)
+    image = riscv_assembler.assemble_file(asm_path)
+    assert len(image.dfm) == 4 * 40 and len(image.pfm) >= 300 + 2
+
+    metrics = riscv_benchmark.run_assembler_case(str(asm_path), min_time=0)
+    assert metrics['instructions'] == len(image.pfm) and metrics['data_bytes'] == 160
+    assert min(metrics['parse_ips'], metrics['encode_ips'], metrics['write_ips']) > 0
+
+
+def test_compare_results():
+    baseline = {'assembler': {'1000': {'parse_ips': 1000.0, 'encode_ips': 1000.0, 'peak_rss_kb': 1000}},
+                'iss': {'prog_01': {'block_mips': 1.0}}}
+    current = {'assembler': {'1000': {'parse_ips': 950.0, 'encode_ips': 800.0, 'peak_rss_kb': 1200}},
+               'iss': {'prog_01': {'block_mips': 2.0}, 'prog_02': {'block_mips': 1.0}}}
+    rows = riscv_benchmark.compare_results(baseline, current, tolerance=0.1)
+    assert [(case, metric) for _, case, metric, *_, regression in rows if regression] == \
+           [('1000', 'encode_ips'), ('1000', 'peak_rss_kb')]
+    assert len(rows) == 4
+
+
+def test_main_baseline(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    args = ["--sizes", "200", "--programs", str(PROGRAM_DIR), "--min-time", "0", "--iss-max-instructions", "2000",
+            "--baseline", str(baseline)]
+    assert riscv_benchmark.main(args + ["--update-baseline", "-o", str(tmp_path / "results.json")]) == 0
+    results = json.loads(baseline.read_text())
+    assert set(results['assembler']) == {'200'} and results['iss']['prog_01']['instructions'] == 1054
+
+    #Ten times faster baseline, the run fails
+    for metrics in results['assembler'].values():
+        metrics['encode_ips'] *= 10
+    baseline.write_text(json.dumps(results))
+    assert riscv_benchmark.main(args + ["--tolerance", "0.5"]) == 1
@@ -0,0 +1,63 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the listing and debug map (Scripts/riscv_debug_map.py)        #
+########################################################################################
+
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_debug_map  # noqa: E402
+
+ASSEMBLER = REPO_ROOT / "Scripts" / "riscv_assembler.py"
+PROGRAM = next((REPO_ROOT / "Verification" / "MCU_v2_Pipeline_Tests" / "prog_03").glob("*.asm"))
+
+
+def test_line_map_points_at_the_source_lines():
+    source_lines = PROGRAM.read_text().splitlines()
+    for image in (riscv_assembler.assemble_file(PROGRAM), riscv_assembler.assemble_file_streaming(PROGRAM)):
+        assert len(image.line_map) == len(image.pfm)
+        #The gp initialization has no source line
+        assert list(image.line_map[:2]) == [0, 0]
+        for line in image.line_map[2:]:
+            mnemonic = source_lines[line - 1].split()[0]
+            assert mnemonic in riscv_assembler.instrcution_type
+
+
+def test_listing_and_debug_map_files(tmp_path):
+    subprocess.run([sys.executable, str(ASSEMBLER), str(PROGRAM), "-o", str(tmp_path), "-q", "-l", "--debug-map"],
+                   check=True, capture_output=True)
+    listing = (tmp_path / "test_prog_03.lst").read_text()
+    assert "0x0000005c  0x0000006f  test_prog_03.asm:53   jal   zero,       halt" in listing
+    assert "0x1000000c  data  check_cnt" in listing
+
+    source_map = riscv_debug_map.SourceMap.from_file(tmp_path / "test_prog_03.map.json")
+    image = riscv_assembler.assemble_file(PROGRAM)
+    assert source_map.lines == image.line_map
+    assert source_map.location(0x5c) == "test_prog_03.asm:53"
+    assert source_map.label(0x5c) == "halt"
+    assert source_map.label(0x34) == "start_loop+0x4"
+    assert source_map.location(0x4) == "test_prog_03.asm:?" and source_map.label(0x4) == ''
+
+
+def test_listing_of_reordered_code(tmp_path):
+    #Swap two instructions, the line map of the image goes 5, 7, 6
+    asm_path = tmp_path / "p.asm"
+    asm_path.write_text(".section .data\nv: .word 5\n.section .text\n\n   lw    t0,         v(gp)\n"
+                        "   add   t1,   t0,   t0\n   addi  t2,   zero, 3\nhalt:\n   jal   zero,       halt\n")
+    image = riscv_assembler.assemble_file(asm_path)
+    image.pfm[3], image.pfm[4] = image.pfm[4], image.pfm[3]
+    image.line_map[3], image.line_map[4] = image.line_map[4], image.line_map[3]
+    assert list(image.line_map[2:5]) == [5, 7, 6]
+
+    riscv_debug_map.write_listing(image, str(asm_path), str(tmp_path / "p.lst"))
+    source_lines = asm_path.read_text().splitlines()
+    entries = [line for line in (tmp_path / "p.lst").read_text().splitlines() if "p.asm:" in line]
+    assert len(entries) == 4
+    for entry in entries:
+        number = int(entry.split()[2].split(':')[1])
+        assert entry.endswith(source_lines[number - 1].strip())
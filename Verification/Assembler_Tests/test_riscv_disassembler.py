@@ -0,0 +1,86 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the PFM image disassembler (Scripts/riscv_disassembler.py)    #
+########################################################################################
+
+import random
+import struct
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_disassembler  # noqa: E402
+
+PROGRAM_DIRS = sorted((REPO_ROOT / "Verification" / "MCU_v2_Pipeline_Tests").glob("prog_*"))
+MNEMONICS = [m for m in riscv_assembler.opc if m.islower()]
+REGISTERS = list(riscv_assembler.register_map)
+SFRS = list(riscv_assembler.sfr_map)
+
+
+def random_program(rng, length):
+    labels = [f"label{i}" for i in range(rng.randint(1, 8))]
+    positions = {rng.randrange(length): label for label in labels}
+    labels = list(positions.values())
+    lines = [".section .text"]
+    for i in range(length):
+        if i in positions:
+            lines.append(f"{positions[i]}:")
+        mnemonic = rng.choice(MNEMONICS)
+        instr_type = riscv_assembler.instrcution_type[mnemonic]
+        rd, rs1, rs2 = (rng.choice(REGISTERS) for _ in range(3))
+        if instr_type == 'R':
+            lines.append(f"{mnemonic} {rd}, {rs1}, {rs2}")
+        elif mnemonic in ('lw', 'sw'):
+            lines.append(rng.choice([f"{mnemonic} {rd}, {rng.randint(-2048, 2047)}({rs1})",
+                                     f"{mnemonic} {rd}, {rng.choice(SFRS)}(zero)"]))
+        elif mnemonic in riscv_assembler.function7:
+            lines.append(f"{mnemonic} {rd}, {rs1}, {rng.randint(0, 31)}")
+        elif instr_type == 'I':
+            lines.append(f"{mnemonic} {rd}, {rs1}, {rng.randint(-2048, 2047)}")
+        elif instr_type == 'U':
+            lines.append(f"{mnemonic} {rd}, {hex(rng.getrandbits(20) << 12)}")
+        elif instr_type == 'B':
+            lines.append(f"{mnemonic} {rs1}, {rs2}, {rng.choice(labels + [str(2 * rng.randint(-2048, 2047))])}")
+        else:
+            lines.append(f"{mnemonic} {rd}, {rng.choice(labels)}")
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_round_trip_random_programs(seed):
+    rng = random.Random(seed)
+    image = riscv_assembler.assemble(random_program(rng, rng.randint(1, 300)))
+    source = '\n'.join(riscv_disassembler.disassemble_words(image.pfm)) + '\n'
+    #The assembler adds the gp initialization in front of the disassembled program again
+    assert riscv_assembler.assemble(source).pfm[2:] == image.pfm
+
+
+@pytest.mark.parametrize("prog_dir", PROGRAM_DIRS, ids=lambda p: p.name)
+def test_disassemble_image_files(prog_dir):
+    image = riscv_assembler.assemble_file(next(prog_dir.glob("*.asm")))
+    for name in ("pfm.hex", "pfm.bin"):
+        source = '\n'.join(riscv_disassembler.disassemble_file(prog_dir / name)) + '\n'
+        assert riscv_assembler.assemble(source).pfm[2:] == image.pfm
+    if prog_dir.name == "prog_01":
+        assert "lw    t1, TMR0_CTRL(zero)" in source and "beq   t2, zero, L_00000060" in source
+
+
+def test_full_memory_dump(tmp_path):
+    image = riscv_assembler.assemble_file(next(PROGRAM_DIRS[0].glob("*.asm")))
+    #Raw 64KB dump, the words after the program are 0
+    dump = tmp_path / "pfm.img"
+    dump.write_bytes(struct.pack(f'<{len(image.pfm)}I', *image.pfm) +
+                     bytes(4 * (riscv_disassembler.PFM_WORDS - len(image.pfm))))
+    lines = riscv_disassembler.disassemble_file(dump)
+    assert len([line for line in lines if '# 0x' in line]) == len(image.pfm)
+
+    lines = riscv_disassembler.disassemble_words([image.pfm[0], None, 0xFFFFFFFF])
+    assert lines[2].endswith("xxxxxxxx unknown word") and lines[3].endswith("0xffffffff not an instruction")
+    assert riscv_disassembler.main([str(PROGRAM_DIRS[0] / "pfm.hex"), "-o", str(tmp_path / "out.asm")]) == 0
+    #Text image with an unknown word that has x in its first digits
+    assert riscv_disassembler.words_from_buffer(b"x1" + b"0" * 30 + b"\n" + b"0" * 27 + b"10011\n") == [None, 0x13]
@@ -0,0 +1,83 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the memory image writers (Scripts/riscv_image_formats.py)     #
+########################################################################################
+
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_image_formats as formats  # noqa: E402
+
+ASSEMBLER = REPO_ROOT / "Scripts" / "riscv_assembler.py"
+PROGRAM = next((REPO_ROOT / "Verification" / "MCU_v2_Pipeline_Tests" / "prog_03").glob("*.asm"))
+
+
+#Reads an Intel HEX file back into a {address: byte} map
+def read_intel_hex(path):
+    memory = {}
+    upper = 0
+    for line in path.read_text().splitlines():
+        record = bytes.fromhex(line[1:])
+        assert sum(record) & 0xFF == 0
+        length, address, record_type, data = record[0], int.from_bytes(record[1:3], 'big'), record[3], record[4:-1]
+        assert len(data) == length
+        if record_type == 0x04:
+            upper = int.from_bytes(data, 'big') << 16
+        elif record_type == 0x00:
+            memory.update((upper + address + i, byte) for i, byte in enumerate(data))
+        else:
+            assert record_type == 0x01
+    return memory
+
+
+#Reads a $readmemh file back into a {word index: word} map
+def read_readmemh(path):
+    memory = {}
+    index = 0
+    for line in path.read_text().split():
+        if line.startswith('@'):
+            index = int(line[1:], 16)
+        else:
+            memory[index] = int(line, 16)
+            index += 1
+    return memory
+
+
+def test_all_formats_hold_the_image(tmp_path):
+    image = riscv_assembler.assemble_file(PROGRAM)
+    riscv_assembler.write_image(image, tmp_path, sorted(formats.FORMATS))
+    dfm = bytes(image.dfm) + bytes(-len(image.dfm) % 4)
+
+    assert (tmp_path / "pfm.bin").read_bytes() == (PROGRAM.parent / "pfm.bin").read_bytes()
+    assert (tmp_path / "dfm.hex").read_bytes() == (PROGRAM.parent / "dfm.hex").read_bytes()
+    assert (tmp_path / "pfm.img").read_bytes() == image.pfm.tobytes()
+    assert (tmp_path / "dfm.img").read_bytes() == dfm
+
+    ihex = read_intel_hex(tmp_path / "dfm.ihx")
+    assert ihex == {0x10000000 + i: byte for i, byte in enumerate(dfm)}
+    assert read_readmemh(tmp_path / "pfm.mem") == dict(enumerate(image.pfm))
+
+
+def test_sparse_images_use_address_records(tmp_path):
+    words = [1, 2] + [0] * 100 + [3] + [0] * 3 + [4] + [0] * 50
+    regions = formats.split_regions(words, sparse=True)
+    assert regions == [(0, [1, 2]), (102, [3, 0, 0, 0, 4])]
+
+    formats.write_memory(str(tmp_path / "pfm"), 0x0000FFF8, words, ('ihex', 'memh', 'img'), sparse=True)
+    assert read_readmemh(tmp_path / "pfm.mem") == {i: w for i, w in enumerate(words) if i < 107 and (w or i > 102)}
+    #The raw image has no addresses, it is always dense
+    assert (tmp_path / "pfm.img").stat().st_size == 4 * len(words)
+    #The records cross the 64KB boundary through an extended linear address record
+    ihex = read_intel_hex(tmp_path / "pfm.ihx")
+    assert ihex[0xFFF8] == 1 and ihex[0xFFF8 + 4 * 102] == 3 and len(ihex) == 4 * 7
+
+
+def test_command_line_format_selection(tmp_path):
+    subprocess.run([sys.executable, str(ASSEMBLER), str(PROGRAM), "-o", str(tmp_path), "-q",
+                    "--format", "memh", "--format", "ihex"], check=True, capture_output=True)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["dfm.ihx", "dfm.mem", "pfm.ihx", "pfm.mem"]
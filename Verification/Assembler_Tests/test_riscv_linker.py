@@ -0,0 +1,113 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the relocatable objects and the linker                        #
+#              (Scripts/riscv_object.py, Scripts/riscv_linker.py)                      #
+########################################################################################
+
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_iss  # noqa: E402
+import riscv_linker  # noqa: E402
+import riscv_object  # noqa: E402
+import riscv_program_generator  # noqa: E402
+
+PROGRAM_DIRS = sorted((REPO_ROOT / "Verification" / "MCU_v2_Pipeline_Tests").glob("prog_*"))
+
+MAIN = """
+.globl x
+.section .data
+x:      .word 5
+result: .space 4
+
+.section .text
+   call  add_k
+   sw    a0,         result(gp)
+   lw    t2,         k(gp)
+{extra}
+   beq   t2,   t2,   finish
+"""
+
+LIB = """
+.globl add_k, k, finish
+.section .data
+k:      .word 3
+
+.section .text
+add_k:
+   lw    a0,         x(gp)
+   lw    t0,         k(gp)
+   add   a0,   a0,   t0
+   ret
+finish:
+   sw    t1,         k(gp)
+halt:
+   j     halt
+"""
+
+
+def link_sources(*sources):
+    objects = [riscv_object.ObjectFile.unpack(riscv_assembler.assemble_object(source).pack()) for source in sources]
+    return riscv_linker.link(objects)
+
+
+@pytest.mark.parametrize("source", [next(p.glob("*.asm")).read_text() for p in PROGRAM_DIRS] +
+                                   [riscv_program_generator.generate_program(seed) for seed in range(5)])
+def test_single_module_matches_assembler(source):
+    image, linked = riscv_assembler.assemble(source), link_sources(source)
+    assert linked.pfm == image.pfm and linked.dfm == image.dfm
+
+
+def test_link_modules():
+    #Same layout as the concatenated source (the data of main is word aligned)
+    main = MAIN.format(extra="")
+    linked, image = link_sources(main, LIB), riscv_assembler.assemble(main + LIB)
+    assert linked.pfm == image.pfm and linked.dfm == image.dfm
+    assert linked.symbol_table == {name: image.symbol_table[name] for name in ("x", "add_k", "k", "finish")}
+
+    #la of a symbol of another module is a lui %hi/addi %lo pair
+    main = MAIN.format(extra="   la    t1,         add_k")
+    obj = riscv_assembler.assemble_object(main)
+    assert obj.imports() == ["add_k", "finish", "k"] and obj.exports() == ["x"]
+    assert [riscv_object.RELOCATION_NAMES[reloc_type] for _, reloc_type, _ in obj.relocations] == \
+           ["jump", "gprel", "gprel", "hi20", "lo12", "branch"]
+    linked = link_sources(main, LIB)
+    sim = riscv_iss.Simulator.from_image(linked)
+    assert sim.run(1000) == 'halt'
+    dfm = sim.dfm_result_lines()
+    assert int(dfm[1], 2) == 8 and int(dfm[2], 2) == linked.symbol_table["add_k"]
+
+
+def test_link_errors():
+    lib = riscv_assembler.assemble_object(LIB)
+    with pytest.raises(ValueError, match="Symbol 'x' used in module 1 is not defined"):
+        riscv_linker.link([riscv_assembler.assemble_object(".section .text\n   nop\n"), lib])
+    with pytest.raises(ValueError, match="Symbol 'k' is defined in"):
+        riscv_linker.link([riscv_assembler.assemble_object(MAIN.format(extra="")), lib, lib])
+    with pytest.raises(ValueError, match="^main.asm:2:8: Assemble Error! Exported symbol 'y' is not defined"):
+        riscv_assembler.assemble_object(".section .text\n.globl y\nstart:\n   nop\n", "main.asm")
+
+
+def test_incremental_build(tmp_path):
+    main, lib = tmp_path / "main.asm", tmp_path / "lib.asm"
+    main.write_text(MAIN.format(extra=""))
+    lib.write_text(LIB)
+    paths = [str(main), str(lib)]
+    assert riscv_linker.build_objects(paths, jobs=1)[1] == 2
+    assert riscv_linker.build_objects(paths, jobs=1)[1] == 0
+    lib.write_text(LIB.replace(".word 3", ".word 4"))
+    objects, assembled = riscv_linker.build_objects(paths, jobs=1)
+    assert assembled == 1 and objects[1].data == bytearray(b'\x04\0\0\0')
+
+    out = tmp_path / "out"
+    out.mkdir()
+    assert riscv_assembler.main([str(main), "-c", "-o", str(out)]) == 0
+    assert riscv_linker.main([str(out / "main.rvo"), str(lib), "-o", str(out), "-j", "1"]) == 0
+    assert (out / "pfm.hex").read_text() == "".join(riscv_assembler.word2hex_32bit(word) + "\n"
+                                                    for word in link_sources(MAIN.format(extra=""), lib.read_text()).pfm)
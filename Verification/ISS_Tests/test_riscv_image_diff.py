@@ -0,0 +1,63 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the gold/result image differ (Scripts/riscv_image_diff.py)    #
+########################################################################################
+
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_image_diff  # noqa: E402
+
+PROG_DIR = REPO_ROOT / "Verification" / "MCU_v2_Pipeline_Tests" / "prog_03"
+
+
+@pytest.fixture
+def test_dir(tmp_path):
+    for name in ("dfm_gold.bin", "dfm_sim_result.bin", "test_prog_03.asm"):
+        shutil.copy(PROG_DIR / name, tmp_path / name)
+    return tmp_path
+
+
+def test_packed_image_matches_text(test_dir):
+    path = str(test_dir / "dfm_sim_result.bin")
+    image = riscv_image_diff.PackedImage(path)
+    lines = (test_dir / "dfm_sim_result.bin").read_text().split()
+
+    assert image.mapping is not None
+    assert image.known.tolist() == ['x' not in line for line in lines]
+    assert [int(w) for w, k in zip(image.words, image.known) if k] == [int(l, 2) for l in lines if 'x' not in l]
+    #The text layout falls back to the line parser and gives the same arrays
+    words, known = riscv_image_diff.parse_memory_text(b'\r\n'.join(l.encode() for l in lines))
+    assert (words == image.words).all() and (known == image.known).all()
+
+
+def test_diff_reports_labelled_ranges(test_dir, capsys):
+    assert riscv_image_diff.diff_directory(str(test_dir)) == []
+
+    #Corrupt check_cnt (word 3) and make the word after it known
+    lines = (test_dir / "dfm_sim_result.bin").read_text().split()
+    lines[3] = format(6, '032b')
+    lines[4] = format(0, '032b')
+    (test_dir / "dfm_sim_result.bin").write_text(''.join(line + '\n' for line in lines))
+
+    assert riscv_image_diff.diff_directory(str(test_dir)) == ["0x1000000c-0x10000010 (check_cnt+0x0): 2 word(s) differ"]
+    assert riscv_image_diff.main([str(test_dir), "-q"]) == 1
+    assert "FAIL" in capsys.readouterr().out
+
+
+def test_parse_memory_lines():
+    #x/z anywhere in a binary word (also in the first two digits), only a real 0x prefix is stripped
+    text = "// comment\nx1" + "0" * 30 + "\n" + "1" * 32 + "\n0x1234abcd\n0X0000000z\n\n0xxxxxxxxx\n"
+    assert riscv_image_diff.parse_memory_lines(text) == [None, 0xFFFFFFFF, 0x1234ABCD, None, None]
+    words, known = riscv_image_diff.parse_memory_text(text.encode())
+    assert known.tolist() == [False, True, True, False, False] and words.tolist()[:3] == [0, 0xFFFFFFFF, 0x1234ABCD]
+    with pytest.raises(ValueError, match="Invalid memory word '0x12g4'"):
+        riscv_image_diff.parse_memory_lines("0x12g4\n")
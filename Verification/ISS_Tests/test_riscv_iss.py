@@ -0,0 +1,196 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the RV32I instruction set simulator (Scripts/riscv_iss.py)    #
+########################################################################################
+
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_iss  # noqa: E402
+
+ALU_PROGRAM = """
+.section .data
+a:   .word 7
+b:   .word 0xFFFFFFFD
+res: .space 8
+
+.section .text
+   lw    t0,         a(gp)
+   lw    t1,         b(gp)
+   add   t2,   t0,   t1
+   sub   t3,   t0,   t1
+   slt   t4,   t1,   t0
+   sltu  t5,   t1,   t0
+   addi  s3,   zero, 1
+   sra   s2,   t1,   s3
+   srai  s4,   t1,   1
+   srli  s5,   t1,   28
+   slli  s6,   t0,   4
+   addi  a1,   zero, -5
+   slti  a2,   a1,   -4
+   lui   a3,         0x12345000
+   addi  s7,   zero, 5
+loop:
+   addi  s7,   s7,   -1
+   bne   s7,   zero, loop
+   jal   ra,         func
+   sw    t2,         res(gp)
+halt:
+   jal   zero,       halt
+func:
+   addi  a0,   zero, 42
+   jalr  zero, ra,   0
+.section .end
+"""
+
+
+def reg(name):
+    return riscv_assembler.register_int[name]
+
+
+def test_alu_branches_and_jumps():
+    sim = riscv_iss.simulate(riscv_assembler.assemble(ALU_PROGRAM))
+    x = sim.x
+
+    assert sim.stop_reason == 'halt'
+    assert x[reg('gp')] == riscv_iss.GP_VALUE
+    assert x[reg('t2')] == 4
+    assert x[reg('t3')] == 10
+    assert (x[reg('t4')], x[reg('t5')]) == (1, 0)
+    assert x[reg('s2')] == x[reg('s4')] == 0xFFFFFFFE
+    assert x[reg('s5')] == 0xF
+    assert x[reg('s6')] == 112
+    assert x[reg('a1')] == 0xFFFFFFFB and x[reg('a2')] == 1
+    assert x[reg('a3')] == 0x12345000
+    assert x[reg('s7')] == 0
+    assert x[reg('a0')] == 42
+    assert sim.dfm[2] == 4 and sim.dfm_valid[2]
+
+
+def test_decode_matches_assembler_tables():
+    image = riscv_assembler.assemble(ALU_PROGRAM)
+    decoded = [riscv_iss.decode(word) for word in image.pfm]
+    mnemonics = [line.split()[0] for line in ALU_PROGRAM.splitlines()
+                 if line.startswith("   ") and not line.strip().startswith('.')]
+
+    assert [ins.mnemonic for ins in decoded] == ['lui', 'addi'] + mnemonics
+
+
+def test_dfm_result_format(tmp_path):
+    prog_dir = REPO_ROOT / "Verification" / "MCU_v2_Pipeline_Tests" / "prog_02"
+    sim = riscv_iss.Simulator.from_files(prog_dir / "pfm.hex", prog_dir / "dfm.bin")
+    assert sim.run() == 'halt'
+
+    sim.write_dfm_result(tmp_path / "dfm_sim_result.bin")
+    lines = (tmp_path / "dfm_sim_result.bin").read_text().splitlines()
+    assert len(lines) == riscv_iss.DFM_RESULT_WORDS
+    assert lines[:4] == (prog_dir / "dfm_gold.bin").read_text().splitlines()[:4]
+    assert lines[7] == 'x' * 32
+
+
+def run_both_modes(image, max_instructions):
+    results = []
+    for mode in ('step', 'block'):
+        sim = riscv_iss.Simulator.from_image(image)
+        sim.run(max_instructions, mode)
+        results.append(sim)
+    return results
+
+
+def test_block_mode_matches_step_mode():
+    sources = [ALU_PROGRAM] + [next(d.glob("*.asm")).read_text()
+                               for d in sorted((REPO_ROOT / "Verification" / "MCU_v2_Pipeline_Tests").glob("prog_*"))]
+    for source in sources:
+        #Odd limit so that the last block does not fit in the budget
+        step, block = run_both_modes(riscv_assembler.assemble(source), 20011)
+        assert (block.stop_reason, block.pc, block.instret) == (step.stop_reason, step.pc, step.instret)
+        assert block.x == step.x
+        assert block.dfm_result_lines() == step.dfm_result_lines()
+
+
+
+def test_halt_near_the_end_of_the_budget():
+    #gp init + 8 instructions + the halt jump retire 11 instructions: with the budgets from
+    #one block to one block + 9 the halt is found in the block loop, it must not step again
+    source = ".section .text\n" + "   addi  t0,   t0,   1\n" * 8 + "halt:\n   jal   zero,       halt\n.section .end\n"
+    image = riscv_assembler.assemble(source)
+    for max_instructions in (riscv_iss.MAX_BLOCK_LENGTH, riscv_iss.MAX_BLOCK_LENGTH + 9):
+        for mode in ('step', 'block', 'timing'):
+            sim = riscv_iss.Simulator.from_image(image)
+            assert sim.run(max_instructions, mode) == 'halt', mode
+            assert sim.instret == 11 and sim.x[reg('t0')] == 8, mode
+
+
+def test_jump_into_the_middle_of_a_block():
+    #'skip' is the entry of its own block and is also covered by the block of 'start'
+    source = """
+.section .text
+start:
+   addi  t0,   zero, 1
+   addi  t1,   zero, 2
+skip:
+   addi  t2,   t2,   1
+   beq   t2,   t1,   done
+   jal   zero,       skip
+done:
+   jal   zero,       done
+.section .end
+"""
+    step, block = run_both_modes(riscv_assembler.assemble(source), 1000)
+    assert block.stop_reason == step.stop_reason == 'halt'
+    assert block.instret == step.instret
+    assert block.x[riscv_assembler.register_int['t2']] == 2
+
+
+def test_patch_pfm_invalidates_cached_blocks():
+    image = riscv_assembler.assemble(".section .text\n   addi t0, zero, 1\nhalt:\n   jal zero, halt\n")
+    sim = riscv_iss.Simulator.from_image(image)
+    sim.run()
+    assert sim.x[5] == 1
+
+    #Replace 'addi t0, zero, 1' (third word) by 'addi t0, zero, 7' and run again
+    sim.patch_pfm(8, riscv_assembler.build_Itype_instr(['addi', 't0', 'zero', '7'], {}))
+    sim.pc = 0
+    sim.run()
+    assert sim.x[5] == 7
+
+
+TIMING_PROGRAM = """
+.section .data
+a:   .word 7
+
+.section .text
+   lw    t0,         a(gp)
+   add   t1,   t0,   t0
+halt:
+   jal   zero,       halt
+.section .end
+"""
+
+
+def test_timing_mode_counts_hazards():
+    sim = riscv_iss.Simulator.from_image(riscv_assembler.assemble(TIMING_PROGRAM))
+    assert sim.run(mode='timing') == 'halt'
+    timing = sim.timing
+
+    assert sim.x[reg('t1')] == 14
+    assert timing.instructions == 5
+    #add waits 1 cycle for lw, the halt jump flushes Decode/Execute, 4 cycles to fill
+    assert timing.stall_cycles == 1 and timing.flush_total == 2
+    assert timing.cycles == 5 + 1 + 2 + 4
+    assert (timing.forward_from_mem, timing.forward_from_wb) == (2, 2)
+    assert timing.stall_breakdown(sim.decoded) == [(0x10, 'jal', 1, 0, 2), (0x0c, 'add', 1, 1, 0)]
+
+
+def test_timing_mode_matches_step_mode():
+    image = riscv_assembler.assemble(ALU_PROGRAM)
+    step, timed = riscv_iss.Simulator.from_image(image), riscv_iss.Simulator.from_image(image)
+    step.run(mode='step')
+    timed.run(mode='timing')
+
+    assert (timed.x, timed.pc, timed.instret) == (step.x, step.pc, step.instret)
+    assert timed.timing.cpi > 1.0
@@ -0,0 +1,199 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the peripheral models (Scripts/riscv_peripherals.py)          #
+########################################################################################
+
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_iss  # noqa: E402
+import riscv_peripherals as periph  # noqa: E402
+
+TESTS_DIR = REPO_ROOT / "Verification" / "MCU_v2_Pipeline_Tests"
+
+TMR0_CTRL = periph.TMR0_BASE_ADDR
+TMR0_VAL = periph.TMR0_BASE_ADDR + 4
+TMR0_MATCH_VAL0 = periph.TMR0_BASE_ADDR + 8
+
+
+@pytest.mark.parametrize("prog", ["prog_01", "prog_02", "prog_03"])
+def test_peripheral_programs_match_gold(prog):
+    #The programs poll PWM/TMR flags, the results depend on the cycle timing
+    prog_dir = TESTS_DIR / prog
+    image = riscv_assembler.assemble_file(str(next(prog_dir.glob("*.asm"))))
+    sim = riscv_iss.Simulator.from_image(image)
+    sim.run(max_instructions=100000, mode='timing')
+
+    gold = (prog_dir / "dfm_gold.bin").read_text().split()
+    assert sim.dfm_result_lines()[:len(gold)] == gold
+
+
+def test_timer_next_event_predicts_match_flag():
+    mcu = periph.Mcu()
+    mcu.write(TMR0_MATCH_VAL0, 100, 10)
+    #on, start, clksrc = sys_clk/4
+    mcu.write(TMR0_CTRL, periph.TMR_ON | periph.TMR_START | (2 << 8), 12)
+
+    event = mcu.next_event(20)
+    assert 12 + 4 * 99 < event <= 12 + 4 * 101
+    assert not mcu.read(TMR0_CTRL, event - 1) & periph.TMR_MATCH0_F
+    assert mcu.read(TMR0_CTRL, event) & periph.TMR_MATCH0_F
+
+    #The flag stays set until it is cleared, there is no other event before the overflow
+    assert mcu.next_event(event + 1) > 1 << 32
+
+
+def test_timer_counts_dco_clock():
+    mcu = periph.Mcu()
+    #DCO toggles every 5 system clocks (period 10), the timer counts its rising edges
+    mcu.write(periph.DCO_BASE_ADDR + 4, 4, 0)
+    mcu.write(periph.DCO_BASE_ADDR, periph.DCO_ON, 1)
+    mcu.write(TMR0_CTRL, periph.TMR_ON | periph.TMR_START | (5 << 8), 2)
+    mcu.write(TMR0_CTRL, periph.TMR_ON | periph.TMR_RD | (5 << 8), 1003)
+
+    assert mcu.read(TMR0_VAL, 1005) in (99, 100)
+    #The software set only bits are hardware cleared and never read back
+    assert mcu.read(TMR0_CTRL, 1005) == periph.TMR_ON | (5 << 8)
+
+
+def test_low_power_mode_freezes_peripherals():
+    mcu = periph.Mcu()
+    mcu.write(TMR0_CTRL, periph.TMR_ON | periph.TMR_START, 0)
+    mcu.write(periph.CHIP_BASE_ADDR, periph.CHIP_LPM, 100)
+    mcu.write(periph.CHIP_BASE_ADDR, 0, 1100)
+    mcu.write(TMR0_CTRL, periph.TMR_ON | periph.TMR_RD, 1200)
+
+    assert 195 <= mcu.read(TMR0_VAL, 1202) <= 205
+
+
+def test_pwm_next_event_after_shadow_load():
+    mcu = periph.Mcu()
+    base = periph.PWM0_BASE_ADDR
+    #pr = 49, dc = 25, ph = 0, of = 17 loaded by ld_trg on the first period match
+    mcu.write(base + 8, 0x00190031, 0)
+    mcu.write(base + 12, 0x00110000, 1)
+    mcu.write(base, periph.PWM_ON | periph.PWM_LD_TRG, 2)
+    mcu.write(base, periph.PWM_ON, 10)
+
+    time = 10
+    ofm_reads = []
+    for _ in range(4):
+        time = mcu.next_event(time)
+        value = mcu.read(base, time)
+        if value & periph.PWM_OFM_F:
+            ofm_reads.append(time)
+            mcu.write(base, value & ~periph.PWM_OFM_F, time)
+        time += 1
+    assert [b - a for a, b in zip(ofm_reads, ofm_reads[1:])] == [50] * (len(ofm_reads) - 1)
+    assert len(ofm_reads) >= 2
+
+
+POLLING_PROGRAM = """
+.section .data
+match0: .word 100000
+match1: .word 250000
+count:  .space 4
+
+.section .text
+   lw    t0,         match0(gp)
+   sw    t0,         TMR0_MATCH_VAL0(zero)
+   addi  t0,   zero, 0x81
+   sw    t0,         TMR0_CTRL(zero)
+   lui   t3,         0x00002000
+wait0:
+   lw    t1,         TMR0_CTRL(zero)
+   and   t2,   t1,   t3
+   beq   t2,   zero, wait0
+   xor   t1,   t1,   t3
+   sw    t1,         TMR0_CTRL(zero)
+   lw    t0,         match1(gp)
+   sw    t0,         TMR0_MATCH_VAL0(zero)
+wait1:
+   lw    t1,         TMR0_CTRL(zero)
+   and   t2,   t1,   t3
+   beq   t2,   zero, wait1
+   ori   t1,   t1,   0x8
+   sw    t1,         TMR0_CTRL(zero)
+   lw    t1,         TMR0_VAL(zero)
+   sw    t1,         count(gp)
+halt:
+   jal   zero,       halt
+.section .end
+"""
+
+
+def run_both(image, mode):
+    results = []
+    for fast_forward in (False, True):
+        sim = riscv_iss.Simulator.from_image(image)
+        results.append((sim.run(max_instructions=1000000, mode=mode, fast_forward=fast_forward), sim))
+    assert results[0][0] == results[1][0]
+    return [sim for _, sim in results]
+
+
+def assert_same_run(slow, fast):
+    assert (fast.x, fast.pc, fast.instret, fast.cycle) == (slow.x, slow.pc, slow.instret, slow.cycle)
+    assert fast.dfm == slow.dfm
+    if slow.timing is not None:
+        for counter in ('executed', 'load_use_stalls', 'flush_cycles'):
+            assert getattr(fast.timing, counter) == getattr(slow.timing, counter)
+        assert fast.timing.cycles == slow.timing.cycles
+        assert ((fast.timing.forward_from_mem, fast.timing.forward_from_wb)
+                == (slow.timing.forward_from_mem, slow.timing.forward_from_wb))
+
+
+@pytest.mark.parametrize("mode", ["block", "timing"])
+def test_fast_forward_polling_loop_is_exact(mode):
+    image = riscv_assembler.assemble(POLLING_PROGRAM)
+    slow, fast = run_both(image, mode)
+    assert_same_run(slow, fast)
+
+    assert 250000 <= fast.dfm[2] < 250000 + 20
+    assert not slow.idle_loops.report()
+    loops = fast.idle_loops.loops
+    assert len(loops) == 2
+    #Almost the whole wait is skipped
+    assert sum(loop.cycles for loop in loops.values()) > 0.99 * fast.cycle
+    assert "cycles skipped" in fast.idle_loops.report()
+
+
+@pytest.mark.parametrize("prog", ["prog_01", "prog_02", "prog_03"])
+def test_fast_forward_keeps_gold_results(prog):
+    image = riscv_assembler.assemble_file(str(next((TESTS_DIR / prog).glob("*.asm"))))
+    slow, fast = run_both(image, 'timing')
+    assert_same_run(slow, fast)
+
+
+def test_find_idle_loops_rejects_side_effects():
+    source = """
+.section .data
+a:   .word 0
+
+.section .text
+poll:
+   lw    t1,         TMR0_CTRL(zero)
+   beq   t1,   zero, poll
+store:
+   lw    t1,         TMR0_CTRL(zero)
+   sw    t1,         a(gp)
+   beq   t1,   zero, store
+count:
+   lw    t1,         TMR0_CTRL(zero)
+   addi  t2,   t2,   1
+   beq   t1,   zero, count
+spin:
+   addi  t2,   zero, 1
+   bne   t2,   zero, spin
+.section .end
+"""
+    image = riscv_assembler.assemble(source)
+    sim = riscv_iss.Simulator.from_image(image)
+    heads = [loop.head * 4 for loop in sim.idle_loops.loops.values()]
+    #Only the pure polling loop qualifies (store, induction variable, no load)
+    assert heads == [image.symbol_table['poll']]
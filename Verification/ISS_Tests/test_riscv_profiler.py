@@ -0,0 +1,106 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the instruction level profiler (Scripts/riscv_profiler.py)    #
+########################################################################################
+
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_debug_map  # noqa: E402
+import riscv_iss  # noqa: E402
+import riscv_profiler  # noqa: E402
+
+LOOP_PROGRAM = """
+.section .data
+n:   .word 0
+
+.section .text
+main:
+   addi  t0,   zero, 10
+loop:
+   lw    t1,         n(gp)
+   add   t1,   t1,   t0
+   sw    t1,         n(gp)
+   addi  t0,   t0,   -1
+   bne   t0,   zero, loop
+done:
+   jal   zero,       done
+.section .end
+"""
+
+
+def profile_program(source, mode):
+    image = riscv_assembler.assemble(source)
+    sim = riscv_iss.Simulator.from_image(image)
+    sim.source_map = riscv_debug_map.SourceMap.from_image(image, "loop.asm")
+    sim.enable_profiling()
+    assert sim.run(mode=mode) == 'halt'
+    return riscv_profiler.Profile(sim)
+
+
+@pytest.mark.parametrize("mode", ["block", "step", "timing"])
+def test_execution_counts(mode):
+    profile = profile_program(LOOP_PROGRAM, mode)
+    #Prologue (lui/addi) + addi, 10 loop iterations of 5 instructions, the halt jump
+    assert profile.instructions == 3 + 50 + 1
+    assert [count for count in profile.executed[:9]] == [1, 1, 1, 10, 10, 10, 10, 10, 1]
+    assert [(start, end) for start, end, *_ in profile.hot_blocks()] == [(0x0c, 0x1c), (0x00, 0x08), (0x20, 0x20)]
+
+
+def test_timing_profile_attributes_stalls():
+    profile = profile_program(LOOP_PROGRAM, 'timing')
+    #add waits for lw every iteration, bne flushes 9 times and the halt jump once
+    assert profile.load_use_stalls[4] == 10
+    assert profile.flush_cycles[7] == 18 and profile.flush_cycles[8] == 2
+    assert profile.hot_labels()[0] == ('loop', 50, 50 + 10 + 18, 28)
+    assert profile.hot_pcs()[0] == (0x1c, 'bne', 10, 28, 0, 18)
+
+
+def test_folded_stacks(tmp_path):
+    profile = profile_program(LOOP_PROGRAM, 'block')
+    path = tmp_path / "loop.folded"
+    profile.write_folded(str(path))
+    lines = path.read_text().splitlines()
+    assert lines[0] == "loop.asm;(prologue);0x00000000;0x00000000_lui 1"
+    assert "loop.asm;loop;0x0000000c;0x00000010_add 10" in lines
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == profile.total_cycles
+
+
+POLLING_PROGRAM = """
+.section .data
+match0: .word 5000
+
+.section .text
+   lw    t0,         match0(gp)
+   sw    t0,         TMR0_MATCH_VAL0(zero)
+   addi  t0,   zero, 0x81
+   sw    t0,         TMR0_CTRL(zero)
+   lui   t3,         0x00002000
+wait0:
+   lw    t1,         TMR0_CTRL(zero)
+   and   t2,   t1,   t3
+   beq   t2,   zero, wait0
+halt:
+   jal   zero,       halt
+.section .end
+"""
+
+
+@pytest.mark.parametrize("mode", ["block", "timing"])
+def test_profile_counts_fast_forwarded_iterations(mode):
+    image = riscv_assembler.assemble(POLLING_PROGRAM)
+    counts = []
+    for fast_forward in (False, True):
+        sim = riscv_iss.Simulator.from_image(image)
+        sim.enable_profiling()
+        sim.run(max_instructions=100000, mode=mode, fast_forward=fast_forward)
+        counts.append(sim.executed_counts())
+    assert sim.idle_loops.report()
+    assert counts[0] == counts[1]
+    assert sum(counts[1]) == sim.instret
@@ -0,0 +1,47 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the constrained-random program generator                      #
+#              (Scripts/riscv_program_generator.py)                                    #
+########################################################################################
+
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_program_generator  # noqa: E402
+
+LAYOUT = ["dfm.bin", "dfm.hex", "dfm_gold.bin", "pfm.bin", "pfm.hex"]
+
+
+def test_program_depends_only_on_the_seed():
+    assert riscv_program_generator.generate_program(7) == riscv_program_generator.generate_program(7)
+    assert riscv_program_generator.generate_program(7) != riscv_program_generator.generate_program(8)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_generated_programs_halt(seed):
+    image = riscv_assembler.assemble(riscv_program_generator.generate_program(seed))
+    sim = riscv_program_generator.reference_run(image)
+    assert sim.instret < riscv_program_generator.MAX_INSTRUCTIONS
+
+
+def test_build_tests_in_parallel(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    results = riscv_program_generator.build_tests(range(4), str(first), jobs=2)
+    assert [(seed, error) for seed, error, _ in results] == [(seed, None) for seed in range(4)]
+
+    riscv_program_generator.build_tests(range(4), str(second), jobs=1)
+    for seed in range(4):
+        test_dir = first / f"prog_{seed:04d}"
+        assert sorted(path.name for path in test_dir.iterdir()) == LAYOUT + [f"test_prog_{seed:04d}.asm"]
+        assert len((test_dir / "dfm_gold.bin").read_text().splitlines()) == 1024
+        for path in test_dir.iterdir():
+            assert path.read_bytes() == (second / test_dir.name / path.name).read_bytes()
+
+    assert riscv_program_generator.main(["-n", "2", "-s", "10", "-o", str(tmp_path), "-j", "1"]) == 0
+    assert (tmp_path / "prog_0011" / "pfm.hex").exists()
@@ -0,0 +1,78 @@
+######################################## Header ########################################
+# Author: Vlad Rosu                                                                    #
+# Description: Tests for the binary execution traces (Scripts/riscv_trace.py)          #
+########################################################################################
+
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO_ROOT / "Scripts"))
+
+import riscv_assembler  # noqa: E402
+import riscv_iss  # noqa: E402
+import riscv_trace  # noqa: E402
+
+PROGRAM = """
+.section .data
+n:   .word 3
+sum: .space 4
+
+.section .text
+   lw    t0,         n(gp)
+loop:
+   add   t1,   t1,   t0
+   addi  t0,   t0,   -1
+   bne   t0,   zero, loop
+   sw    t1,         sum(gp)
+halt:
+   jal   zero,       halt
+.section .end
+"""
+
+
+def record_trace(path, mode='step', codec='zlib', chunk_records=riscv_trace.CHUNK_RECORDS):
+    sim = riscv_iss.Simulator.from_image(riscv_assembler.assemble(PROGRAM))
+    with riscv_trace.TraceWriter(str(path), codec, chunk_records) as writer:
+        sim.enable_trace(writer)
+        assert sim.run(mode=mode) == 'halt'
+    return sim
+
+
+@pytest.mark.parametrize("codec", sorted(riscv_trace.CODECS))
+def test_trace_records(tmp_path, codec):
+    path = tmp_path / "iss.rvt"
+    sim = record_trace(path, codec=codec, chunk_records=4)
+    records = list(riscv_trace.read_records(str(path)))
+
+    #One record per retired instruction, the block mode runs as step mode
+    assert len(records) == sim.instret == 2 + 1 + 3 * 3 + 2
+    load, store, halt = records[2], records[-2], records[-1]
+    assert load == (0x08, sim.pfm[2], 5, riscv_trace.TRACE_LOAD | riscv_trace.TRACE_RD_WRITE, 0,
+                    3, 0x10000000, 3)
+    assert store[3] == riscv_trace.TRACE_STORE and store[6:] == (0x10000004, 6)
+    assert halt[:4] == (0x1c, sim.pfm[7], 0, 0)
+
+
+def test_compare_reports_first_divergence(tmp_path):
+    iss, timed = tmp_path / "iss.rvt", tmp_path / "timed.rvt"
+    record_trace(iss)
+    record_trace(timed, mode='timing', codec='lzma', chunk_records=3)
+    assert riscv_trace.compare_traces(str(iss), str(timed)) is None
+
+    #RTL side trace written as plain records with a wrong rd data in record 6
+    records = list(riscv_trace.read_records(str(iss)))
+    rtl = tmp_path / "rtl.trace"
+    bad = list(records[6])
+    bad[5] ^= 0x10
+    rtl.write_bytes(b''.join(riscv_trace.RECORD.pack(*record) for record in records[:6] + [tuple(bad)] + records[7:]))
+    index, ref_record, rtl_record = riscv_trace.compare_traces(str(iss), str(rtl))
+    assert (index, ref_record, rtl_record) == (6, records[6], tuple(bad))
+    assert "wdata differ" in riscv_trace.divergence_report((index, ref_record, rtl_record))[0]
+
+    #Missing records at the end
+    rtl.write_bytes(b''.join(riscv_trace.RECORD.pack(*record) for record in records[:-1]))
+    assert riscv_trace.compare_traces(str(iss), str(rtl)) == (len(records) - 1, records[-1], None)
+    assert riscv_trace.main(["compare", str(iss), str(rtl)]) == 1